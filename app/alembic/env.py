@@ -1,7 +1,7 @@
 import asyncio
 from logging.config import fileConfig
 from models import Base
-from database import DATABASE_URL
+from database import get_database_url
 from sqlalchemy import pool
 from sqlalchemy.engine import Connection
 from sqlalchemy.ext.asyncio import async_engine_from_config, create_async_engine
@@ -14,7 +14,8 @@ config = context.config
 
 # Interpret the config file for Python logging.
 # This line sets up loggers basically.
-if config.config_file_name is not None:
+# An in-process upgrade (bootstrap.alembic_upgrade) keeps the application's logging.
+if config.config_file_name is not None and config.attributes.get("configure_logger", True):
     fileConfig(config.config_file_name)
 
 # add your model's MetaData object here
@@ -41,7 +42,7 @@ def run_migrations_offline() -> None:
     script output.
 
     """
-    url = DATABASE_URL
+    url = get_database_url()
     context.configure(
         url=url,
         target_metadata=target_metadata,
@@ -68,7 +69,7 @@ async def run_async_migrations() -> None:
     """
 
     connectable = create_async_engine(
-        DATABASE_URL,
+        get_database_url(),
         future=True,
         echo=False,
     )
@@ -0,0 +1,28 @@
+"""uservalues (user_id, value_name) index
+
+Revision ID: 3f2a9c41d7e5
+Revises: 890ddacb7b93
+Create Date: 2025-03-20 12:00:00.000000
+
+Run with ``alembic -x unique_values=true upgrade head`` to make the index
+unique, one value name per user. That fails if duplicates already exist.
+"""
+from typing import Sequence, Union
+
+from alembic import context, op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f2a9c41d7e5'
+down_revision: Union[str, None] = '890ddacb7b93'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    unique = context.get_x_argument(as_dictionary=True).get("unique_values", "false").lower() in ("1", "true", "yes")
+    op.create_index('ix_uservalues_user_id_value_name', 'uservalues', ['user_id', 'value_name'], unique=unique)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_uservalues_user_id_value_name', table_name='uservalues')
@@ -1,24 +1,187 @@
-from amplitude import Amplitude, BaseEvent
-from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import json
 import logging
+import os
+import time
+import uuid
+from dataclasses import dataclass, asdict
+from typing import List, Optional
+
+import aiohttp
 
 logger = logging.getLogger(__name__)
 
+AMPLITUDE_URL = "https://api2.amplitude.com/2/httpapi"
+_STOP = object()
+
+
+@dataclass
+class AnalyticsStats:
+    queued: int = 0
+    sent: int = 0
+    dropped: int = 0
+    spilled: int = 0
+    replayed: int = 0
+    failed_flushes: int = 0
+
+    def snapshot(self) -> dict:
+        return asdict(self)
+
 
 class AnalyticsService:
-    def __init__(self, api_key: str):
-        self.executor = ThreadPoolExecutor(max_workers=2)
-        self.client = Amplitude(api_key)
+    """Non-blocking Amplitude client.
+
+    ``track_event`` only puts the event on a bounded queue. A background task
+    sends batches to the HTTP API when ``batch_size`` events are waiting or
+    ``flush_interval`` seconds have passed. Batches that cannot be delivered
+    are appended to ``spill_path`` and re-sent after the next successful flush.
+    Every event carries an ``insert_id``, so Amplitude drops the copies a
+    replay sends of a batch it had in fact received.
+    """
+
+    def __init__(
+            self,
+            api_key: str,
+            endpoint: str = AMPLITUDE_URL,
+            queue_size: int = 10000,
+            batch_size: int = 100,
+            flush_interval: float = 5.0,
+            spill_path: Optional[str] = "analytics_spill.jsonl",
+            max_spill_bytes: int = 50 * 1024 * 1024,
+            timeout: float = 10.0
+    ):
+        self.api_key = api_key
+        self.endpoint = endpoint
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spill_path = spill_path
+        self.max_spill_bytes = max_spill_bytes
+        self.timeout = timeout
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.stats = AnalyticsStats()
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._task: Optional[asyncio.Task] = None
 
     def track_event(self, user_id: int, event_type: str, event_props: dict = None):
+        event = {
+            "user_id": str(user_id),
+            "event_type": event_type,
+            "event_properties": event_props or {},
+            "time": int(time.time() * 1000),
+            "insert_id": uuid.uuid4().hex
+        }
+        try:
+            self.queue.put_nowait(event)
+            self.stats.queued += 1
+        except asyncio.QueueFull:
+            self.stats.dropped += 1
+            logger.warning("Analytics queue is full, event dropped")
+
+    async def start(self):
+        self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Stop the flusher after delivering (or spilling) everything still queued"""
+        if self._task is not None:
+            await self.queue.put(_STOP)
+            await self._task
+            self._task = None
+        while not self.queue.empty():
+            await self._flush(self._drain(self.batch_size))
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _drain(self, limit: int) -> List[dict]:
+        batch = []
+        while len(batch) < limit and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        return [event for event in batch if event is not _STOP]
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            batch = [await self.queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and batch[-1] is not _STOP:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            stopping = batch[-1] is _STOP
+            if stopping:
+                batch.pop()
+            try:
+                await self._flush(batch)
+            except Exception:
+                # whatever went wrong, the next batch still gets its chance
+                logger.exception(f"Analytics flush of {len(batch)} events failed")
+                self.stats.failed_flushes += 1
+
+    async def _flush(self, batch: List[dict]):
+        if not batch:
+            return
+        if await self._send(batch):
+            self.stats.sent += len(batch)
+            await self._replay_spill()
+        else:
+            self.stats.failed_flushes += 1
+            await asyncio.to_thread(self._spill, batch)
+
+    async def _send(self, batch: List[dict]) -> bool:
+        payload = {"api_key": self.api_key, "events": batch, "options": {"min_id_length": 1}}
         try:
-            self.executor.submit(
-                self.client.track(
-                    BaseEvent(
-                        user_id=str(user_id),
-                        event_type=event_type,
-                        event_properties=event_props)
-                )
-            )
-        except Exception as e:
-            logger.error(f"Amplitude error: {e}")
+            async with self._session.post(self.endpoint, json=payload) as response:
+                if response.status == 200:
+                    return True
+                body = await response.text()
+                if response.status == 400:
+                    # Amplitude rejected the payload itself, retrying will not help
+                    logger.error(f"Amplitude rejected batch of {len(batch)}: {body[:200]}")
+                    self.stats.dropped += len(batch)
+                    return True
+                logger.warning(f"Amplitude responded {response.status}: {body[:200]}")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f"Amplitude error: {e}")
+        except Exception:
+            logger.exception("Amplitude send failed")
+        return False
+
+    def _spill(self, batch: List[dict]):
+        if not self.spill_path:
+            self.stats.dropped += len(batch)
+            return
+        try:
+            if os.path.exists(self.spill_path) and os.path.getsize(self.spill_path) > self.max_spill_bytes:
+                self.stats.dropped += len(batch)
+                return
+            with open(self.spill_path, "a", encoding="utf-8") as f:
+                for event in batch:
+                    f.write(json.dumps(event, ensure_ascii=False) + "\n")
+            self.stats.spilled += len(batch)
+        except OSError as e:
+            logger.error(f"Analytics spill error: {e}")
+            self.stats.dropped += len(batch)
+
+    def _take_spill(self) -> List[dict]:
+        if not self.spill_path or not os.path.exists(self.spill_path):
+            return []
+        replay_path = f"{self.spill_path}.replay"
+        os.replace(self.spill_path, replay_path)
+        with open(replay_path, encoding="utf-8") as f:
+            events = [json.loads(line) for line in f if line.strip()]
+        os.remove(replay_path)
+        return events
+
+    async def _replay_spill(self):
+        events = await asyncio.to_thread(self._take_spill)
+        for start in range(0, len(events), self.batch_size):
+            batch = events[start:start + self.batch_size]
+            if not await self._send(batch):
+                await asyncio.to_thread(self._spill, events[start:])
+                return
+            self.stats.replayed += len(batch)
@@ -0,0 +1,118 @@
+import logging
+from contextlib import nullcontext
+from io import BytesIO
+from typing import AsyncGenerator
+
+from aiogram import Bot
+from aiogram.types import InputFile
+
+from metrics import stage
+
+logger = logging.getLogger(__name__)
+
+# Telegram Bot API refuses to serve files bigger than 20 MB anyway
+DEFAULT_MAX_VOICE_BYTES = 20 * 1024 * 1024
+DEFAULT_MAX_SPEECH_BYTES = 10 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+
+class AudioTooLargeError(ValueError):
+    pass
+
+
+class BoundedBuffer(BytesIO):
+    """BytesIO that refuses to grow past ``limit`` bytes"""
+
+    def __init__(self, limit: int):
+        super().__init__()
+        self.limit = limit
+
+    def write(self, data) -> int:
+        if self.tell() + len(data) > self.limit:
+            raise AudioTooLargeError(f"Audio exceeds {self.limit} bytes")
+        return super().write(data)
+
+
+async def download_voice(bot: Bot, file_id: str, limit: int = DEFAULT_MAX_VOICE_BYTES) -> BytesIO:
+    """Download a Telegram file into memory, rewound and ready to upload"""
+    with stage("telegram_download"):
+        file = await bot.get_file(file_id)
+        if file.file_size and file.file_size > limit:
+            raise AudioTooLargeError(f"Audio exceeds {limit} bytes")
+        buffer = BoundedBuffer(limit)
+        await bot.download_file(file.file_path, destination=buffer, chunk_size=CHUNK_SIZE)
+    return buffer
+
+
+class SpeechInputFile(InputFile):
+    """Telegram upload fed directly from the OpenAI TTS response stream.
+
+    Nothing is synthesized until aiogram starts sending the request, and
+    chunks go to Telegram as soon as OpenAI produces them.
+    """
+
+    def __init__(
+            self,
+            client,
+            text: str,
+            model: str = "tts-1",
+            voice: str = "nova",
+            limit: int = DEFAULT_MAX_SPEECH_BYTES,
+            filename: str = "response.ogg",
+            chunk_size: int = CHUNK_SIZE,
+            response_format: str = "opus",
+            scheduler=None,
+            user_id=None,
+            on_complete=None
+    ):
+        super().__init__(filename=filename, chunk_size=chunk_size)
+        self.client = client
+        self.text = text
+        self.model = model
+        self.voice = voice
+        self.limit = limit
+        self.response_format = response_format
+        self.scheduler = scheduler
+        self.user_id = user_id
+        self.on_complete = on_complete
+
+    async def read(self, bot: Bot) -> AsyncGenerator[bytes, None]:
+        size = 0
+        chunks = [] if self.on_complete is not None else None
+        slot = self.scheduler.slot("tts", self.user_id) if self.scheduler is not None else nullcontext()
+        async with slot, self.client.audio.speech.with_streaming_response.create(
+                model=self.model,
+                voice=self.voice,
+                input=self.text,
+                response_format=self.response_format
+        ) as response:
+            async for chunk in response.iter_bytes(self.chunk_size):
+                size += len(chunk)
+                if size > self.limit:
+                    raise AudioTooLargeError(f"Speech exceeds {self.limit} bytes")
+                if chunks is not None:
+                    chunks.append(chunk)
+                yield chunk
+        if chunks is not None:
+            await self.on_complete(b"".join(chunks))
+
+
+async def synthesize_speech(
+        client,
+        text: str,
+        model: str = "tts-1",
+        voice: str = "nova",
+        limit: int = DEFAULT_MAX_SPEECH_BYTES,
+        response_format: str = "opus"
+) -> bytes:
+    """Synthesize ``text`` fully into memory, refusing results bigger than ``limit``"""
+    buffer = BoundedBuffer(limit)
+    async with client.audio.speech.with_streaming_response.create(
+            model=model,
+            voice=voice,
+            input=text,
+            response_format=response_format
+    ) as response:
+        async for chunk in response.iter_bytes(CHUNK_SIZE):
+            buffer.write(chunk)
+    return buffer.getvalue()
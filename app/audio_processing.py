@@ -0,0 +1,204 @@
+import asyncio
+import logging
+import resource
+import shutil
+from array import array
+from dataclasses import dataclass, asdict
+from typing import List
+
+import ffmpeg
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_WIDTH = 2  # s16le
+FRAME_SECONDS = 0.02
+
+
+class FFmpegError(RuntimeError):
+    pass
+
+
+def _children_cpu() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _quiet(cmd: List[str]) -> List[str]:
+    # global options must come before the first input, ffmpeg ignores trailing ones
+    return [cmd[0], "-nostdin", "-loglevel", "error", *cmd[1:]]
+
+
+def _decode_cmd(binary: str, sample_rate: int, silence_db: int, min_silence: float) -> List[str]:
+    # drop leading silence, and every pause longer than min_silence down to min_silence
+    trim = (f"silenceremove=start_periods=1:start_threshold={silence_db}dB:"
+            f"stop_periods=-1:stop_duration={min_silence}:stop_threshold={silence_db}dB:stop_silence={min_silence}")
+    return _quiet(
+        ffmpeg.input("pipe:0")
+        .output("pipe:1", format="s16le", acodec="pcm_s16le", ac=1, ar=sample_rate, af=trim)
+        .compile(cmd=binary)
+    )
+
+
+def _opus_cmd(binary: str, sample_rate: int, bitrate: str) -> List[str]:
+    return _quiet(
+        ffmpeg.input("pipe:0", format="s16le", ac=1, ar=sample_rate)
+        .output("pipe:1", format="ogg", acodec="libopus", audio_bitrate=bitrate, application="voip")
+        .compile(cmd=binary)
+    )
+
+
+def _quietest_cut(pcm: array, target: int, window: int, frame: int) -> int:
+    """Sample index of the quietest frame within ``window`` samples of ``target``"""
+    best, best_energy = target, sum(abs(sample) for sample in pcm[target:target + frame])
+    for start in range(max(0, target - window), min(len(pcm) - frame, target + window), frame):
+        energy = sum(abs(sample) for sample in pcm[start:start + frame])
+        if energy < best_energy:
+            best, best_energy = start, energy
+    return best
+
+
+def split_pcm(pcm: bytes, sample_rate: int, chunk_seconds: float, search_seconds: float = 1.0) -> List[bytes]:
+    """Split mono s16le audio into chunks of about ``chunk_seconds``, cutting at the quietest nearby frame"""
+    samples = array("h", pcm)
+    chunk, window = int(chunk_seconds * sample_rate), int(search_seconds * sample_rate)
+    frame = int(FRAME_SECONDS * sample_rate)
+    parts, start = [], 0
+    while len(samples) - start > chunk + window:
+        cut = _quietest_cut(samples, start + chunk, window, frame)
+        parts.append(samples[start:cut].tobytes())
+        start = cut
+    parts.append(samples[start:].tobytes())
+    return parts
+
+
+@dataclass
+class AudioStats:
+    voice_messages: int = 0
+    input_bytes: int = 0
+    output_bytes: int = 0
+    output_seconds: float = 0.0
+    chunks: int = 0
+    pcm_decoded: int = 0
+    speech_encoded: int = 0
+    cpu_seconds: float = 0.0
+    failures: int = 0
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.input_bytes - self.output_bytes
+
+    def snapshot(self) -> dict:
+        return {
+            **asdict(self),
+            "bytes_saved": self.bytes_saved,
+            "output_seconds": round(self.output_seconds, 1),
+            "cpu_seconds": round(self.cpu_seconds, 3)
+        }
+
+
+class AudioProcessor:
+    """ffmpeg stage for voice input and synthesized replies.
+
+    ffmpeg runs as a subprocess of the event loop, at most ``workers`` at a
+    time, so no transcode blocks the loop and nothing else has to be
+    started or imported for it. Splitting long PCM into chunks runs in a
+    thread, and the chunks are encoded concurrently. Audio goes through stdin/stdout pipes, never
+    temp files. Without an ffmpeg binary, ``available`` is False and callers
+    send audio as is.
+    """
+
+    def __init__(
+            self,
+            workers: int = 2,
+            sample_rate: int = 16000,
+            chunk_seconds: float = 120,
+            silence_db: int = -45,
+            min_silence: float = 0.7,
+            bitrate: str = "24k",
+            speech_sample_rate: int = 24000,
+            speech_bitrate: str = "32k",
+            binary: str = "ffmpeg",
+            timeout: float = 120
+    ):
+        self.workers = workers
+        self.sample_rate = sample_rate
+        self.chunk_seconds = chunk_seconds
+        self.silence_db = silence_db
+        self.min_silence = min_silence
+        self.bitrate = bitrate
+        self.speech_sample_rate = speech_sample_rate
+        self.speech_bitrate = speech_bitrate
+        self.binary = shutil.which(binary)
+        self.timeout = timeout
+        self.stats = AudioStats()
+        self._slots = asyncio.Semaphore(max(1, workers))
+        # CPU of the ffmpeg children reaped so far, each child is counted once
+        self._cpu_seen = _children_cpu()
+
+    @property
+    def available(self) -> bool:
+        return self.binary is not None and self.workers > 0
+
+    async def _run(self, cmd: List[str], data: bytes) -> bytes:
+        async with self._slots:
+            process = await asyncio.create_subprocess_exec(
+                *cmd, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+            )
+            try:
+                stdout, stderr = await asyncio.wait_for(process.communicate(data), self.timeout)
+            except asyncio.TimeoutError:
+                raise FFmpegError(f"ffmpeg timed out after {self.timeout}s")
+            finally:
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+                cpu = _children_cpu()
+                self.stats.cpu_seconds += cpu - self._cpu_seen
+                self._cpu_seen = cpu
+        if process.returncode != 0:
+            raise FFmpegError(stderr.decode(errors="replace")[-500:])
+        return stdout
+
+    async def _decode(self, data: bytes, sample_rate: int) -> bytes:
+        return await self._run(_decode_cmd(self.binary, sample_rate, self.silence_db, self.min_silence), data)
+
+    async def prepare_voice(self, data: bytes) -> List[bytes]:
+        """16 kHz mono Opus chunks of ``data`` with silence trimmed, or ``[data]`` if that fails"""
+        self.stats.voice_messages += 1
+        self.stats.input_bytes += len(data)
+        try:
+            pcm = await self._decode(data, self.sample_rate)
+            encode = _opus_cmd(self.binary, self.sample_rate, self.bitrate)
+            # the split scans every sample in Python, too long for the event loop on a long note
+            parts = await asyncio.to_thread(split_pcm, pcm, self.sample_rate, self.chunk_seconds) if pcm else []
+            # each encode takes a worker slot in _run, so at most ``workers`` of them run at once
+            chunks = list(await asyncio.gather(*(self._run(encode, part) for part in parts)))
+        except Exception as e:
+            logger.warning(f"Voice preprocessing failed, sending original: {e}")
+            self.stats.failures += 1
+            self.stats.output_bytes += len(data)
+            return [data]
+        if not chunks:
+            # nothing but silence; let Whisper have the original rather than sending nothing
+            chunks = [data]
+        self.stats.output_bytes += sum(len(chunk) for chunk in chunks)
+        self.stats.output_seconds += len(pcm) / SAMPLE_WIDTH / self.sample_rate
+        self.stats.chunks += len(chunks)
+        return chunks
+
+    async def decode_pcm(self, data: bytes, sample_rate: int = 24000) -> bytes:
+        """Mono s16le of ``data`` with silence trimmed, for APIs that take raw PCM; raises ``FFmpegError``"""
+        try:
+            pcm = await self._decode(data, sample_rate)
+        except Exception:
+            self.stats.failures += 1
+            raise
+        self.stats.pcm_decoded += 1
+        self.stats.output_seconds += len(pcm) / SAMPLE_WIDTH / sample_rate
+        return pcm
+
+    async def encode_opus(self, pcm: bytes) -> bytes:
+        """Ogg/Opus voice from 24 kHz mono s16le TTS output"""
+        data = await self._run(_opus_cmd(self.binary, self.speech_sample_rate, self.speech_bitrate), pcm)
+        self.stats.speech_encoded += 1
+        return data
@@ -0,0 +1,8 @@
+"""Offline benchmarks. Run from the ``app`` directory: ``python -m benchmarks.<name>``"""
+import os
+
+# Benchmarks never talk to the real services, but config.Settings insists on these
+for _name in ("BOT_TOKEN", "OPENAI_API_KEY", "ASSISTANT_ID", "POSTGRES_USER", "POSTGRES_PASSWORD",
+              "POSTGRES_DB", "POSTGRES_HOST", "AMPLITUDE_API_KEY"):
+    os.environ.setdefault(_name, "benchmark")
+os.environ.setdefault("POSTGRES_PORT", "5432")
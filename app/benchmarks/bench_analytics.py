@@ -0,0 +1,99 @@
+"""Handler latency with analytics off, on, and with the collector down.
+
+    python -m benchmarks.bench_analytics --events 5000 --collector-latency 0.2
+"""
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+
+from aiohttp import web
+
+from analytics import AnalyticsService
+from benchmarks.common import LoopLagMonitor, summarize
+
+
+class FakeCollector:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.events = 0
+        self.batches = 0
+        self.down = False
+
+    async def handle(self, request: web.Request):
+        if self.down:
+            return web.Response(status=503)
+        payload = await request.json()
+        await asyncio.sleep(self.latency)
+        self.events += len(payload["events"])
+        self.batches += 1
+        return web.json_response({"code": 200})
+
+    async def start(self, port: int) -> web.AppRunner:
+        app = web.Application()
+        app.router.add_post("/2/httpapi", self.handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", port).start()
+        return runner
+
+
+async def handler(analytics, n):
+    """Shape of a bot handler: some awaited work, then an analytics event"""
+    started = time.perf_counter()
+    await asyncio.sleep(0.001)
+    if analytics is not None:
+        analytics.track_event(user_id=n, event_type="voice_message", event_props={"length": n})
+    return time.perf_counter() - started
+
+
+async def run(name, analytics, args):
+    async with LoopLagMonitor() as monitor:
+        latencies = await asyncio.gather(*(handler(analytics, n) for n in range(args.events)))
+    print(f"{name:>14}: {summarize(latencies)} {monitor.report()}")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=5000)
+    parser.add_argument("--collector-latency", type=float, default=0.2)
+    parser.add_argument("--port", type=int, default=18765)
+    args = parser.parse_args()
+    logging.getLogger("analytics").setLevel(logging.CRITICAL)
+
+    collector = FakeCollector(args.collector_latency)
+    runner = await collector.start(args.port)
+    url = f"http://127.0.0.1:{args.port}/2/httpapi"
+    with tempfile.TemporaryDirectory() as workdir:
+        spill = os.path.join(workdir, "spill.jsonl")
+        try:
+            await run("warmup", None, args)
+            await run("disabled", None, args)
+
+            analytics = AnalyticsService("key", endpoint=url, flush_interval=0.5, spill_path=spill)
+            await analytics.start()
+            await run("enabled", analytics, args)
+            await analytics.close()
+            print(f"{'':>14}  collector got {collector.events} events in {collector.batches} batches")
+
+            collector.down = True
+            analytics = AnalyticsService("key", endpoint=url, flush_interval=0.5, spill_path=spill)
+            await analytics.start()
+            await run("collector down", analytics, args)
+            await analytics.close()
+            collector.down = False
+            print(f"{'':>14}  {analytics.stats.snapshot()}")
+
+            analytics = AnalyticsService("key", endpoint=url, flush_interval=0.5, spill_path=spill)
+            await analytics.start()
+            analytics.track_event(user_id=1, event_type="recovered")
+            await analytics.close()
+            print(f"{'':>14}  after recovery: {analytics.stats.snapshot()}")
+        finally:
+            await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
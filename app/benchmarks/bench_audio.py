@@ -0,0 +1,82 @@
+"""ffmpeg stage cost and savings: CPU time per message, bytes and Whisper seconds saved, MP3 vs Opus replies.
+
+    python -m benchmarks.bench_audio --messages 20 --seconds 45 --pause-share 0.3
+
+Needs an ffmpeg binary with libopus and libmp3lame. Voice notes are synthetic:
+tone bursts separated by pauses, encoded as 48 kHz Ogg/Opus like Telegram's.
+"""
+import argparse
+import asyncio
+import math
+import random
+import subprocess
+import sys
+import time
+from array import array
+
+from audio_processing import AudioProcessor
+from benchmarks.common import LoopLagMonitor, summarize
+
+
+def speechlike_pcm(seconds: float, pause_share: float, rate: int) -> bytes:
+    samples = array("h")
+    while len(samples) < seconds * rate:
+        burst = random.uniform(0.3, 2.0)
+        pitch = random.uniform(120, 300)
+        samples.extend(int(8000 * math.sin(2 * math.pi * pitch * n / rate) * (0.6 + 0.4 * math.sin(n / 800)))
+                       for n in range(int(burst * rate)))
+        if random.random() < pause_share:
+            samples.extend([0] * int(random.uniform(0.8, 3.0) * rate))
+    return samples.tobytes()
+
+
+def encode(pcm: bytes, rate: int, *output) -> bytes:
+    cmd = ["ffmpeg", "-nostdin", "-loglevel", "error", "-f", "s16le", "-ac", "1", "-ar", str(rate), "-i", "pipe:0",
+           *output, "pipe:1"]
+    return subprocess.run(cmd, input=pcm, stdout=subprocess.PIPE, check=True).stdout
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--seconds", type=float, default=45, help="length of each voice note")
+    parser.add_argument("--pause-share", type=float, default=0.3)
+    parser.add_argument("--chunk-seconds", type=float, default=20)
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args()
+
+    processor = AudioProcessor(workers=args.workers, chunk_seconds=args.chunk_seconds)
+    if not processor.available:
+        sys.exit("ffmpeg not found")
+
+    notes = [encode(speechlike_pcm(args.seconds, args.pause_share, 48000), 48000, "-c:a", "libopus", "-b:a", "32k",
+                    "-f", "ogg") for _ in range(args.messages)]
+    await processor.prepare_voice(notes[0])  # warm the page cache for the ffmpeg binary
+    processor.stats = type(processor.stats)()
+
+    latencies = []
+
+    async def one(note):
+        started = time.perf_counter()
+        await processor.prepare_voice(note)
+        latencies.append(time.perf_counter() - started)
+
+    async with LoopLagMonitor() as monitor:
+        await asyncio.gather(*(one(note) for note in notes))
+    stats = processor.stats
+    billed = args.seconds * args.messages
+    print(f"voice: {summarize(latencies)} {monitor.report()}")
+    print(f"       cpu per message={stats.cpu_seconds / args.messages * 1000:.1f}ms "
+          f"bytes {stats.input_bytes // 1024}KB -> {stats.output_bytes // 1024}KB (saved {stats.bytes_saved // 1024}KB), "
+          f"whisper seconds {billed:.0f} -> {stats.output_seconds:.0f}, chunks={stats.chunks}")
+
+    speech = [speechlike_pcm(random.uniform(5, 20), 0.1, 24000) for _ in range(args.messages)]
+    mp3 = sum(len(encode(pcm, 24000, "-c:a", "libmp3lame", "-b:a", "64k", "-f", "mp3")) for pcm in speech)
+    processor.stats = type(processor.stats)()
+    opus = sum(len(data) for data in await asyncio.gather(*(processor.encode_opus(pcm) for pcm in speech)))
+    print(f"reply: mp3 64k {mp3 // 1024}KB vs opus {processor.speech_bitrate} {opus // 1024}KB, "
+          f"cpu per reply={processor.stats.cpu_seconds / args.messages * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,59 @@
+"""Fire interleaved value requests from many users and check for cross-talk.
+
+    python -m benchmarks.bench_conversations --users 50 --messages 10
+"""
+import argparse
+import asyncio
+import random
+import sys
+import time
+
+from benchmarks.common import summarize
+from benchmarks.fakes import FakeOpenAI, FakeSessionFactory, unlimited_scheduler
+from openai_client import OpenAIService, process_assistant_response
+from value_writer import ValueWriter
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=10, help="messages per user")
+    parser.add_argument("--latency", type=float, default=0.01)
+    args = parser.parse_args()
+
+    fake = FakeOpenAI(latency=args.latency)
+    sessions = FakeSessionFactory()
+    service = OpenAIService("asst_benchmark", "sk-benchmark", scheduler=unlimited_scheduler(),
+                            value_writer=ValueWriter(sessions))
+    service.client = fake
+
+    jobs = [(user_id, n) for user_id in range(args.users) for n in range(args.messages)]
+    random.shuffle(jobs)
+    latencies = []
+
+    async def one(user_id, n):
+        started = time.perf_counter()
+        text, _ = await process_assistant_response(
+            user_id=user_id,
+            client_ai=service,
+            input_text=f"my value number {n} from user {user_id}"
+        )
+        latencies.append(time.perf_counter() - started)
+        return text
+
+    started = time.perf_counter()
+    replies = await asyncio.gather(*(one(*job) for job in jobs))
+    elapsed = time.perf_counter() - started
+
+    crossed = [row for row in sessions.rows if not row.description.endswith(f"from user {row.user_id}")]
+    failed = [reply for reply in replies if reply != "✅ Ценность сохранена!"]
+    print(f"requests: {len(jobs)} in {elapsed:.2f}s ({len(jobs) / elapsed:.1f} req/s)")
+    print(f"latency: {summarize(latencies)}")
+    print(f"rows saved: {len(sessions.rows)}, misattributed rows: {len(crossed)}, "
+          f"mismatched tool outputs: {len(fake.errors)}, failed replies: {len(failed)}")
+    if crossed or fake.errors or failed or len(sessions.rows) != len(jobs):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
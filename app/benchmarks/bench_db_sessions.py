@@ -0,0 +1,72 @@
+"""Database connections held per in-flight message: session around the whole flow vs around the write.
+
+    python -m benchmarks.bench_db_sessions --messages 200 --latency 0.2
+"""
+import argparse
+import asyncio
+import time
+
+from benchmarks.common import summarize
+from benchmarks.fakes import FakeOpenAI, FakeSessionFactory, unlimited_scheduler
+from models import UserValue
+from openai_client import Conversation, OpenAIService, process_assistant_response
+from validation import ValueValidator
+from value_writer import ValueWriter
+
+
+async def whole_flow_session(user_id, client_ai, input_text):
+    """The previous ``process_assistant_response``: one session held across every OpenAI call"""
+    conversation = Conversation(user_id=user_id)
+    async with client_ai.validator.session_factory() as session:
+        result = await client_ai.identify_value(input_text, conversation)
+        call = result["function_call"]
+        args = call["arguments"]
+        valid = await client_ai.validator.validate(args["description"], client_ai, user_id, session, args["name"])
+        if valid:
+            session.add(UserValue(user_id=user_id, value_name=args["name"], description=args["description"]))
+            await session.commit()
+        await client_ai.submit_result(conversation.thread_id, conversation.run_id, valid, call["id"], user_id)
+        await client_ai.release_tool_run(conversation)
+
+
+async def scoped_session(user_id, client_ai, input_text):
+    await process_assistant_response(user_id=user_id, client_ai=client_ai, input_text=input_text)
+
+
+async def run(name, flow, args):
+    sessions = FakeSessionFactory(latency=args.db_latency)
+    service = OpenAIService("asst_benchmark", "sk-benchmark", scheduler=unlimited_scheduler(),
+                            validator=ValueValidator(session_factory=sessions),
+                            value_writer=ValueWriter(sessions))
+    service.client = FakeOpenAI(latency=args.latency)
+
+    latencies = []
+
+    async def one(n):
+        started = time.perf_counter()
+        await flow(n, service, f"my value is honesty with people close to me, message {n}")
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(n) for n in range(args.messages)))
+    elapsed = time.perf_counter() - started
+    print(f"{name:>18}: {summarize(latencies)}")
+    print(f"{'':>18}  peak connections={sessions.peak_sessions} for {args.messages} in-flight messages, "
+          f"avg connections held={sessions.held_seconds / elapsed:.1f}, "
+          f"held per message={sessions.held_seconds / args.messages * 1000:.1f}ms, "
+          f"rows={len(sessions.rows)}")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.2, help="OpenAI call latency")
+    parser.add_argument("--db-latency", type=float, default=0.002)
+    args = parser.parse_args()
+
+    await run("whole-flow session", whole_flow_session, args)
+    await run("scoped session", scoped_session, args)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
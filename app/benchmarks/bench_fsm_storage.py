@@ -0,0 +1,126 @@
+"""FSM storage against a local Redis: the stock RedisStorage versus the near-cache storage.
+
+    python -m benchmarks.bench_fsm_storage --redis-url redis://localhost:6379/15 --updates 20000
+
+Each simulated update does what the router does for a text message: the
+FSM middleware reads the state, the handler reads the data and a share of
+updates writes it back. Users are picked with Zipf-like popularity, so a
+few are hot. A second client plays another bot process and moves hot
+users to new FSM states; a read that returns a state older than one set
+a few milliseconds before it started counts as stale. The database given
+is flushed first, and keyspace notifications are enabled on the server.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.redis import RedisStorage
+from redis.asyncio import Redis
+
+from benchmarks.common import percentile, summarize
+from storage import create_redis, NearCacheRedisStorage, pack_data
+
+SAMPLE_DATA = {
+    "thread_id": "thread_abc123def456ghi789jkl012",
+    "thread_active_at": 1760000000.123456,
+    "values_page": 2,
+    "last_mood": "нейтральное"
+}
+
+
+def storages(args):
+    return {
+        "stock RedisStorage, JSON": lambda: RedisStorage(Redis.from_url(args.redis_url)),
+        "msgpack + batched writes": lambda: NearCacheRedisStorage(
+            create_redis(args.redis_url, args.max_connections), near_cache_items=0),
+        "msgpack + batched writes + near-cache": lambda: NearCacheRedisStorage(
+            create_redis(args.redis_url, args.max_connections), near_cache_items=args.near_cache_items,
+            configure_keyspace_events=True),
+    }
+
+
+async def workload(storage, args, users, weights):
+    update_ids = iter(range(args.updates))
+    latencies, stale, operations = [], 0, 0
+    # user -> (step, completion time) of the last state set by the other process
+    written = {}
+
+    async def worker():
+        nonlocal stale, operations
+        for _ in update_ids:
+            user = random.choices(users, weights)[0]
+            key = StorageKey(bot_id=1, chat_id=user, user_id=user)
+            started = time.perf_counter()
+            state = await storage.get_state(key)
+            await storage.get_data(key)
+            operations += 2
+            if random.random() < args.write_share:
+                await storage.update_data(key, {"thread_active_at": time.time()})
+                operations += 2
+            latencies.append(time.perf_counter() - started)
+            number, at = written.get(user, (0, started))
+            # a write that finished shortly before the read may still be on its way as a notification
+            if int(state.rpartition("step")[2] if state else 0) < number and at < started - args.notification_slack:
+                stale += 1
+
+    async def other_process(redis: Redis):
+        count = 0
+        while True:
+            await asyncio.sleep(args.foreign_interval)
+            user = random.choices(users, weights)[0]
+            count += 1
+            await redis.set(f"fsm:{user}:{user}:state", f"Form:step{count}")
+            written[user] = (count, time.perf_counter())
+
+    other = Redis.from_url(args.redis_url)
+    foreign = asyncio.create_task(other_process(other))
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+    foreign.cancel()
+    await asyncio.gather(foreign, return_exceptions=True)
+    await other.aclose()
+    return latencies, operations, elapsed, stale
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--redis-url", default="redis://localhost:6379/15")
+    parser.add_argument("--updates", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--write-share", type=float, default=0.3)
+    parser.add_argument("--foreign-interval", type=float, default=0.01,
+                        help="seconds between writes of the other process")
+    parser.add_argument("--notification-slack", type=float, default=0.005,
+                        help="seconds a foreign write may take to reach the near-cache before a read counts as stale")
+    parser.add_argument("--max-connections", type=int, default=64)
+    parser.add_argument("--near-cache-items", type=int, default=10000)
+    args = parser.parse_args()
+
+    print(f"payload: JSON {len(json.dumps(SAMPLE_DATA).encode())} bytes, "
+          f"msgpack {len(pack_data(SAMPLE_DATA))} bytes")
+    users = list(range(1, args.users + 1))
+    weights = [1 / rank for rank in users]
+    for name, make in storages(args).items():
+        setup = Redis.from_url(args.redis_url)
+        await setup.flushdb()
+        await setup.aclose()
+        storage = make()
+        if isinstance(storage, NearCacheRedisStorage):
+            await storage.start()
+        random.seed(3)
+        latencies, operations, elapsed, stale = await workload(storage, args, users, weights)
+        print(f"{name}: {len(latencies) / elapsed:.0f} updates/s, {operations / elapsed:.0f} ops/s, "
+              f"p99={percentile(latencies, 99) * 1000:.2f}ms, stale reads={stale}")
+        print(f"    {summarize(latencies)}")
+        if isinstance(storage, NearCacheRedisStorage):
+            print(f"    {storage.stats.snapshot()}")
+        await storage.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
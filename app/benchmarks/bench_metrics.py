@@ -0,0 +1,59 @@
+"""Cost of the instrumentation: a stage timer, the update middleware and one /metrics scrape.
+
+    python -m benchmarks.bench_metrics --iterations 100000
+"""
+import argparse
+import asyncio
+import time
+from datetime import datetime
+
+import aiohttp
+from aiogram.types import Chat, Message, Update, User
+
+from metrics import MetricsMiddleware, stage, start_metrics_server
+
+
+def make_update(n: int) -> Update:
+    user = User(id=n, is_bot=False, first_name="bench")
+    message = Message(message_id=n, date=datetime.now(), chat=Chat(id=n, type="private"), from_user=user, text="hi")
+    return Update(update_id=n, message=message)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=100000)
+    parser.add_argument("--port", type=int, default=9109)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    for _ in range(args.iterations):
+        with stage("tool_call"):
+            pass
+    print(f"stage timer: {(time.perf_counter() - started) / args.iterations * 1e6:.2f}us per block")
+
+    async def handler(event, data):
+        return None
+
+    middleware = MetricsMiddleware()
+    update = make_update(1)
+    started = time.perf_counter()
+    for _ in range(args.iterations):
+        await middleware(handler, update, {})
+    print(f"middleware:  {(time.perf_counter() - started) / args.iterations * 1e6:.2f}us per update")
+
+    class Stats:
+        def snapshot(self):
+            return {"hits": 10, "misses": 2, "nested": {"queued": 1}}
+
+    runner = await start_metrics_server("127.0.0.1", args.port, components={"bench": Stats()})
+    async with aiohttp.ClientSession() as http:
+        started = time.perf_counter()
+        async with http.get(f"http://127.0.0.1:{args.port}/metrics") as response:
+            body = await response.text()
+        print(f"scrape:      {(time.perf_counter() - started) * 1000:.2f}ms, {len(body)} bytes, "
+              f"status={response.status} {response.headers['Content-Type']}")
+    await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,240 @@
+"""Replay an update mix through the real router against local OpenAI and Telegram stubs.
+
+    python -m benchmarks.bench_replay --updates 300 --users 40 --mix text=0.5,voice=0.3,photo=0.1,command=0.1
+    python -m benchmarks.bench_replay --record mix.jsonl       # keep the synthetic mix
+    python -m benchmarks.bench_replay --replay mix.jsonl       # raw updates, e.g. dumped from getUpdates
+    python -m benchmarks.bench_replay --serve &                # stubs in their own process...
+    python -m benchmarks.bench_replay --external               # ...so they do not share the bot's CPU
+
+Nothing leaves the machine: ``OpenAIService`` talks to ``OpenAIStub`` over
+HTTP with the real SDK, the bot to ``TelegramStub``, values go to an
+in-memory session factory. Reports throughput, per-handler p50/p95/p99 and
+the mean of every pipeline stage from the Prometheus histograms.
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from collections import defaultdict
+from io import BytesIO
+
+from aiogram import Dispatcher
+from aiogram.dispatcher.middlewares.base import BaseMiddleware
+from PIL import Image
+
+from analytics import AnalyticsService
+from audio_processing import AudioProcessor
+from benchmarks.common import summarize
+from benchmarks.fakes import FakeSessionFactory, unlimited_scheduler
+from benchmarks.openai_stub import OpenAIStub
+from benchmarks.telegram_stub import TelegramStub, photo_update, text_update, voice_update
+from config import Settings
+from context_middleware import ContextMiddleware
+from main_router import router
+from metrics import STAGE_SECONDS, MetricsMiddleware
+from openai_client import OpenAIService
+from scheduler import OpenAIScheduler
+from validation import ValueValidator
+from value_writer import ValueWriter
+
+QUESTIONS = (
+    "Как справиться с тревогой перед экзаменом?",
+    "Почему тревога усиливается по вечерам?",
+    "Какие упражнения помогают при панической атаке?"
+)
+PHOTO_SIZES = ((90, 68), (320, 240), (800, 600), (1280, 960))
+
+
+class HandlerTimer(BaseMiddleware):
+    """Inner middleware recording how long each router handler takes"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    async def __call__(self, handler, event, data):
+        name = data["handler"].callback.__name__
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            self.errors[name] += 1
+            raise
+        finally:
+            self.latencies[name].append(time.perf_counter() - started)
+
+
+def build_dispatcher(service: OpenAIService, bot, settings: Settings, analytics: AnalyticsService):
+    """The production middleware stack around the real router, plus a ``HandlerTimer``.
+
+    The router can only be attached once, so call this once per process.
+    """
+    timer = HandlerTimer()
+    router.message.middleware(timer)
+    router.callback_query.middleware(timer)
+    dp = Dispatcher()
+    dp.update.outer_middleware(MetricsMiddleware(slow_seconds=float("inf")))
+    dp.update.middleware(ContextMiddleware(service, bot, settings, analytics))
+    dp.include_router(router)
+    return dp, timer
+
+
+def parse_mix(spec: str) -> dict:
+    mix = {kind: float(share) for kind, share in (item.split("=") for item in spec.split(","))}
+    total = sum(mix.values())
+    return {kind: share / total for kind, share in mix.items()}
+
+
+def jpeg(width: int, height: int) -> bytes:
+    buffer = BytesIO()
+    Image.effect_noise((width, height), 64).convert("RGB").save(buffer, "JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def synthetic_updates(args, telegram: TelegramStub) -> list:
+    mix = parse_mix(args.mix)
+    photos = [jpeg(width, height) for width, height in PHOTO_SIZES]
+    updates = []
+    for update_id in range(1, args.updates + 1):
+        user_id = random.randint(1, args.users)
+        kind = random.choices(list(mix), weights=list(mix.values()))[0]
+        if kind == "voice":
+            duration = random.randint(3, 40)
+            file_id = f"voice-{update_id}"
+            telegram.add_file(file_id, random.randbytes(duration * 4000))
+            updates.append(voice_update(update_id, user_id, file_id, duration * 4000, duration))
+        elif kind == "photo":
+            sizes = []
+            for (width, height), data in zip(PHOTO_SIZES, photos):
+                file_id = f"photo-{update_id}-{width}"
+                telegram.add_file(file_id, data)
+                sizes.append((file_id, width, height, len(data)))
+            updates.append(photo_update(update_id, user_id, sizes))
+        elif kind == "command":
+            updates.append(text_update(update_id, user_id, "/start"))
+        else:
+            updates.append(text_update(update_id, user_id, random.choice(QUESTIONS)))
+    return updates
+
+
+def stage_means() -> str:
+    sums, counts = {}, {}
+    for metric in STAGE_SECONDS.collect():
+        for sample in metric.samples:
+            if sample.name.endswith("_sum"):
+                sums[sample.labels["stage"]] = sample.value
+            elif sample.name.endswith("_count"):
+                counts[sample.labels["stage"]] = sample.value
+    return " ".join(f"{stage}={sums[stage] / count * 1000:.0f}ms(n={count:.0f})"
+                    for stage, count in counts.items() if count)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=300)
+    parser.add_argument("--users", type=int, default=40)
+    parser.add_argument("--mix", default="text=0.5,voice=0.3,photo=0.1,command=0.1")
+    parser.add_argument("--replay", help="JSONL file of raw Telegram updates")
+    parser.add_argument("--record", help="write the synthetic mix to this JSONL file")
+    parser.add_argument("--concurrency", type=int, default=64, help="updates in flight at once")
+    parser.add_argument("--rate", type=float, default=0, help="updates per second, 0 for as fast as possible")
+    parser.add_argument("--no-stream", action="store_true", help="poll runs instead of streaming them")
+    parser.add_argument("--limits", action="store_true", help="use the default OpenAI scheduler limits")
+    parser.add_argument("--openai-latency", type=float, default=0.05)
+    parser.add_argument("--token-delay", type=float, default=0.005)
+    parser.add_argument("--value-share", type=float, default=0.3, help="share of voice notes that state a value")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of OpenAI requests answered with 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="share answered with 429")
+    parser.add_argument("--telegram-latency", type=float, default=0.02)
+    parser.add_argument("--openai-port", type=int, default=8931)
+    parser.add_argument("--telegram-port", type=int, default=8932)
+    parser.add_argument("--serve", action="store_true", help="only run the stubs until interrupted")
+    parser.add_argument("--external", action="store_true", help="use stubs started with --serve")
+    args = parser.parse_args()
+
+    openai = OpenAIStub(default_latency=args.openai_latency, token_delay=args.token_delay,
+                        value_share=args.value_share, error_rate=args.error_rate,
+                        rate_limit_rate=args.rate_limit_rate)
+    telegram = TelegramStub(latency=args.telegram_latency)
+    if args.external:
+        # files of the synthetic mix are unknown to that stub, it serves random bytes instead
+        openai.base = f"http://127.0.0.1:{args.openai_port}/v1"
+        telegram.base = f"http://127.0.0.1:{args.telegram_port}"
+    else:
+        await openai.start(args.openai_port)
+        await telegram.start(args.telegram_port)
+    if args.serve:
+        print(f"stubs on {openai.base} and {telegram.base}")
+        await asyncio.Event().wait()
+
+    if args.replay:
+        with open(args.replay) as f:
+            updates = [json.loads(line) for line in f if line.strip()]
+    else:
+        updates = synthetic_updates(args, telegram)
+    if args.record:
+        with open(args.record, "w") as f:
+            f.writelines(json.dumps(update, ensure_ascii=False) + "\n" for update in updates)
+
+    sessions = FakeSessionFactory()
+    service = OpenAIService(
+        "asst_benchmark", "sk-benchmark",
+        stream_runs=not args.no_stream,
+        scheduler=OpenAIScheduler() if args.limits else unlimited_scheduler(),
+        validator=ValueValidator(session_factory=sessions),
+        value_writer=ValueWriter(sessions),
+        # the synthetic voice notes are noise, ffmpeg would only reject them
+        audio=AudioProcessor(workers=0)
+    )
+    service.client = openai.client()
+    settings = Settings.model_construct(STREAM_EDIT_INTERVAL=0.5)
+    analytics = AnalyticsService("", queue_size=10 ** 6)  # not started: events stay queued
+    bot = telegram.bot()
+    dp, timer = build_dispatcher(service, bot, settings, analytics)
+
+    slots = asyncio.Semaphore(args.concurrency)
+    latencies, failed = [], 0
+
+    async def one(update: dict):
+        nonlocal failed
+        async with slots:
+            started = time.perf_counter()
+            try:
+                await dp.feed_raw_update(bot, update)
+            except Exception:
+                failed += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    tasks = []
+    for update in updates:
+        tasks.append(asyncio.create_task(one(update)))
+        if args.rate:
+            await asyncio.sleep(1 / args.rate)
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+
+    print(f"updates: {len(updates)} in {elapsed:.2f}s ({len(updates) / elapsed:.1f}/s), failed={failed}")
+    print(f"all:     {summarize(latencies)}")
+    for name, samples in sorted(timer.latencies.items()):
+        print(f"{name:>22}: {summarize(samples)} errors={timer.errors[name]}")
+    print(f"stages:  {stage_means()}")
+    if not args.external:
+        print(f"openai:  calls={dict(sorted(openai.calls.items()))} "
+              f"injected failures={sum(openai.failures.values())}")
+        print(f"telegram: {dict(sorted(telegram.calls.items()))}")
+        print(f"mismatched tool outputs: {len(openai.errors)}")
+    print(f"values saved: {len(sessions.rows)}")
+
+    await service.value_writer.close()
+    await bot.session.close()
+    await telegram.close()
+    await openai.close()
+    if openai.errors:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
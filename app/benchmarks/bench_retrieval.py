@@ -0,0 +1,114 @@
+"""Local retrieval index: search latency and recall, and the cost of re-indexing.
+
+    python -m benchmarks.bench_retrieval --chunks 100000 --dimensions 512 --queries 200
+
+Chunk vectors are synthetic, drawn around a few hundred topic centres the
+way real embeddings of one knowledge base cluster. The blocked search over
+the memory-mapped index is compared with a brute force over the same
+vectors held in RAM; recall@k is the share of the exact top k it returns,
+which checks the per-block merge. Re-indexing runs ``update_index`` over generated documents with a
+counting embedder, once from scratch and again after one document changed.
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.common import summarize
+from retrieval import DocumentIndex, top_k, unit_rows, update_index
+
+
+def clustered(rows: int, dimensions: int, topics: int, spread: float, rng) -> np.ndarray:
+    centres = rng.standard_normal((topics, dimensions)).astype(np.float32)
+    vectors = centres[rng.integers(0, topics, rows)] + spread * rng.standard_normal((rows, dimensions),
+                                                                                     dtype=np.float32)
+    return unit_rows(vectors)
+
+
+def search_benchmark(args, directory: str):
+    rng = np.random.default_rng(1)
+    vectors = clustered(args.chunks, args.dimensions, args.topics, args.spread, rng)
+    chunks = [{"document": f"doc{n // 50}.md", "chunk": n % 50, "text": ""} for n in range(args.chunks)]
+    index = DocumentIndex(directory)
+    started = time.perf_counter()
+    index.write({}, chunks, vectors, "synthetic")
+    print(f"write {args.chunks} x {args.dimensions}: {time.perf_counter() - started:.2f}s, "
+          f"{os.path.getsize(index._matrix_path(0)) / 2 ** 20:.0f} MiB on disk")
+
+    started = time.perf_counter()
+    fresh = DocumentIndex(directory)
+    fresh.refresh()
+    print(f"load: {(time.perf_counter() - started) * 1000:.1f}ms (sidecar parse, vectors are mapped lazily)")
+
+    queries = unit_rows(vectors[rng.integers(0, args.chunks, args.queries)]
+                        + args.spread * rng.standard_normal((args.queries, args.dimensions), dtype=np.float32))
+    exact_times, local_times, recall = [], [], []
+    for query in queries:
+        started = time.perf_counter()
+        exact = set(top_k(vectors @ query, args.k).tolist())
+        exact_times.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        found = fresh.search(query, args.k, block_rows=args.block_rows)
+        local_times.append(time.perf_counter() - started)
+        rows = {50 * int(chunk["document"][3:-3]) + chunk["chunk"] for _, chunk in found}
+        recall.append(len(exact & rows) / args.k)
+    print(f"brute force in RAM: {summarize(exact_times)}")
+    print(f"memmap, blocked:    {summarize(local_times)}")
+    print(f"recall@{args.k}: {np.mean(recall):.4f} (min {min(recall):.2f})")
+
+
+async def reindex_benchmark(args, directory: str):
+    docs = os.path.join(directory, "docs")
+    os.makedirs(docs)
+    words = [f"слово{n}" for n in range(2000)]
+    for n in range(args.documents):
+        with open(os.path.join(docs, f"doc{n:03}.md"), "w", encoding="utf-8") as f:
+            f.write("\n\n".join(" ".join(random.choices(words, k=120)) + "." for _ in range(40)))
+
+    calls = {"requests": 0, "texts": 0}
+
+    async def embed(texts):
+        calls["requests"] += 1
+        calls["texts"] += len(texts)
+        await asyncio.sleep(args.embedding_latency)
+        rows = [np.frombuffer(hashlib.sha512(text.encode()).digest() * (args.dimensions // 64 + 1),
+                              dtype=np.int8)[:args.dimensions] for text in texts]
+        return unit_rows(rows)
+
+    index = DocumentIndex(os.path.join(directory, "index"))
+    for name in ("from scratch", "nothing changed", "one document changed"):
+        if name == "one document changed":
+            with open(os.path.join(docs, "doc007.md"), "a", encoding="utf-8") as f:
+                f.write("\n\nНовый абзац о тревоге.")
+        calls.update(requests=0, texts=0)
+        report = await update_index(index, docs, embed, "synthetic", args.dimensions)
+        print(f"reindex, {name + ':':<22}{report.seconds:.2f}s embedded={report.chunks_embedded}/{report.chunks} "
+              f"chunks in {calls['requests']} requests, generation={index.meta['generation']}")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=100000)
+    parser.add_argument("--dimensions", type=int, default=512)
+    parser.add_argument("--topics", type=int, default=300)
+    parser.add_argument("--spread", type=float, default=0.08, help="noise around a topic centre, per dimension")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=4)
+    parser.add_argument("--block-rows", type=int, default=16384)
+    parser.add_argument("--documents", type=int, default=50)
+    parser.add_argument("--embedding-latency", type=float, default=0.3, help="seconds per embeddings request")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        search_benchmark(args, os.path.join(directory, "search"))
+        await reindex_benchmark(args, directory)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
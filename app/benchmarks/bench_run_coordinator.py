@@ -0,0 +1,156 @@
+"""Bursts of text fragments through the real router, with and without the run coordinator.
+
+    python -m benchmarks.bench_run_coordinator --users 60 --debounce 1.0
+
+Every user sends two bursts of one to four fragments, a fraction of a
+second apart, with a pause between bursts that often ends while the first
+answer is still being generated. ``OpenAIStub`` runs with strict threads,
+so a message or run on a thread with an active run is refused as by the
+real API. Modes: no coordination (the old handler), runs serialised per
+user, bursts merged, and merged with stale runs cancelled.
+"""
+import argparse
+import asyncio
+import logging
+import random
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+
+from analytics import AnalyticsService
+from audio_processing import AudioProcessor
+from benchmarks.bench_replay import build_dispatcher
+from benchmarks.common import percentile, summarize
+from benchmarks.fakes import unlimited_scheduler
+from benchmarks.openai_stub import OpenAIStub
+from benchmarks.telegram_stub import TelegramStub, text_update
+from config import Settings
+from openai_client import OpenAIService
+from run_coordinator import RunCoordinator, Turn
+
+
+class RecordingCoordinator(RunCoordinator):
+    """Keeps every turn's queueing delay by user"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.delays = defaultdict(list)
+
+    @asynccontextmanager
+    async def turn(self, user_id: int, text: str):
+        async with super().turn(user_id, text) as turn:
+            if turn is not None:
+                self.delays[user_id].append(turn.queue_seconds)
+            yield turn
+
+
+class Uncoordinated(RecordingCoordinator):
+    """The handler before the coordinator: every message starts its own run at once"""
+
+    @asynccontextmanager
+    async def turn(self, user_id: int, text: str):
+        self.stats.messages += 1
+        self.stats.turns += 1
+        now = time.monotonic()
+        self.delays[user_id].append(0.0)
+        yield Turn(user_id, [text], now, now)
+
+
+def plan(users: int, first_id: int, gap: float, pause: float) -> dict:
+    timelines = {}
+    for user_id in range(first_id, first_id + users):
+        at, fragments = random.uniform(0, 2), []
+        for burst in range(2):
+            for n in range(random.randint(1, 4)):
+                fragments.append((at, f"часть {burst}.{n}: как справиться с тревогой"))
+                at += random.expovariate(1 / gap)
+            at += random.uniform(0.5, pause)
+        timelines[user_id] = fragments
+    return timelines
+
+
+async def run(dp, bot, telegram, timelines: dict):
+    update_ids = iter(range(10 ** 9))
+    failures, tasks = [], []
+    last_sent = {}
+
+    async def feed(user_id, text):
+        try:
+            await dp.feed_raw_update(bot, text_update(next(update_ids), user_id, text))
+        except Exception as e:
+            failures.append(type(e).__name__)
+
+    async def user(user_id, fragments):
+        started = time.perf_counter()
+        for at, text in fragments:
+            await asyncio.sleep(max(0.0, started + at - time.perf_counter()))
+            last_sent[user_id] = time.perf_counter()
+            tasks.append(asyncio.create_task(feed(user_id, text)))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user(user_id, fragments) for user_id, fragments in timelines.items()))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    answer_after_last = [telegram.sent_at[str(user_id)] - sent for user_id, sent in last_sent.items()
+                         if telegram.sent_at.get(str(user_id), 0) > sent]
+    return elapsed, failures, answer_after_last, len(last_sent) - len(answer_after_last)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=60)
+    parser.add_argument("--gap", type=float, default=0.4, help="mean seconds between fragments of a burst")
+    parser.add_argument("--pause", type=float, default=3.0, help="longest pause between a user's bursts")
+    parser.add_argument("--debounce", type=float, default=1.0)
+    parser.add_argument("--max-wait", type=float, default=4.0)
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--openai-port", type=int, default=8936)
+    parser.add_argument("--telegram-port", type=int, default=8937)
+    args = parser.parse_args()
+    # refused runs of the uncoordinated mode are counted below, not logged
+    logging.getLogger("aiogram.event").setLevel(logging.CRITICAL)
+
+    openai = OpenAIStub(latency={"runs": 0.3, "poll": 0.02}, token_delay=0.05, strict_threads=True)
+    telegram = TelegramStub(latency=0.02)
+    await openai.start(args.openai_port)
+    await telegram.start(args.telegram_port)
+    service = OpenAIService("asst_benchmark", "sk-benchmark", scheduler=unlimited_scheduler(),
+                            audio=AudioProcessor(workers=0), stream_runs=args.stream)
+    service.client = openai.client()
+    bot = telegram.bot()
+    dp, _ = build_dispatcher(service, bot, Settings.model_construct(STREAM_EDIT_INTERVAL=0.5),
+                             AnalyticsService("", queue_size=10 ** 6))
+
+    modes = (
+        ("uncoordinated", Uncoordinated()),
+        ("serialised", RecordingCoordinator(debounce=0, cancel_stale=False)),
+        ("merged", RecordingCoordinator(debounce=args.debounce, max_wait=args.max_wait, cancel_stale=False)),
+        ("merged+cancel", RecordingCoordinator(debounce=args.debounce, max_wait=args.max_wait)),
+    )
+    random.seed(7)
+    timelines = plan(args.users, 1, args.gap, args.pause)
+    for n, (name, coordinator) in enumerate(modes):
+        service.coordinator = coordinator
+        # fresh user ids, so no thread or FSM state carries over between modes
+        shifted = {user_id + n * 10 ** 6: fragments for user_id, fragments in timelines.items()}
+        calls_before, rejected_before = dict(openai.calls), openai.rejected
+        elapsed, failures, answered, unanswered = await run(dp, bot, telegram, shifted)
+        calls = {key: value - calls_before.get(key, 0) for key, value in openai.calls.items()}
+        delays = [d for user_delays in coordinator.delays.values() for d in user_delays]
+        worst = [max(user_delays) for user_delays in coordinator.delays.values()]
+        print(f"{name}: {elapsed:.1f}s, messages={coordinator.stats.messages} runs={calls.get('runs', 0)} "
+              f"cancels={calls.get('runs.cancel', 0)} threads={calls.get('threads', 0)} "
+              f"refused by API={openai.rejected - rejected_before} failed updates={len(failures)} "
+              f"users without a final answer={unanswered}")
+        print(f"    queueing delay per turn: {summarize(delays)}; worst per user p95="
+              f"{percentile(worst, 95) * 1000:.0f}ms")
+        print(f"    last fragment to final answer: {summarize(answered)}")
+        print(f"    {coordinator.stats.snapshot()}")
+
+    await bot.session.close()
+    await telegram.close()
+    await openai.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,74 @@
+"""Burst load against a rate-limited stub, with and without OpenAIScheduler.
+
+    python -m benchmarks.bench_scheduler --users 40 --requests 5 --rate 20
+"""
+import argparse
+import asyncio
+import logging
+import time
+from collections import defaultdict
+
+from benchmarks.common import percentile, summarize
+from benchmarks.fakes import RateLimitedEndpoint
+from openai import RateLimitError
+from scheduler import EndpointLimit, OpenAIScheduler
+
+
+async def run(args, scheduler):
+    endpoint = RateLimitedEndpoint(rate=args.rate, concurrency=args.concurrency, latency=args.latency)
+    latencies = []
+    per_user = defaultdict(list)
+    failed = 0
+
+    async def one(user_id):
+        nonlocal failed
+        started = time.perf_counter()
+        try:
+            if scheduler is None:
+                await endpoint()
+            else:
+                await scheduler.call("tts", user_id, endpoint)
+        except RateLimitError:
+            failed += 1
+            return
+        elapsed = time.perf_counter() - started
+        latencies.append(elapsed)
+        per_user[user_id].append(elapsed)
+
+    # one heavy user floods the queue alongside everyone else
+    jobs = [one(user_id) for user_id in range(args.users) for _ in range(args.requests)]
+    jobs += [one("heavy") for _ in range(args.users * args.requests // 2)]
+    started = time.perf_counter()
+    await asyncio.gather(*jobs)
+    elapsed = time.perf_counter() - started
+
+    name = "scheduler" if scheduler else "direct"
+    print(f"{name:>9}: ok={len(latencies)} failed={failed} upstream 429s={endpoint.rejected} "
+          f"in {elapsed:.2f}s ({len(latencies) / elapsed:.1f} ok/s)")
+    print(f"{'':>9}  latency {summarize(latencies)}")
+    light = [max(v) for k, v in per_user.items() if k != "heavy"]
+    if light:
+        print(f"{'':>9}  light users finish p95={percentile(light, 95):.2f}s, "
+              f"heavy user finishes {max(per_user['heavy'], default=0):.2f}s")
+    if scheduler:
+        print(f"{'':>9}  stats {scheduler.snapshot()['tts']}")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=40)
+    parser.add_argument("--requests", type=int, default=5, help="requests per user")
+    parser.add_argument("--rate", type=float, default=20, help="upstream requests per second")
+    parser.add_argument("--concurrency", type=int, default=10, help="upstream concurrent requests")
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+    logging.getLogger("scheduler").setLevel(logging.ERROR)
+
+    await run(args, None)
+    # configured slightly above the upstream rate so some 429s still need retrying
+    limit = EndpointLimit(concurrency=args.concurrency, rate=args.rate * 1.1, burst=int(args.rate))
+    await run(args, OpenAIScheduler({"tts": limit}, max_retries=8, backoff_base=0.1))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,140 @@
+"""Text questions through the real router with and without the semantic answer cache.
+
+    python -m benchmarks.bench_semantic_cache --users 200 --threshold 0.92
+
+Questions come from a handful of topics, asked in reworded forms with
+Zipf-like popularity. Each user asks one to three questions in a row, so
+their follow-ups go to the thread (bypass) as they would in production.
+Embeddings come from ``OpenAIStub``: bags of stemmed words, coarser than
+a real model but enough to exercise the index and the threshold.
+"""
+import argparse
+import asyncio
+import random
+import time
+from collections import defaultdict
+
+from analytics import AnalyticsService
+from audio_processing import AudioProcessor
+from benchmarks.bench_replay import build_dispatcher
+from benchmarks.common import summarize
+from benchmarks.fakes import unlimited_scheduler
+from benchmarks.openai_stub import OpenAIStub
+from benchmarks.telegram_stub import TelegramStub, text_update
+from config import Settings
+from openai_client import OpenAIService
+from semantic_cache import SemanticCache, normalize_question
+
+TOPICS = (
+    "как справиться с тревогой перед экзаменом",
+    "почему тревога усиливается по вечерам",
+    "какие дыхательные упражнения помогают при панической атаке",
+    "чем тревожное расстройство отличается от обычного волнения",
+    "как помочь близкому человеку с тревожностью",
+    "можно ли избавиться от тревоги без лекарств",
+    "как тревога влияет на сон",
+    "что делать если тревога мешает работать",
+    "какие симптомы у генерализованного тревожного расстройства",
+    "когда нужно обращаться к психотерапевту из-за тревоги",
+    "помогает ли спорт при тревожности",
+    "как кофеин влияет на тревогу"
+)
+FILLERS = ("подскажите", "пожалуйста", "скажите")
+
+
+def reword(topic: str) -> str:
+    words = topic.split()
+    roll = random.random()
+    if roll < 0.3:
+        text = topic
+    elif roll < 0.6:
+        # same words in another order
+        cut = random.randint(1, len(words) - 1)
+        text = " ".join(words[cut:] + words[:cut])
+    else:
+        text = f"{random.choice(FILLERS)} {topic}"
+    text = text[0].upper() + text[1:]
+    return text + random.choice(("?", "??", ".", ""))
+
+
+def sessions(users: int, first_id: int) -> dict:
+    weights = [1 / (rank + 1) for rank in range(len(TOPICS))]
+    return {
+        first_id + n: [random.choices(range(len(TOPICS)), weights)[0] for _ in range(random.randint(1, 3))]
+        for n in range(users)
+    }
+
+
+async def run(dp, bot, telegram, plan: dict, concurrency: int):
+    slots = asyncio.Semaphore(concurrency)
+    latencies, update_ids = [], iter(range(10 ** 9))
+
+    async def user(user_id, topics):
+        async with slots:
+            for topic in topics:
+                started = time.perf_counter()
+                await dp.feed_raw_update(bot, text_update(next(update_ids), user_id, reword(TOPICS[topic])))
+                latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user(user_id, topics) for user_id, topics in plan.items()))
+    elapsed = time.perf_counter() - started
+
+    # the stub quotes the question in its answer: a cached answer about another topic is a false hit
+    replies = defaultdict(list)
+    for sent in telegram.sent:
+        replies[int(sent["chat_id"])].append(sent.get("text", ""))
+    wrong = sum(
+        1 for user_id, topics in plan.items() for topic, reply in zip(topics, replies[user_id])
+        if topic_of(reply) != topic
+    )
+    return latencies, elapsed, wrong
+
+
+def topic_of(reply: str) -> int:
+    """Topic of the (truncated) question the stub quoted in its answer"""
+    quoted = set(normalize_question(reply.partition("«")[2].partition("»")[0]).split())
+    return max(range(len(TOPICS)), key=lambda n: len(quoted & set(TOPICS[n].split())))
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--threshold", type=float, default=0.92)
+    parser.add_argument("--run-latency", type=float, default=0.8, help="seconds a run takes at the stub")
+    parser.add_argument("--embedding-latency", type=float, default=0.05)
+    parser.add_argument("--openai-port", type=int, default=8934)
+    parser.add_argument("--telegram-port", type=int, default=8935)
+    args = parser.parse_args()
+
+    openai = OpenAIStub(latency={"runs": args.run_latency, "embeddings": args.embedding_latency,
+                                 "poll": 0.02})
+    telegram = TelegramStub(latency=0.02)
+    await openai.start(args.openai_port)
+    await telegram.start(args.telegram_port)
+
+    service = OpenAIService("asst_benchmark", "sk-benchmark", scheduler=unlimited_scheduler(),
+                            audio=AudioProcessor(workers=0))
+    service.client = openai.client()
+    settings = Settings.model_construct(STREAM_EDIT_INTERVAL=0.5)
+    bot = telegram.bot()
+    dp, _ = build_dispatcher(service, bot, settings, AnalyticsService("", queue_size=10 ** 6))
+
+    for name, cache, first_id in (("off", None, 1), ("on", SemanticCache(threshold=args.threshold), 10 ** 6)):
+        service.answer_cache = cache
+        telegram.sent.clear()
+        runs_before = openai.calls.get("runs", 0)
+        latencies, elapsed, wrong = await run(dp, bot, telegram, sessions(args.users, first_id), args.concurrency)
+        print(f"cache {name:>3}: {summarize(latencies)} in {elapsed:.1f}s, "
+              f"runs={openai.calls.get('runs', 0) - runs_before}, wrong-topic answers={wrong}")
+        if cache is not None:
+            print(f"           {cache.stats.snapshot()}")
+
+    await bot.session.close()
+    await telegram.close()
+    await openai.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,81 @@
+"""Cold-start cost: module imports, the migration step and the assistant sync.
+
+    python -m benchmarks.bench_startup --runs 3 --assistant-latency 0.4
+
+Imports are timed in fresh interpreters. The old migration step was an
+``alembic`` subprocess, timed here up to the point where it would connect;
+without a Postgres server the upgrade itself is not run. The assistant sync
+goes to ``OpenAIStub`` through the real client, first with an empty
+fingerprint cache (first deploy) and then with a filled one (restart).
+"""
+import argparse
+import asyncio
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.openai_stub import OpenAIStub
+from bootstrap import sync_assistant
+
+
+class DictRedis:
+    def __init__(self):
+        self.data = {}
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value, ex=None):
+        self.data[key] = value.encode()
+
+
+def fresh_interpreter(code: str, runs: int) -> float:
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--assistant-latency", type=float, default=0.4)
+    parser.add_argument("--port", type=int, default=8933)
+    args = parser.parse_args()
+
+    interpreter = fresh_interpreter("pass", args.runs)
+    bot = fresh_interpreter("import main", args.runs)
+    migrate = fresh_interpreter("import migrate", args.runs)
+    alembic = fresh_interpreter("import alembic.command, alembic.config, models, database", args.runs)
+    print(f"interpreter:          {interpreter:.2f}s")
+    print(f"import main:          {bot:.2f}s")
+    print(f"import migrate:       {migrate:.2f}s (the separate init command)")
+    print(f"alembic subprocess:   {alembic:.2f}s before connecting (old path, blocked the event loop)")
+    started = time.perf_counter()
+    import alembic.command, alembic.config  # noqa: E401,F401
+    print(f"alembic in-process:   {time.perf_counter() - started:.2f}s extra imports, upgrade runs in a thread")
+
+    from openai_client import OpenAIService
+
+    stub = OpenAIStub(latency={"assistants": args.assistant_latency}, jitter=0)
+    await stub.start(args.port)
+    service = OpenAIService("asst_benchmark", "sk-benchmark")
+    service.client = stub.client()
+    redis = DictRedis()
+    for name in ("first deploy", "restart", "restart"):
+        started = time.perf_counter()
+        updated = await sync_assistant(service, redis)
+        print(f"assistant sync, {name + ':':<14}{time.perf_counter() - started:.3f}s updated={updated}")
+    service.search_instruction += " Answer in Russian."
+    started = time.perf_counter()
+    updated = await sync_assistant(service, redis)
+    print(f"assistant sync, {'changed:':<14}{time.perf_counter() - started:.3f}s updated={updated}")
+    print(f"assistant updates sent: {stub.calls.get('assistants', 0)}")
+    await stub.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
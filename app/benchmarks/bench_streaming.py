@@ -0,0 +1,64 @@
+"""Time-to-first-token and time-to-first-audio, polling vs streaming runs.
+
+    python -m benchmarks.bench_streaming --requests 20 --sentences 8 --token-delay 0.02
+"""
+import argparse
+import asyncio
+import time
+
+from benchmarks.common import summarize
+from benchmarks.fakes import FakeOpenAI, FakeSessionFactory, unlimited_scheduler
+from openai_client import OpenAIService, process_assistant_response
+from streaming import StreamTimings, stream_run
+from value_writer import ValueWriter
+
+
+async def text_latency(service: OpenAIService, n: int):
+    """Seconds until the user sees the first piece of the answer"""
+    thread = await service.client.beta.threads.create()
+    await service.client.beta.threads.messages.create(thread_id=thread.id, content=f"question {n}", role="user")
+    started = time.perf_counter()
+    if service.stream_runs:
+        timings = StreamTimings(started=started)
+        await stream_run(service.client, thread.id, service.assistant_id, timings=timings)
+        return timings.time_to_first_token
+    await service.client.beta.threads.runs.create_and_poll(thread_id=thread.id, assistant_id=service.assistant_id)
+    await service.client.beta.threads.messages.list(thread.id, limit=1)
+    return time.perf_counter() - started
+
+
+async def voice_latency(service: OpenAIService, n: int):
+    """Seconds until the first and the last byte of the spoken reply are ready for upload"""
+    started = time.perf_counter()
+    _, audio = await process_assistant_response(n, service, f"question {n}", is_voice=True)
+    first = None
+    async for _ in audio.read(None):
+        if first is None:
+            first = time.perf_counter() - started
+    return first, time.perf_counter() - started
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--sentences", type=int, default=8)
+    parser.add_argument("--token-delay", type=float, default=0.02)
+    parser.add_argument("--latency", type=float, default=0.1)
+    args = parser.parse_args()
+
+    sessions = FakeSessionFactory()
+    for stream_runs in (False, True):
+        service = OpenAIService("asst_benchmark", "sk-benchmark", stream_runs=stream_runs,
+                                scheduler=unlimited_scheduler(), value_writer=ValueWriter(sessions))
+        service.client = FakeOpenAI(latency=args.latency, jitter=0.1, token_delay=args.token_delay,
+                                    answer_sentences=args.sentences)
+        ttft = await asyncio.gather(*(text_latency(service, n) for n in range(args.requests)))
+        voice = await asyncio.gather(*(voice_latency(service, n) for n in range(args.requests)))
+        mode = "stream" if stream_runs else "poll"
+        print(f"{mode:>6} text  first token: {summarize(ttft)}")
+        print(f"{mode:>6} voice first audio: {summarize([v[0] for v in voice])}")
+        print(f"{mode:>6} voice full audio:  {summarize([v[1] for v in voice])}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,102 @@
+"""Long conversations through the text handler: unbounded threads versus truncation and rollover.
+
+    python -m benchmarks.bench_thread_context --users 20 --turns 60
+
+Every user asks ``--turns`` questions one after another through the real
+router against ``OpenAIStub``. The stub bills prompt tokens for the messages
+a run sees and, with ``--context-delay``, takes longer to answer the longer
+the prompt is. Modes: threads that only grow, runs truncated to the last
+messages, and truncation with rollover to a summary-seeded thread. For each
+the prompt tokens and run latency are reported by thread age in turns,
+where age restarts at a rollover.
+"""
+import argparse
+import asyncio
+import logging
+import random
+import time
+
+from analytics import AnalyticsService
+from audio_processing import AudioProcessor
+from benchmarks.bench_replay import QUESTIONS, build_dispatcher
+from benchmarks.common import summarize
+from benchmarks.fakes import unlimited_scheduler
+from benchmarks.openai_stub import OpenAIStub
+from benchmarks.telegram_stub import TelegramStub, text_update
+from config import Settings
+from openai_client import OpenAIService
+from thread_context import ThreadContext
+
+
+async def conversation(dp, bot, user_id: int, turns: int, think: float, update_ids, latencies: list):
+    for n in range(turns):
+        await asyncio.sleep(random.uniform(0, think))
+        started = time.perf_counter()
+        await dp.feed_raw_update(bot, text_update(next(update_ids), user_id, f"{random.choice(QUESTIONS)} ({n})"))
+        latencies.append(time.perf_counter() - started)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=60)
+    parser.add_argument("--think", type=float, default=0.2, help="longest pause before each question")
+    parser.add_argument("--last-messages", type=int, default=20)
+    parser.add_argument("--rollover-tokens", type=int, default=2000)
+    parser.add_argument("--context-delay", type=float, default=0.1, help="run seconds per 1000 prompt tokens")
+    parser.add_argument("--no-stream", action="store_true")
+    parser.add_argument("--openai-port", type=int, default=8940)
+    parser.add_argument("--telegram-port", type=int, default=8941)
+    args = parser.parse_args()
+    logging.getLogger("thread_context").setLevel(logging.WARNING)
+
+    openai = OpenAIStub(latency={"runs": 0.2, "poll": 0.02}, default_latency=0.03, token_delay=0.005,
+                        context_delay=args.context_delay)
+    telegram = TelegramStub(latency=0.01)
+    await openai.start(args.openai_port)
+    await telegram.start(args.telegram_port)
+    service = OpenAIService("asst_benchmark", "sk-benchmark", scheduler=unlimited_scheduler(),
+                            audio=AudioProcessor(workers=0), stream_runs=not args.no_stream)
+    service.client = openai.client()
+    bot = telegram.bot()
+    dp, _ = build_dispatcher(service, bot, Settings.model_construct(STREAM_EDIT_INTERVAL=0.5),
+                             AnalyticsService("", queue_size=10 ** 6))
+
+    modes = (
+        ("unbounded", ThreadContext(truncate_last_messages=0, rollover_tokens=0)),
+        (f"last {args.last_messages} messages", ThreadContext(truncate_last_messages=args.last_messages,
+                                                              rollover_tokens=0)),
+        (f"last {args.last_messages} + rollover", ThreadContext(truncate_last_messages=args.last_messages,
+                                                                rollover_tokens=args.rollover_tokens)),
+    )
+    update_ids = iter(range(10 ** 9))
+    for n, (name, context) in enumerate(modes):
+        service.thread_context = context
+        random.seed(5)
+        calls_before = dict(openai.calls)
+        latencies = []
+        started = time.perf_counter()
+        await asyncio.gather(*(conversation(dp, bot, n * 10 ** 6 + user, args.turns, args.think, update_ids, latencies)
+                               for user in range(1, args.users + 1)))
+        await context.close()
+        elapsed = time.perf_counter() - started
+        calls = {key: value - calls_before.get(key, 0) for key, value in openai.calls.items()
+                 if value > calls_before.get(key, 0)}
+        stats = context.stats.snapshot()
+        by_age = stats.pop("by_age")
+        prompt = sum(bucket["runs"] * bucket["mean_prompt_tokens"] for bucket in by_age.values())
+        print(f"{name}: {elapsed:.1f}s, prompt tokens={prompt} ({prompt / max(1, stats['turns']):.0f} per turn), "
+              f"threads created={calls.get('threads', 0)} summaries requested={calls.get('chat', 0)}")
+        print(f"    per message: {summarize(latencies)}")
+        print(f"    {stats}")
+        for age, bucket in by_age.items():
+            print(f"    age {age:>5}: runs={bucket['runs']:<5} prompt tokens={bucket['mean_prompt_tokens']:<6} "
+                  f"run={bucket['mean_run_seconds'] * 1000:.0f}ms")
+
+    await bot.session.close()
+    await telegram.close()
+    await openai.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,97 @@
+"""Voice-to-text latency with and without the transcript cache, for a mix of new, forwarded and re-uploaded notes.
+
+    python -m benchmarks.bench_transcripts --messages 200 --forwarded 0.3 --reuploaded 0.1
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+from types import SimpleNamespace
+
+from audio import download_voice
+from benchmarks.common import summarize
+from benchmarks.fakes import unlimited_scheduler
+from openai_client import OpenAIService
+from transcripts import TranscriptCache
+
+
+class FakeVoiceBot:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.files = {}
+        self.downloads = 0
+
+    async def get_file(self, file_id):
+        return SimpleNamespace(file_path=file_id, file_size=len(self.files[file_id]))
+
+    async def download_file(self, file_path, destination, chunk_size):
+        await asyncio.sleep(self.latency)
+        self.downloads += 1
+        destination.write(self.files[file_path])
+        destination.seek(0)
+
+
+class FakeWhisper:
+    def __init__(self, per_second: float):
+        self.per_second = per_second
+        self.calls = 0
+        self.audio = SimpleNamespace(transcriptions=SimpleNamespace(create=self._create))
+
+    async def _create(self, file, model):
+        self.calls += 1
+        # bill like Whisper: time grows with the length of the audio (~4 KB/s of Opus)
+        await asyncio.sleep(len(file[1]) / 4000 * self.per_second)
+        return SimpleNamespace(text=f"транскрипт {len(file[1])}")
+
+
+def message_mix(args, bot):
+    notes, mix = [], []
+    for n in range(args.messages):
+        roll = random.random()
+        if notes and roll < args.forwarded:
+            mix.append(random.choice(notes))
+            continue
+        if notes and roll < args.forwarded + args.reuploaded:
+            data = bot.files[random.choice(notes).file_id]
+        else:
+            data = os.urandom(random.randint(20, 120) * 1000)
+        note = SimpleNamespace(file_id=f"file-{n}", file_unique_id=f"unique-{n}", file_size=len(data))
+        bot.files[note.file_id] = data
+        notes.append(note)
+        mix.append(note)
+    return mix
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--forwarded", type=float, default=0.3, help="share of forwarded notes (same file_unique_id)")
+    parser.add_argument("--reuploaded", type=float, default=0.1, help="share of the same audio uploaded again")
+    parser.add_argument("--download-latency", type=float, default=0.05)
+    parser.add_argument("--whisper-per-second", type=float, default=0.005)
+    args = parser.parse_args()
+
+    bot = FakeVoiceBot(args.download_latency)
+    mix = message_mix(args, bot)
+
+    for name, cache in (("uncached", None), ("cached", TranscriptCache())):
+        service = OpenAIService("asst_benchmark", "sk-benchmark", scheduler=unlimited_scheduler(), transcripts=cache)
+        service.client = whisper = FakeWhisper(args.whisper_per_second)
+        bot.downloads = 0
+        latencies = []
+        for note in mix:
+            started = time.perf_counter()
+            if cache is None:
+                # the handler before the cache: download, then Whisper
+                await service.transcribe_voice((await download_voice(bot, note.file_id)).getvalue())
+            else:
+                await service.voice_to_text(bot, note)
+            latencies.append(time.perf_counter() - started)
+        print(f"{name:>8}: {summarize(latencies)} downloads={bot.downloads} whisper calls={whisper.calls}")
+        if cache is not None:
+            print(f"{'':>8}  {cache.stats.snapshot()}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,58 @@
+"""Replay a reply mix through OpenAIService.speech and report TTS cache savings.
+
+    python -m benchmarks.bench_tts_cache --replies 500 --static-share 0.6
+"""
+import argparse
+import asyncio
+import random
+import time
+from types import SimpleNamespace
+
+from benchmarks.common import summarize
+from benchmarks.fakes import FakeOpenAI, unlimited_scheduler
+from openai_client import OpenAIService, STATIC_REPLIES
+from tts_cache import TTSCache
+
+
+async def send(service: OpenAIService, text: str, uploads: list):
+    """Stands in for message.answer_voice: consumes the upload and returns a sent message"""
+    started = time.perf_counter()
+    audio = await service.speech(text)
+    if isinstance(audio, str):
+        file_id = audio
+    else:
+        size = 0
+        async for chunk in audio.read(None):
+            size += len(chunk)
+        uploads.append(size)
+        file_id = f"file_{hash(text)}"
+    await service.remember_voice(text, SimpleNamespace(voice=SimpleNamespace(file_id=file_id)))
+    return time.perf_counter() - started
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--replies", type=int, default=500)
+    parser.add_argument("--static-share", type=float, default=0.6)
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    dynamic = [f"Free-form answer number {n} about your values." for n in range(50)]
+    replies = [
+        random.choice(STATIC_REPLIES) if random.random() < args.static_share else random.choice(dynamic)
+        for _ in range(args.replies)
+    ]
+    for cache in (None, TTSCache(None, static_phrases=STATIC_REPLIES)):
+        service = OpenAIService("asst_benchmark", "sk-benchmark", scheduler=unlimited_scheduler(), tts_cache=cache)
+        service.client = FakeOpenAI(latency=args.latency, jitter=0.1)
+        uploads = []
+        latencies = [await send(service, text, uploads) for text in replies]
+        name = "cached" if cache else "uncached"
+        print(f"{name:>8}: {summarize(latencies)} tts calls={service.client.calls.get('audio.speech', 0)} "
+              f"uploaded={sum(uploads) / 1024:.0f}KB")
+        if cache:
+            print(f"{'':>8}  {cache.snapshot()}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,69 @@
+"""How many validation round trips the tiered validator avoids.
+
+    python -m benchmarks.bench_validation --descriptions 500
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from benchmarks.common import summarize
+from benchmarks.fakes import FakeOpenAI, FakeSessionFactory, unlimited_scheduler
+from openai_client import OpenAIService, validate_value
+from validation import ValueValidator
+
+SHORT = ["семья", "честность", "свобода выбора", "дети"]
+PROFANE = ["вся эта хуйня про ценности", "fuck this value thing"]
+COMMON = [
+    "Быть честным с близкими людьми",
+    "быть честным с близкими людьми!",
+    "Помогать семье в трудную минуту",
+    "Постоянно учиться чему-то новому",
+]
+
+
+def description_mix(n):
+    mix = []
+    for i in range(n):
+        roll = random.random()
+        if roll < 0.25:
+            mix.append(random.choice(SHORT))
+        elif roll < 0.3:
+            mix.append(random.choice(PROFANE))
+        elif roll < 0.7:
+            mix.append(random.choice(COMMON))
+        else:
+            mix.append(f"Уникальная ценность номер {i} для пользователя")
+    return mix
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--descriptions", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    mix = description_mix(args.descriptions)
+    service = OpenAIService("asst_benchmark", "sk-benchmark", scheduler=unlimited_scheduler())
+    service.client = FakeOpenAI(latency=args.latency, jitter=0.2)
+
+    latencies = []
+    for description in mix:
+        started = time.perf_counter()
+        await validate_value(description, service)
+        latencies.append(time.perf_counter() - started)
+    print(f"  llm only: {summarize(latencies)} llm calls={len(mix)}")
+
+    validator = ValueValidator()
+    sessions = FakeSessionFactory()
+    latencies = []
+    for n, description in enumerate(mix):
+        started = time.perf_counter()
+        async with sessions() as session:
+            await validator.validate(description, service, user_id=n % 20, session=session, name=description[:100])
+        latencies.append(time.perf_counter() - started)
+    print(f"    tiered: {summarize(latencies)} {validator.stats.snapshot()}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
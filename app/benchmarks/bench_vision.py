@@ -0,0 +1,109 @@
+"""Vision tokens, bytes and latency: largest photo by URL vs the inline detail=low pipeline.
+
+    python -m benchmarks.bench_vision --photos 50 --repeat-share 0.3
+"""
+import argparse
+import asyncio
+import random
+import time
+from io import BytesIO
+from types import SimpleNamespace
+
+from PIL import Image
+
+from benchmarks.common import summarize
+from benchmarks.fakes import unlimited_scheduler
+from openai_client import OpenAIService
+from vision import PhotoMoodAnalyzer, estimate_image_tokens
+
+SIZES = ((90, 67), (320, 240), (800, 600), (1280, 960))
+
+
+def jpeg(width, height) -> bytes:
+    out = BytesIO()
+    Image.effect_noise((width, height), 64).convert("RGB").save(out, format="JPEG", quality=90)
+    return out.getvalue()
+
+
+class FakeVisionBot:
+    def __init__(self, latency):
+        self.latency = latency
+        self.files = {f"{w}x{h}": jpeg(w, h) for w, h in SIZES}
+        self.downloaded = 0
+
+    async def download(self, photo, destination):
+        await asyncio.sleep(self.latency)
+        data = self.files[photo.file_id.split(":")[1]]
+        self.downloaded += len(data)
+        destination.write(data)
+        destination.seek(0)
+
+
+class FakeVisionOpenAI:
+    """Bills prompt tokens the way the API does and scales latency with them"""
+
+    def __init__(self, latency, per_token):
+        self.latency = latency
+        self.per_token = per_token
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    async def _create(self, messages, **kwargs):
+        image = messages[0]["content"][1]["image_url"]
+        if image["url"].startswith("data:"):
+            tokens = estimate_image_tokens(0, 0, image["detail"])
+        else:
+            width, height = map(int, image["url"].rsplit("/", 1)[1].split("x"))
+            tokens = estimate_image_tokens(width, height, "high")
+        self.calls += 1
+        await asyncio.sleep(self.latency + tokens * self.per_token)
+        return SimpleNamespace(
+            usage=SimpleNamespace(prompt_tokens=tokens + 40),
+            choices=[SimpleNamespace(message=SimpleNamespace(content="нейтральное"))]
+        )
+
+
+def photo_sizes(n):
+    return [SimpleNamespace(file_id=f"{n}:{w}x{h}", file_unique_id=f"{n}-{w}", width=w, height=h) for w, h in SIZES]
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--photos", type=int, default=50)
+    parser.add_argument("--repeat-share", type=float, default=0.3, help="share of re-sent photos")
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--per-token", type=float, default=0.0003)
+    args = parser.parse_args()
+
+    photos = []
+    for n in range(args.photos):
+        photos.append(random.choice(photos) if photos and random.random() < args.repeat_share else photo_sizes(n))
+
+    bot = FakeVisionBot(args.latency / 5)
+    service = OpenAIService("asst_benchmark", "sk-benchmark", scheduler=unlimited_scheduler(),
+                            photo_moods=PhotoMoodAnalyzer())
+    fake = service.client = FakeVisionOpenAI(args.latency, args.per_token)
+
+    latencies, tokens = [], 0
+    for sizes in photos:
+        started = time.perf_counter()
+        largest = sizes[-1]
+        response = await service.mood_completion(f"https://api.telegram.org/file/bot<token>/{largest.file_id.split(':')[1]}")
+        tokens += response.usage.prompt_tokens
+        latencies.append(time.perf_counter() - started)
+    print(f"  url/largest: {summarize(latencies)} calls={fake.calls} prompt_tokens={tokens} "
+          f"image bytes fetched by OpenAI={len(bot.files['%dx%d' % SIZES[-1]]) * len(photos) // 1024}KB")
+
+    fake.calls = 0
+    latencies = []
+    for sizes in photos:
+        started = time.perf_counter()
+        await service.analyze_photo(bot, sizes)
+        latencies.append(time.perf_counter() - started)
+    stats = service.photo_moods.stats
+    print(f"inline/low+cache: {summarize(latencies)} calls={fake.calls} prompt_tokens={stats.prompt_tokens} "
+          f"image bytes sent={stats.image_bytes // 1024}KB cache_hits={stats.cache_hits}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,149 @@
+"""Compare the legacy temp-file voice path with the in-memory one.
+
+    python -m benchmarks.bench_voice_io --messages 200 --concurrency 20
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+import uuid
+from types import SimpleNamespace
+
+from audio import SpeechInputFile, download_voice
+from benchmarks.common import LoopLagMonitor, summarize
+
+CHUNK = 64 * 1024
+
+
+class FakeBot:
+    def __init__(self, payload: bytes, delay: float):
+        self.payload = payload
+        self.delay = delay
+
+    async def get_file(self, file_id):
+        await asyncio.sleep(self.delay)
+        return SimpleNamespace(file_path=f"voice/{file_id}.ogg", file_size=len(self.payload))
+
+    async def download_file(self, file_path, destination, chunk_size=CHUNK, **kwargs):
+        await asyncio.sleep(self.delay)
+        if isinstance(destination, str):
+            # aiogram writes path destinations through aiofiles, i.e. a thread
+            await asyncio.to_thread(_write_file, destination, self.payload)
+            return None
+        for i in range(0, len(self.payload), chunk_size):
+            destination.write(self.payload[i:i + chunk_size])
+        destination.seek(0)
+        return destination
+
+
+def _write_file(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+class FakeSpeechResponse:
+    def __init__(self, payload: bytes):
+        self.payload = payload
+
+    def stream_to_file(self, path):
+        _write_file(path, self.payload)
+
+    async def iter_bytes(self, chunk_size=CHUNK):
+        for i in range(0, len(self.payload), chunk_size):
+            yield self.payload[i:i + chunk_size]
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeOpenAI:
+    def __init__(self, speech: bytes, delay: float):
+        self.speech_payload = speech
+        self.delay = delay
+        self.audio = SimpleNamespace(
+            transcriptions=SimpleNamespace(create=self._transcribe),
+            speech=SimpleNamespace(
+                create=self._speech,
+                with_streaming_response=SimpleNamespace(create=self._speech_stream)
+            )
+        )
+
+    async def _transcribe(self, file, model):
+        data = file[1].read() if isinstance(file, tuple) else file.read()
+        await asyncio.sleep(self.delay)
+        return SimpleNamespace(text=f"{len(data)} bytes heard")
+
+    async def _speech(self, **kwargs):
+        await asyncio.sleep(self.delay)
+        return FakeSpeechResponse(self.speech_payload)
+
+    def _speech_stream(self, **kwargs):
+        return FakeSpeechResponse(self.speech_payload)
+
+
+async def file_based(bot, client, workdir):
+    audio_path = os.path.join(workdir, f"voice_{uuid.uuid4().hex}.ogg")
+    speech_path = os.path.join(workdir, f"speech_{uuid.uuid4().hex}.mp3")
+    file = await bot.get_file("voice")
+    await bot.download_file(file.file_path, audio_path)
+    with open(audio_path, "rb") as f:
+        transcript = await client.audio.transcriptions.create(file=f, model="whisper-1")
+    response = await client.audio.speech.create(model="tts-1", voice="nova", input=transcript.text)
+    response.stream_to_file(speech_path)
+    with open(speech_path, "rb") as f:
+        uploaded = len(f.read())
+    os.remove(audio_path)
+    os.remove(speech_path)
+    return uploaded
+
+
+async def in_memory(bot, client, workdir):
+    buffer = await download_voice(bot, "voice")
+    transcript = await client.audio.transcriptions.create(file=("voice.ogg", buffer), model="whisper-1")
+    await asyncio.sleep(client.delay)  # time to first TTS byte
+    uploaded = 0
+    async for chunk in SpeechInputFile(client, transcript.text).read(bot):
+        uploaded += len(chunk)
+    return uploaded
+
+
+async def run(path, args, workdir):
+    bot = FakeBot(os.urandom(args.voice_kb * 1024), args.delay)
+    client = FakeOpenAI(os.urandom(args.speech_kb * 1024), args.delay)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+
+    async def one():
+        async with semaphore:
+            started = time.perf_counter()
+            await path(bot, client, workdir)
+            latencies.append(time.perf_counter() - started)
+
+    async with LoopLagMonitor() as monitor:
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(args.messages)))
+        elapsed = time.perf_counter() - started
+    print(f"{path.__name__:>10}: {summarize(latencies)} {args.messages / elapsed:.1f} msg/s {monitor.report()}")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--voice-kb", type=int, default=256)
+    parser.add_argument("--speech-kb", type=int, default=512)
+    parser.add_argument("--delay", type=float, default=0.005, help="simulated network latency per call")
+    parser.add_argument("--workdir", default=None, help="directory for temp files (defaults to system tmp)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.workdir) as workdir:
+        for path in (file_based, in_memory):
+            await run(path, args, workdir)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
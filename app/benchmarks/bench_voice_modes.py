@@ -0,0 +1,153 @@
+"""Voice notes end to end: the Whisper → assistant run → TTS chain versus one realtime session.
+
+    python -m benchmarks.bench_voice_modes --notes 60 --concurrency 8
+
+Voice updates go through the real router against ``OpenAIStub`` and
+``TelegramStub``; the realtime mode talks to the stub's ``/v1/realtime``
+websocket through the SDK's realtime client. The stub paces both paths
+alike: transcription by audio length, a model's first output after
+``--model-latency``, then the answer word by word. ffmpeg is replaced by a
+pass-through that only takes the time a transcode would, so the modes
+differ in round trips and waiting, not in codecs. Reported per mode: the
+handler's latency per note, OpenAI requests per note and values saved.
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from analytics import AnalyticsService
+from audio_processing import AudioProcessor
+from benchmarks.bench_replay import build_dispatcher
+from benchmarks.common import summarize
+from benchmarks.fakes import FakeSessionFactory, unlimited_scheduler
+from benchmarks.openai_stub import OpenAIStub
+from benchmarks.telegram_stub import TelegramStub, voice_update
+from config import Settings
+from openai_client import OpenAIService
+from realtime import PCM_BYTES_PER_SECOND, RealtimeVoice
+from validation import ValueValidator
+from value_writer import ValueWriter
+
+OPUS_BYTES_PER_SECOND = 4000
+
+
+class PassThroughAudio(AudioProcessor):
+    """Stands in for ffmpeg: output of the right size after the time a transcode of it takes"""
+
+    def __init__(self, seconds_per_audio_second: float):
+        super().__init__(workers=1)
+        self.binary = "pass-through"
+        self.cost = seconds_per_audio_second
+
+    async def prepare_voice(self, data: bytes):
+        await asyncio.sleep(len(data) / OPUS_BYTES_PER_SECOND * self.cost)
+        return [data]
+
+    async def decode_pcm(self, data: bytes, sample_rate: int = 24000) -> bytes:
+        await asyncio.sleep(len(data) / OPUS_BYTES_PER_SECOND * self.cost)
+        return bytes(len(data) * sample_rate * 2 // OPUS_BYTES_PER_SECOND)
+
+    async def encode_opus(self, pcm: bytes) -> bytes:
+        await asyncio.sleep(len(pcm) / PCM_BYTES_PER_SECOND * self.cost)
+        return bytes(len(pcm) * OPUS_BYTES_PER_SECOND // PCM_BYTES_PER_SECOND)
+
+
+async def run(dp, bot, updates: list, concurrency: int):
+    slots = asyncio.Semaphore(concurrency)
+    latencies, failed = [], 0
+
+    async def one(update: dict):
+        nonlocal failed
+        async with slots:
+            started = time.perf_counter()
+            try:
+                await dp.feed_raw_update(bot, update)
+            except Exception:
+                failed += 1
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(one(update) for update in updates))
+    return latencies, failed
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--notes", type=int, default=60)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--min-seconds", type=int, default=3)
+    parser.add_argument("--max-seconds", type=int, default=30)
+    parser.add_argument("--value-share", type=float, default=0.3)
+    parser.add_argument("--api-latency", type=float, default=0.1,
+                        help="threads, messages, polls and the websocket handshake")
+    parser.add_argument("--model-latency", type=float, default=0.5, help="until a model's first output")
+    parser.add_argument("--transcription-latency", type=float, default=0.3)
+    parser.add_argument("--speech-latency", type=float, default=0.3)
+    parser.add_argument("--token-delay", type=float, default=0.02)
+    parser.add_argument("--transcode-cost", type=float, default=0.002, help="seconds per second of audio")
+    parser.add_argument("--no-stream", action="store_true", help="poll runs in the chain instead of streaming")
+    parser.add_argument("--openai-port", type=int, default=8938)
+    parser.add_argument("--telegram-port", type=int, default=8939)
+    args = parser.parse_args()
+
+    api = args.api_latency
+    openai = OpenAIStub(
+        default_latency=api,
+        latency={"threads": api, "messages": api, "poll": api, "realtime": api, "chat": args.model_latency,
+                 "runs": args.model_latency, "realtime.response": args.model_latency,
+                 "transcriptions": args.transcription_latency, "speech": args.speech_latency},
+        token_delay=args.token_delay,
+        value_share=args.value_share
+    )
+    telegram = TelegramStub(latency=0.02)
+    await openai.start(args.openai_port)
+    await telegram.start(args.telegram_port)
+    sessions = FakeSessionFactory()
+    service = OpenAIService(
+        "asst_benchmark", "sk-benchmark",
+        stream_runs=not args.no_stream,
+        scheduler=unlimited_scheduler(),
+        validator=ValueValidator(session_factory=sessions),
+        value_writer=ValueWriter(sessions),
+        audio=PassThroughAudio(args.transcode_cost)
+    )
+    service.client = openai.client()
+    realtime = RealtimeVoice()
+    bot = telegram.bot()
+    dp, _ = build_dispatcher(service, bot, Settings.model_construct(), AnalyticsService("", queue_size=10 ** 6))
+
+    random.seed(11)
+    durations = [random.randint(args.min_seconds, args.max_seconds) for _ in range(args.notes)]
+    print(f"{args.notes} voice notes of {args.min_seconds}-{args.max_seconds}s "
+          f"(mean {sum(durations) / len(durations):.1f}s), {args.concurrency} at a time")
+    for n, (name, mode) in enumerate((("chain", None), ("realtime", realtime))):
+        service.realtime = mode
+        # cached verdicts of the first mode would spare the second its validation calls
+        service.validator = ValueValidator(session_factory=sessions)
+        updates = []
+        for i, duration in enumerate(durations):
+            # fresh users and files per mode, so neither threads nor cached transcripts carry over
+            user_id, file_id = n * 10 ** 6 + i + 1, f"voice-{name}-{i}"
+            telegram.add_file(file_id, random.randbytes(duration * OPUS_BYTES_PER_SECOND))
+            updates.append(voice_update(n * 10 ** 6 + i, user_id, file_id, duration * OPUS_BYTES_PER_SECOND,
+                                        duration))
+        calls_before, rows_before = dict(openai.calls), len(sessions.rows)
+        started = time.perf_counter()
+        latencies, failed = await run(dp, bot, updates, args.concurrency)
+        elapsed = time.perf_counter() - started
+        calls = {key: value - calls_before.get(key, 0) for key, value in openai.calls.items()
+                 if value > calls_before.get(key, 0)}
+        print(f"{name}: {elapsed:.1f}s, failed updates={failed}, values saved={len(sessions.rows) - rows_before}")
+        print(f"    per note: {summarize(latencies)}")
+        print(f"    OpenAI requests: {sum(calls.values()) / len(updates):.1f} per note {dict(sorted(calls.items()))}")
+        if mode is not None:
+            print(f"    {mode.stats.snapshot()}")
+
+    await service.value_writer.close()
+    await bot.session.close()
+    await telegram.close()
+    await openai.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
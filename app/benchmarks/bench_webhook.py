@@ -0,0 +1,143 @@
+"""Updates per second through the real router: long polling vs the webhook server.
+
+    python -m benchmarks.bench_webhook --updates 5000 --api-latency 0.05
+
+The driver process runs the Telegram stub and the load generator; the bot runs
+in a child process, one per mode (a router can only be attached to one
+dispatcher). ``--api-latency`` is added to every reply the bot sends.
+"""
+import argparse
+import asyncio
+import subprocess
+import sys
+import time
+
+import aiohttp
+from aiogram import Dispatcher
+
+from benchmarks.common import summarize
+from benchmarks.telegram_stub import TelegramStub, text_update
+from context_middleware import ContextMiddleware
+from main_router import router
+from webhook import SECRET_HEADER, WebhookServer
+
+SECRET = "benchmark-secret"
+
+
+def dispatcher(bot) -> Dispatcher:
+    dp = Dispatcher()
+    dp.update.middleware(ContextMiddleware(None, bot, None, None))
+    dp.include_router(router)
+    return dp
+
+
+def updates(args):
+    return [text_update(n + 1, 1000 + n % args.users, "/start") for n in range(args.updates)]
+
+
+async def serve_bot(args):
+    """Child process: the bot itself, pointed at the stub in the parent"""
+    stub = TelegramStub()
+    stub.base = f"http://127.0.0.1:{args.port}"
+    bot = stub.bot()
+    dp = dispatcher(bot)
+    if args.mode == "polling":
+        await dp.start_polling(bot, polling_timeout=1)
+        return
+    server = WebhookServer(dp, bot, SECRET, order_window=args.order_window, queue_size=args.queue_size)
+    await server.start("127.0.0.1", args.port + 1)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.close()
+
+
+async def healthy(url):
+    async with aiohttp.ClientSession() as http:
+        for _ in range(100):
+            try:
+                async with http.get(url) as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.1)
+    raise RuntimeError("webhook server did not start")
+
+
+async def post_updates(args):
+    url = f"http://127.0.0.1:{args.port + 1}/webhook"
+    await healthy(f"http://127.0.0.1:{args.port + 1}/healthz")
+    semaphore = asyncio.Semaphore(args.concurrency)
+    acks, retries = [], 0
+
+    async def post(http, update):
+        nonlocal retries
+        async with semaphore:
+            while True:
+                started = time.perf_counter()
+                async with http.post(url, json=update, headers={SECRET_HEADER: SECRET}) as response:
+                    acks.append(time.perf_counter() - started)
+                    if response.status != 503:
+                        return
+                retries += 1
+                await asyncio.sleep(0.05)
+
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=args.concurrency)) as http:
+        async with http.post(url, json=updates(args)[0], headers={SECRET_HEADER: "wrong"}) as response:
+            assert response.status == 401, response.status
+        started = time.perf_counter()
+        await asyncio.gather(*(post(http, update) for update in updates(args)))
+    return started, f"ack {summarize(acks)}, 503 retries={retries}"
+
+
+async def run(args):
+    stub = TelegramStub(latency=args.api_latency)
+    await stub.start(args.port)
+    bot = await asyncio.create_subprocess_exec(
+        sys.executable, "-m", "benchmarks.bench_webhook", *sys.argv[1:], "--mode", args.mode, "--role", "bot"
+    )
+    try:
+        stub.expect(args.updates)
+        if args.mode == "polling":
+            while not stub.calls.get("getUpdates"):
+                await asyncio.sleep(0.05)
+            started, detail = time.perf_counter(), ""
+            stub.push(*updates(args))
+        else:
+            started, detail = await post_updates(args)
+        await stub.all_sent.wait()
+        elapsed = time.perf_counter() - started
+        print(f"{args.mode:>8}: {args.updates / elapsed:8.0f} updates/s ({elapsed:.2f}s) "
+              f"getUpdates calls={stub.calls.get('getUpdates', 0)} {detail}")
+    finally:
+        bot.terminate()
+        await bot.wait()
+        await stub.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=("both", "polling", "webhook"), default="both")
+    parser.add_argument("--updates", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--api-latency", type=float, default=0.05, help="latency of each Bot API call")
+    parser.add_argument("--order-window", type=float, default=0.2)
+    parser.add_argument("--queue-size", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, default=100, help="parallel webhook requests")
+    parser.add_argument("--port", type=int, default=18780)
+    parser.add_argument("--role", choices=("driver", "bot"), default="driver", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.role == "bot":
+        asyncio.run(serve_bot(args))
+    elif args.mode != "both":
+        asyncio.run(run(args))
+    else:
+        for mode in ("polling", "webhook"):
+            subprocess.run([sys.executable, "-m", "benchmarks.bench_webhook", *sys.argv[1:], "--mode", mode],
+                           check=True)
+
+
+if __name__ == "__main__":
+    main()
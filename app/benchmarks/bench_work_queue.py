@@ -0,0 +1,90 @@
+"""Job throughput as worker processes are added, with a local Redis and a stub AI backend.
+
+    python -m benchmarks.bench_work_queue --redis-url redis://localhost:6379/15 --jobs 400 --workers 1,2,4
+
+The driver plays the intake role: it queues text jobs on a private stream and
+counts the replies arriving at a local Telegram stub. Each worker is a separate
+process running the real router against ``FakeOpenAI``.
+"""
+import argparse
+import asyncio
+import subprocess
+import sys
+import time
+
+from aiogram import Dispatcher
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import Update
+from redis.asyncio import Redis
+
+from benchmarks.fakes import FakeOpenAI, unlimited_scheduler
+from benchmarks.telegram_stub import TelegramStub, text_update
+from context_middleware import ContextMiddleware
+from main_router import router
+from openai_client import OpenAIService
+from work_queue import JobQueue, JobWorker
+
+STREAM = "bench:jobs"
+
+
+async def serve_worker(args):
+    stub = TelegramStub()
+    stub.base = f"http://127.0.0.1:{args.port}"
+    bot = stub.bot()
+    service = OpenAIService("asst_benchmark", "sk-benchmark", scheduler=unlimited_scheduler())
+    service.client = FakeOpenAI(latency=args.latency)
+    dp = Dispatcher(storage=MemoryStorage())
+    dp.update.middleware(ContextMiddleware(service, bot, None, None))
+    dp.include_router(router)
+    redis = Redis.from_url(args.redis_url)
+    await JobWorker(JobQueue(redis, stream=STREAM), dp, bot, concurrency=args.concurrency).run()
+
+
+async def run(args):
+    redis = Redis.from_url(args.redis_url)
+    queue = JobQueue(redis, stream=STREAM)
+    stub = TelegramStub()
+    await stub.start(args.port)
+    try:
+        for workers in map(int, args.workers.split(",")):
+            await redis.delete(STREAM, queue.dead_letter, queue.delayed)
+            await queue.ensure_group()
+            stub.sent.clear()
+            stub.expect(args.jobs)
+            processes = [
+                subprocess.Popen([sys.executable, "-m", "benchmarks.bench_work_queue", *sys.argv[1:], "--role", "worker"])
+                for _ in range(workers)
+            ]
+            try:
+                started = time.perf_counter()
+                for n in range(args.jobs):
+                    update = Update.model_validate(text_update(n + 1, 1000 + n, f"question number {n}"))
+                    await queue.enqueue("text", update)
+                await stub.all_sent.wait()
+                elapsed = time.perf_counter() - started
+                print(f"{workers:>2} workers: {args.jobs / elapsed:7.1f} jobs/s ({elapsed:.2f}s for {args.jobs} jobs)")
+            finally:
+                for process in processes:
+                    process.terminate()
+                    process.wait()
+    finally:
+        await redis.delete(STREAM, queue.dead_letter, queue.delayed)
+        await redis.aclose()
+        await stub.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--redis-url", default="redis://localhost:6379/15")
+    parser.add_argument("--jobs", type=int, default=400)
+    parser.add_argument("--workers", default="1,2,4")
+    parser.add_argument("--concurrency", type=int, default=16, help="jobs in flight per worker")
+    parser.add_argument("--latency", type=float, default=0.2, help="latency of each stub OpenAI call")
+    parser.add_argument("--port", type=int, default=18790)
+    parser.add_argument("--role", choices=("driver", "worker"), default="driver", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    asyncio.run(serve_worker(args) if args.role == "worker" else run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+import asyncio
+import statistics
+import time
+
+
+def percentile(samples, pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(samples) -> str:
+    if not samples:
+        return "n=0"
+    return (
+        f"n={len(samples)} mean={statistics.mean(samples) * 1000:.2f}ms "
+        f"p50={percentile(samples, 50) * 1000:.2f}ms "
+        f"p95={percentile(samples, 95) * 1000:.2f}ms "
+        f"p99={percentile(samples, 99) * 1000:.2f}ms"
+    )
+
+
+class LoopLagMonitor:
+    """Measures how long the event loop is blocked by scheduling a periodic tick"""
+
+    def __init__(self, interval: float = 0.001):
+        self.interval = interval
+        self.blocked = 0.0
+        self.max_lag = 0.0
+        self._task = None
+
+    async def _tick(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = time.perf_counter() - started - self.interval
+            if lag > 0:
+                self.blocked += lag
+                self.max_lag = max(self.max_lag, lag)
+
+    async def __aenter__(self):
+        self._task = asyncio.create_task(self._tick())
+        return self
+
+    async def __aexit__(self, *exc):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    def report(self) -> str:
+        return f"loop blocked={self.blocked * 1000:.1f}ms max_lag={self.max_lag * 1000:.2f}ms"
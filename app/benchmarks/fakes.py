@@ -0,0 +1,293 @@
+"""In-process stand-ins for the OpenAI client and database sessions"""
+import asyncio
+import itertools
+import json
+import random
+import time
+from types import SimpleNamespace
+
+import httpx
+from openai import RateLimitError
+
+from scheduler import DEFAULT_LIMITS, EndpointLimit, OpenAIScheduler
+
+
+class FakeOpenAI:
+    """Implements the subset of ``AsyncOpenAI`` used by ``OpenAIService``.
+
+    Runs ask for ``save_value`` when the user message contains "value",
+    otherwise they complete with an echo of the message. Every tool output
+    is checked against the run that requested it; mismatches land in
+    ``errors``.
+    """
+
+    def __init__(self, latency: float = 0.01, jitter: float = 0.5, token_delay: float = 0.0,
+                 answer_sentences: int = 1, tts_bytes_per_char: int = 100):
+        self.latency = latency
+        self.jitter = jitter
+        self.token_delay = token_delay
+        self.answer_sentences = answer_sentences
+        self.tts_bytes_per_char = tts_bytes_per_char
+        self.threads = {}
+        self.runs = {}
+        # runs created but not polled yet
+        self.started = {}
+        self.errors = []
+        self.calls = {}
+        self._ids = itertools.count(1)
+        self.beta = SimpleNamespace(threads=SimpleNamespace(
+            create=self._thread_create,
+            messages=SimpleNamespace(create=self._message_create, list=self._message_list),
+            runs=SimpleNamespace(create=self._run_create,
+                                 create_and_poll=self._run_create_and_poll,
+                                 with_raw_response=SimpleNamespace(retrieve=self._run_retrieve),
+                                 stream=self._run_stream,
+                                 poll=self._run_poll,
+                                 submit_tool_outputs=self._submit_tool_outputs),
+        ))
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._chat_create))
+        self.audio = SimpleNamespace(speech=SimpleNamespace(
+            with_streaming_response=SimpleNamespace(create=self._speech_stream)
+        ))
+
+    def _id(self, prefix):
+        return f"{prefix}_{next(self._ids)}"
+
+    async def _sleep(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        await asyncio.sleep(self.latency * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    async def _thread_create(self, **kwargs):
+        await self._sleep("threads.create")
+        thread = SimpleNamespace(id=self._id("thread"))
+        self.threads[thread.id] = []
+        return thread
+
+    async def _message_create(self, thread_id, content, role, **kwargs):
+        await self._sleep("messages.create")
+        self.threads[thread_id].append(_message(role, content))
+
+    async def _message_list(self, thread_id, **kwargs):
+        await self._sleep("messages.list")
+        return SimpleNamespace(data=list(reversed(self.threads[thread_id])))
+
+    def _answer(self, text):
+        filler = " ".join(f"Sentence {n} of the answer." for n in range(1, self.answer_sentences))
+        return f"echo: {text}. {filler}".strip()
+
+    def _start_run(self, thread_id):
+        text = self.threads[thread_id][-1].content[0].text.value
+        run_id = self._id("run")
+        if "value" in text:
+            call = SimpleNamespace(
+                id=self._id("call"),
+                function=SimpleNamespace(
+                    name="save_value",
+                    arguments=json.dumps({"name": "value", "description": text})
+                )
+            )
+            self.runs[run_id] = (thread_id, call.id)
+            return SimpleNamespace(
+                id=run_id,
+                status="requires_action",
+                required_action=SimpleNamespace(
+                    submit_tool_outputs=SimpleNamespace(tool_calls=[call])
+                )
+            )
+        return SimpleNamespace(id=run_id, status="completed", required_action=None, answer=self._answer(text))
+
+    async def _run_create_and_poll(self, thread_id, assistant_id, **kwargs):
+        await self._sleep("runs.create_and_poll")
+        run = self._start_run(thread_id)
+        if run.status == "completed":
+            # polling only returns once the whole answer has been generated
+            await asyncio.sleep(self.token_delay * len(run.answer.split()))
+            self.threads[thread_id].append(_message("assistant", run.answer))
+        return run
+
+    async def _run_create(self, thread_id, assistant_id, **kwargs):
+        await self._sleep("runs.create")
+        run = self._start_run(thread_id)
+        self.started[run.id] = (thread_id, run)
+        return SimpleNamespace(id=run.id, status="queued")
+
+    async def _run_retrieve(self, run_id, thread_id, **kwargs):
+        """Answers the first poll once the whole answer has been generated"""
+        await self._sleep("runs.retrieve")
+        _, run = self.started.pop(run_id)
+        if run.status == "completed":
+            await asyncio.sleep(self.token_delay * len(run.answer.split()))
+            self.threads[thread_id].append(_message("assistant", run.answer))
+        return SimpleNamespace(headers={}, parse=lambda: run)
+
+    def _run_stream(self, thread_id, assistant_id, **kwargs):
+        return FakeRunStream(self, thread_id)
+
+    async def _run_poll(self, run_id, thread_id, **kwargs):
+        await self._sleep("runs.poll")
+        return SimpleNamespace(id=run_id, status="completed")
+
+    def _speech_stream(self, model, voice, input, **kwargs):
+        return FakeSpeechStream(self, input)
+
+    async def _submit_tool_outputs(self, thread_id, run_id, tool_outputs, **kwargs):
+        await self._sleep("runs.submit_tool_outputs")
+        expected = self.runs.pop(run_id, None)
+        received = (thread_id, tool_outputs[0]["tool_call_id"])
+        if expected != received:
+            self.errors.append(f"run {run_id}: expected {expected}, got {received}")
+
+    async def _chat_create(self, messages, **kwargs):
+        await self._sleep("chat.completions.create")
+        content = json.dumps({"valid": True}) if kwargs.get("response_format") else "нейтральное"
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+class FakeRunStream:
+    def __init__(self, fake: FakeOpenAI, thread_id: str):
+        self.fake = fake
+        self.thread_id = thread_id
+
+    async def __aenter__(self):
+        return self._events()
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def _events(self):
+        await self.fake._sleep("runs.stream")
+        run = self.fake._start_run(self.thread_id)
+        if run.status == "completed":
+            words = run.answer.split(" ")
+            for n, word in enumerate(words):
+                await asyncio.sleep(self.fake.token_delay)
+                delta = word if n == len(words) - 1 else word + " "
+                yield _event("thread.message.delta", SimpleNamespace(delta=SimpleNamespace(content=[
+                    SimpleNamespace(type="text", text=SimpleNamespace(value=delta))
+                ])))
+            self.fake.threads[self.thread_id].append(_message("assistant", run.answer))
+            yield _event("thread.run.completed", run)
+        else:
+            yield _event("thread.run.requires_action", run)
+
+
+class FakeSpeechStream:
+    def __init__(self, fake: FakeOpenAI, text: str):
+        self.fake = fake
+        self.text = text
+
+    async def __aenter__(self):
+        await self.fake._sleep("audio.speech")
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def iter_bytes(self, chunk_size=64 * 1024):
+        payload = b"\0" * (len(self.text) * self.fake.tts_bytes_per_char)
+        for i in range(0, len(payload), chunk_size):
+            yield payload[i:i + chunk_size]
+
+
+def unlimited_scheduler() -> OpenAIScheduler:
+    """Scheduler that never queues, for benchmarks that measure something else"""
+    return OpenAIScheduler({name: EndpointLimit(10 ** 6, 10 ** 9, 10 ** 9) for name in DEFAULT_LIMITS})
+
+
+def rate_limit_error(retry_after: float = None) -> RateLimitError:
+    headers = {"retry-after": str(retry_after)} if retry_after is not None else {}
+    response = httpx.Response(429, headers=headers, request=httpx.Request("POST", "https://api.openai.com/v1/stub"))
+    return RateLimitError("Rate limit reached", response=response, body=None)
+
+
+class RateLimitedEndpoint:
+    """Accepts ``rate`` calls per second and ``concurrency`` at once, answering 429 beyond that"""
+
+    def __init__(self, rate: float, concurrency: int, latency: float = 0.05):
+        self.rate = rate
+        self.concurrency = concurrency
+        self.latency = latency
+        self.active = 0
+        self.window = []
+        self.accepted = 0
+        self.rejected = 0
+
+    async def __call__(self, *args, **kwargs):
+        now = time.monotonic()
+        self.window = [t for t in self.window if now - t < 1.0]
+        if len(self.window) >= self.rate or self.active >= self.concurrency:
+            self.rejected += 1
+            raise rate_limit_error()
+        self.window.append(now)
+        self.active += 1
+        self.accepted += 1
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self.active -= 1
+        return SimpleNamespace(ok=True)
+
+
+def _event(name, data):
+    return SimpleNamespace(event=name, data=data)
+
+
+def _message(role, text):
+    return SimpleNamespace(role=role, content=[SimpleNamespace(text=SimpleNamespace(value=text))])
+
+
+class FakeSession:
+    def __init__(self, factory):
+        self.factory = factory
+        self.pending = []
+
+    async def __aenter__(self):
+        self.opened_at = time.perf_counter()
+        self.factory.open_sessions += 1
+        self.factory.peak_sessions = max(self.factory.peak_sessions, self.factory.open_sessions)
+        return self
+
+    async def __aexit__(self, *exc):
+        self.factory.open_sessions -= 1
+        self.factory.held_seconds += time.perf_counter() - self.opened_at
+        return False
+
+    def add(self, row):
+        self.pending.append(row)
+
+    async def execute(self, statement, params=None):
+        """Understands the ``UserValue`` insert of ValueWriter and the duplicate count of ValueValidator"""
+        await asyncio.sleep(self.factory.latency)
+        if params is not None:
+            self.pending.extend(SimpleNamespace(**row) for row in params)
+            return SimpleNamespace(all=lambda: [(row["user_id"], row["value_name"]) for row in params])
+        params = statement.compile().params
+        user_id, name = params["user_id_1"], params["value_name_1"]
+        count = sum(1 for row in self.factory.rows if row.user_id == user_id and row.value_name == name)
+        return SimpleNamespace(scalar_one=lambda: count)
+
+    async def commit(self):
+        await asyncio.sleep(self.factory.latency)
+        self.factory.rows.extend(self.pending)
+        self.factory.commits += 1
+        self.pending = []
+
+    async def rollback(self):
+        self.pending = []
+
+
+class FakeSessionFactory:
+    """Drop-in for ``AsyncSessionLocal`` that keeps committed rows in memory"""
+
+    def __init__(self, latency: float = 0.001):
+        self.latency = latency
+        self.rows = []
+        self.commits = 0
+        self.sessions = 0
+        self.open_sessions = 0
+        self.peak_sessions = 0
+        self.held_seconds = 0.0
+
+    def __call__(self):
+        self.sessions += 1
+        return FakeSession(self)
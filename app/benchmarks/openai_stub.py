@@ -0,0 +1,510 @@
+"""A local stand-in for the OpenAI HTTP API, enough for everything ``OpenAIService`` calls.
+
+Unlike ``fakes.FakeOpenAI`` this runs behind the real ``AsyncOpenAI`` client,
+so request building, SSE parsing, run polling and retries are all exercised.
+"""
+import asyncio
+import base64
+import itertools
+import json
+import random
+import time
+import zlib
+from typing import Dict, Optional
+
+import numpy as np
+from aiohttp import WSMsgType, web
+from openai import AsyncOpenAI
+
+VALUE_WORDS = ("value", "ценност")
+MOODS = ("радость", "грусть", "злость", "нейтральное", "страх", "удивление")
+ACTIVE_RUN_STATUSES = ("queued", "in_progress", "requires_action", "cancelling")
+# about 60 ms of 24 kHz pcm16 speech per character of the spoken answer
+SPEECH_PCM_BYTES_PER_CHAR = 2880
+
+
+class OpenAIStub:
+    """Assistants, threads, messages, runs (polled and streamed), audio, chat, embeddings and realtime.
+
+    ``latency`` maps an endpoint group (assistants, threads, messages, runs,
+    transcriptions, speech, chat, embeddings, realtime for the websocket
+    handshake and realtime.response for a response's first delta) to
+    seconds, ``default_latency`` covers the rest. A run
+    whose message mentions a value and that was given a ``save_value`` tool
+    stops at ``requires_action``; every submitted tool output is checked
+    against the call that asked for it and mismatches land in ``errors``.
+    ``error_rate`` and ``rate_limit_rate`` turn that share of requests into
+    500s and 429s. With ``strict_threads`` a thread refuses new messages and
+    runs while one of its runs is active, as the real API does; refusals
+    are counted in ``rejected``. Prompt tokens of a run count the words of
+    the messages it sees, honouring a ``last_messages`` truncation strategy,
+    and ``context_delay`` adds that many seconds per 1000 of them before a
+    run starts answering, as longer prompts take longer to process.
+    """
+
+    def __init__(
+            self,
+            default_latency: float = 0.05,
+            latency: Optional[Dict[str, float]] = None,
+            jitter: float = 0.3,
+            token_delay: float = 0.005,
+            answer_words: int = 30,
+            whisper_per_second: float = 0.02,
+            tts_bytes_per_char: int = 100,
+            value_share: float = 0.3,
+            error_rate: float = 0.0,
+            rate_limit_rate: float = 0.0,
+            poll_ms: int = 25,
+            strict_threads: bool = False,
+            context_delay: float = 0.0
+    ):
+        self.default_latency = default_latency
+        self.latency = latency or {}
+        self.jitter = jitter
+        self.token_delay = token_delay
+        self.answer_words = answer_words
+        self.whisper_per_second = whisper_per_second
+        self.tts_bytes_per_char = tts_bytes_per_char
+        self.value_share = value_share
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.poll_ms = poll_ms
+        self.strict_threads = strict_threads
+        self.context_delay = context_delay
+        self.active: Dict[str, str] = {}
+        self.rejected = 0
+        self.threads: Dict[str, list] = {}
+        self.runs: Dict[str, dict] = {}
+        self.calls: Dict[str, int] = {}
+        self.failures: Dict[str, int] = {}
+        self.errors = []
+        self._ids = itertools.count(1)
+        self._runner: Optional[web.AppRunner] = None
+        self.base = ""
+
+    def _id(self, prefix: str) -> str:
+        return f"{prefix}_{next(self._ids)}"
+
+    async def _delay(self, group: str):
+        latency = self.latency.get(group, self.default_latency)
+        await asyncio.sleep(latency * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    @web.middleware
+    async def _faults(self, request: web.Request, handler):
+        group = request.match_info.route.name or "other"
+        self.calls[group] = self.calls.get(group, 0) + 1
+        roll = random.random()
+        if roll < self.rate_limit_rate:
+            self.failures[group] = self.failures.get(group, 0) + 1
+            return web.json_response({"error": {"message": "Rate limit reached", "type": "requests",
+                                                "code": "rate_limit_exceeded"}},
+                                     status=429, headers={"retry-after": "0.1"})
+        if roll < self.rate_limit_rate + self.error_rate:
+            self.failures[group] = self.failures.get(group, 0) + 1
+            return web.json_response({"error": {"message": "Stub failure", "type": "server_error"}}, status=500)
+        return await handler(request)
+
+    # threads and messages
+
+    async def create_thread(self, request: web.Request) -> web.Response:
+        await self._delay("threads")
+        body = await request.json() if request.can_read_body else {}
+        thread_id = self._id("thread")
+        self.threads[thread_id] = [self._message(thread_id, message.get("role", "user"), message["content"])
+                                   for message in body.get("messages") or []]
+        return web.json_response({"id": thread_id, "object": "thread", "created_at": int(time.time()),
+                                  "metadata": {}, "tool_resources": None})
+
+    def _busy(self, thread_id: str) -> Optional[web.Response]:
+        run = self.runs.get(self.active.get(thread_id, ""))
+        if not self.strict_threads or run is None:
+            return None
+        self._finish(run)
+        if run["status"] not in ACTIVE_RUN_STATUSES:
+            return None
+        self.rejected += 1
+        return web.json_response({"error": {
+            "message": f"Can't add messages to {thread_id} while a run {run['id']} is active.",
+            "type": "invalid_request_error"
+        }}, status=400)
+
+    async def create_message(self, request: web.Request) -> web.Response:
+        await self._delay("messages")
+        thread_id = request.match_info["thread_id"]
+        busy = self._busy(thread_id)
+        if busy is not None:
+            return busy
+        body = await request.json()
+        content = body["content"] if isinstance(body["content"], str) else json.dumps(body["content"])
+        message = self._message(thread_id, body.get("role", "user"), content)
+        self.threads[thread_id].append(message)
+        return web.json_response(message)
+
+    async def list_messages(self, request: web.Request) -> web.Response:
+        await self._delay("messages")
+        messages = self.threads[request.match_info["thread_id"]]
+        if request.query.get("order", "desc") == "desc":
+            messages = list(reversed(messages))
+        if "after" in request.query:
+            ids = [message["id"] for message in messages]
+            after = request.query["after"]
+            messages = messages[ids.index(after) + 1:] if after in ids else []
+        data = messages[:int(request.query.get("limit", 20))]
+        return web.json_response({"object": "list", "data": data, "has_more": False,
+                                  "first_id": data[0]["id"] if data else None,
+                                  "last_id": data[-1]["id"] if data else None})
+
+    def _message(self, thread_id: str, role: str, text: str, run_id: Optional[str] = None,
+                 status: str = "completed") -> dict:
+        return {
+            "id": self._id("msg"), "object": "thread.message", "created_at": int(time.time()),
+            "thread_id": thread_id, "role": role, "status": status, "run_id": run_id,
+            "assistant_id": "asst_benchmark" if role == "assistant" else None, "attachments": [], "metadata": {},
+            "content": [{"type": "text", "text": {"value": text, "annotations": []}}] if text else []
+        }
+
+    # runs
+
+    def _answer(self, text: str) -> str:
+        words = [f"слово{n}" for n in range(self.answer_words)]
+        for n in range(9, len(words), 10):
+            words[n] += "."
+        return f"Ответ на «{text[:40]}»: " + " ".join(words)
+
+    @staticmethod
+    def _value_arguments(text: str) -> str:
+        return json.dumps({"name": text.split()[-1].strip(".") or "ценность", "description": text},
+                          ensure_ascii=False)
+
+    def _start_run(self, thread_id: str, body: dict) -> dict:
+        text = self.threads[thread_id][-1]["content"][0]["text"]["value"]
+        tools = {tool.get("function", {}).get("name") for tool in body.get("tools") or []}
+        run = {
+            "id": self._id("run"), "object": "thread.run", "created_at": int(time.time()),
+            "thread_id": thread_id, "assistant_id": body.get("assistant_id"), "status": "queued",
+            "model": "gpt-4-1106-preview", "instructions": "", "tools": body.get("tools") or [],
+            "parallel_tool_calls": True, "required_action": None, "usage": None, "metadata": {},
+            "truncation_strategy": body.get("truncation_strategy") or {"type": "auto", "last_messages": None}
+        }
+        if "save_value" in tools and any(word in text.lower() for word in VALUE_WORDS):
+            call_id = self._id("call")
+            run["_call"] = {"id": call_id, "type": "function",
+                            "function": {"name": "save_value", "arguments": self._value_arguments(text)}}
+            run["_answer"] = None
+        else:
+            run["_answer"] = self._answer(text)
+        run["_ready_at"] = (time.monotonic() + self._context_seconds(run)
+                            + self.token_delay * self.answer_words * (run["_answer"] is not None))
+        self.runs[run["id"]] = run
+        self.active[thread_id] = run["id"]
+        return run
+
+    def _finish(self, run: dict):
+        """Moves a run past its waiting time to the state the client should see next"""
+        if run["status"] == "cancelling":
+            run["status"] = "cancelled"
+        elif run["status"] in ("queued", "in_progress") and time.monotonic() >= run["_ready_at"]:
+            if run["_answer"] is None:
+                run["status"] = "requires_action"
+                run["required_action"] = {"type": "submit_tool_outputs",
+                                          "submit_tool_outputs": {"tool_calls": [run["_call"]]}}
+            else:
+                self.threads[run["thread_id"]].append(
+                    self._message(run["thread_id"], "assistant", run["_answer"], run["id"])
+                )
+                self._complete(run)
+        elif run["status"] == "queued":
+            run["status"] = "in_progress"
+
+    def _prompt_tokens(self, run: dict) -> int:
+        messages = self.threads[run["thread_id"]]
+        if run["truncation_strategy"].get("type") == "last_messages":
+            messages = messages[-run["truncation_strategy"]["last_messages"]:]
+        return sum(len(m["content"][0]["text"]["value"].split()) for m in messages if m["content"]) * 2
+
+    def _context_seconds(self, run: dict) -> float:
+        return self._prompt_tokens(run) / 1000 * self.context_delay
+
+    def _complete(self, run: dict):
+        run["status"] = "completed"
+        run["required_action"] = None
+        prompt = self._prompt_tokens(run)
+        completion = self.answer_words if run["_answer"] else 10
+        run["usage"] = {"prompt_tokens": prompt, "completion_tokens": completion,
+                        "total_tokens": prompt + completion}
+
+    def _public(self, run: dict) -> dict:
+        return {key: value for key, value in run.items() if not key.startswith("_")}
+
+    def _poll_headers(self) -> dict:
+        return {"openai-poll-after-ms": str(self.poll_ms)}
+
+    async def create_run(self, request: web.Request) -> web.StreamResponse:
+        await self._delay("runs")
+        body = await request.json()
+        busy = self._busy(request.match_info["thread_id"])
+        if busy is not None:
+            return busy
+        run = self._start_run(request.match_info["thread_id"], body)
+        if body.get("stream"):
+            return await self._stream_run(request, run)
+        return web.json_response(self._public(run), headers=self._poll_headers())
+
+    async def get_run(self, request: web.Request) -> web.Response:
+        await self._delay("poll")
+        run = self.runs[request.match_info["run_id"]]
+        self._finish(run)
+        return web.json_response(self._public(run), headers=self._poll_headers())
+
+    async def cancel_run(self, request: web.Request) -> web.Response:
+        await self._delay("poll")
+        run = self.runs[request.match_info["run_id"]]
+        self._finish(run)
+        if run["status"] not in ACTIVE_RUN_STATUSES:
+            return web.json_response({"error": {"message": f"Cannot cancel run with status '{run['status']}'.",
+                                                "type": "invalid_request_error"}}, status=400)
+        run["status"] = "cancelling"
+        return web.json_response(self._public(run), headers=self._poll_headers())
+
+    async def submit_tool_outputs(self, request: web.Request) -> web.Response:
+        await self._delay("runs")
+        run = self.runs[request.match_info["run_id"]]
+        body = await request.json()
+        received = body["tool_outputs"][0]["tool_call_id"]
+        if run["status"] != "requires_action" or received != run["_call"]["id"]:
+            self.errors.append(f"run {run['id']}: expected {run['_call']['id']}, got {received}")
+            return web.json_response({"error": {"message": "Mismatched tool output", "type": "invalid_request_error"}},
+                                     status=400)
+        self._complete(run)
+        return web.json_response(self._public(run), headers=self._poll_headers())
+
+    async def _stream_run(self, request: web.Request, run: dict) -> web.StreamResponse:
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+
+        async def send(event: str, data: dict):
+            await response.write(f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode())
+
+        await send("thread.run.created", self._public(run))
+        run["status"] = "in_progress"
+        await send("thread.run.in_progress", self._public(run))
+        await asyncio.sleep(self._context_seconds(run))
+        if run["_answer"] is None:
+            run["_ready_at"] = 0
+            self._finish(run)
+            await send("thread.run.requires_action", self._public(run))
+        else:
+            message = self._message(run["thread_id"], "assistant", "", run["id"], status="in_progress")
+            await send("thread.message.created", message)
+            words = run["_answer"].split(" ")
+            for n, word in enumerate(words):
+                await asyncio.sleep(self.token_delay)
+                if run["status"] == "cancelling":
+                    run["status"] = "cancelled"
+                    await send("thread.run.cancelled", self._public(run))
+                    break
+                delta = word if n == len(words) - 1 else word + " "
+                await send("thread.message.delta", {"id": message["id"], "object": "thread.message.delta", "delta": {
+                    "content": [{"index": 0, "type": "text", "text": {"value": delta, "annotations": []}}]
+                }})
+            else:
+                message.update(status="completed",
+                               content=[{"type": "text", "text": {"value": run["_answer"], "annotations": []}}])
+                self.threads[run["thread_id"]].append(message)
+                await send("thread.message.completed", message)
+                self._complete(run)
+                await send("thread.run.completed", self._public(run))
+        await response.write(b"event: done\ndata: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def update_assistant(self, request: web.Request) -> web.Response:
+        await self._delay("assistants")
+        body = await request.json()
+        return web.json_response({
+            "id": request.match_info["assistant_id"], "object": "assistant", "created_at": int(time.time()),
+            "name": "Benchmark", "model": "gpt-4-1106-preview", "instructions": body.get("instructions"),
+            "tools": body.get("tools") or [], "tool_resources": body.get("tool_resources"), "metadata": {}
+        })
+
+    # audio and chat
+
+    async def transcribe(self, request: web.Request) -> web.Response:
+        size = 0
+        async for part in await request.multipart():
+            if part.name == "file":
+                size = len(await part.read())
+        # Whisper time grows with the length of the audio (~4 KB/s of Opus)
+        await asyncio.sleep(size / 4000 * self.whisper_per_second)
+        await self._delay("transcriptions")
+        return web.json_response({"text": self._heard()})
+
+    def _heard(self) -> str:
+        """What the speaker of a synthetic voice note said"""
+        if random.random() < self.value_share:
+            return "Моя главная ценность — честность в отношениях с близкими"
+        return "Расскажи, как справиться с тревогой перед выступлением"
+
+    async def speech(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        await self._delay("speech")
+        response = web.StreamResponse(headers={"Content-Type": "audio/ogg"})
+        await response.prepare(request)
+        payload = b"\0" * (len(body["input"]) * self.tts_bytes_per_char)
+        for i in range(0, len(payload), 64 * 1024):
+            await response.write(payload[i:i + 64 * 1024])
+        await response.write_eof()
+        return response
+
+    @staticmethod
+    def _embedding(text: str, dimensions: int) -> np.ndarray:
+        """Bag of crudely stemmed words, so paraphrases of a question land close together"""
+        vector = np.zeros(dimensions, dtype=np.float32)
+        for word in text.lower().split():
+            word = "".join(char for char in word if char.isalnum())
+            if len(word) > 2:
+                vector += np.random.default_rng(zlib.crc32(word[:5].encode())).standard_normal(dimensions,
+                                                                                            dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    async def embeddings(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        await self._delay("embeddings")
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        data = []
+        for index, text in enumerate(inputs):
+            vector = self._embedding(text, body.get("dimensions") or 1536)
+            embedding = (base64.b64encode(vector.astype("<f4").tobytes()).decode()
+                         if body.get("encoding_format") == "base64" else vector.tolist())
+            data.append({"object": "embedding", "index": index, "embedding": embedding})
+        tokens = sum(len(text.split()) for text in inputs) * 2
+        return web.json_response({"object": "list", "data": data, "model": body["model"],
+                                  "usage": {"prompt_tokens": tokens, "total_tokens": tokens}})
+
+    async def chat(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        await self._delay("chat")
+        if body.get("response_format", {}).get("type") == "json_object":
+            content = json.dumps({"valid": True})
+        elif any(isinstance(message["content"], list) for message in body["messages"]):
+            content = random.choice(MOODS)
+        else:
+            # a summary, as long as a short paragraph
+            content = "Пользователь рассказывал о тревоге; " + " ".join(f"факт{n}" for n in range(40)) + "."
+        return web.json_response({
+            "id": self._id("chatcmpl"), "object": "chat.completion", "created": int(time.time()),
+            "model": body["model"],
+            "choices": [{"index": 0, "finish_reason": "stop", "logprobs": None,
+                         "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": 100, "completion_tokens": 5, "total_tokens": 105}
+        })
+
+    # realtime
+
+    async def realtime(self, request: web.Request) -> web.WebSocketResponse:
+        """One speech-to-speech session: transcribes committed audio, answers with audio or a save_value call"""
+        await self._delay("realtime")
+        ws = web.WebSocketResponse(max_msg_size=16 * 1024 * 1024)
+        await ws.prepare(request)
+        lock = asyncio.Lock()
+
+        async def send(event: dict):
+            async with lock:
+                await ws.send_str(json.dumps({"event_id": self._id("event"), **event}, ensure_ascii=False))
+
+        session = {"id": self._id("sess"), "object": "realtime.session", "model": request.query.get("model"),
+                   "tools": []}
+        await send({"type": "session.created", "session": session})
+        audio, heard, tasks = bytearray(), "", []
+        async for message in ws:
+            if message.type != WSMsgType.TEXT:
+                break
+            event = json.loads(message.data)
+            if event["type"] == "session.update":
+                session.update(event["session"])
+                await send({"type": "session.updated", "session": session})
+            elif event["type"] == "conversation.item.create":
+                await send({"type": "conversation.item.created", "previous_item_id": None,
+                            "item": {"id": self._id("item"), "object": "realtime.item", **event["item"]}})
+            elif event["type"] == "input_audio_buffer.append":
+                audio += base64.b64decode(event["audio"])
+            elif event["type"] == "input_audio_buffer.commit":
+                if not audio:
+                    await send({"type": "error", "error": {"type": "invalid_request_error",
+                                                           "message": "Error committing input audio buffer: empty"}})
+                    continue
+                item_id, heard = self._id("item"), self._heard()
+                await send({"type": "input_audio_buffer.committed", "previous_item_id": None, "item_id": item_id})
+                tasks.append(asyncio.create_task(self._realtime_transcription(send, item_id, len(audio), heard)))
+                audio = bytearray()
+            elif event["type"] == "response.create":
+                tasks.append(asyncio.create_task(self._realtime_response(send, session, heard)))
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return ws
+
+    async def _realtime_transcription(self, send, item_id: str, size: int, heard: str):
+        # the same pace as Whisper, from 48 KB/s of pcm16 instead of ~4 KB/s of Opus
+        await asyncio.sleep(size / 48000 * self.whisper_per_second)
+        await self._delay("transcriptions")
+        await send({"type": "conversation.item.input_audio_transcription.completed", "item_id": item_id,
+                    "content_index": 0, "transcript": heard})
+
+    async def _realtime_response(self, send, session: dict, heard: str):
+        response = {"id": self._id("resp"), "object": "realtime.response", "status": "in_progress",
+                    "status_details": None, "output": [], "usage": None}
+        await send({"type": "response.created", "response": response})
+        await self._delay("realtime.response")
+        item_id = self._id("item")
+        tools = {tool.get("name") for tool in session.get("tools") or []}
+        if "save_value" in tools and any(word in heard.lower() for word in VALUE_WORDS):
+            await send({"type": "response.function_call_arguments.done", "response_id": response["id"],
+                        "item_id": item_id, "output_index": 0, "call_id": self._id("call"), "name": "save_value",
+                        "arguments": self._value_arguments(heard)})
+            output_tokens = 10
+        else:
+            words = self._answer(heard).split(" ")
+            for n, word in enumerate(words):
+                await asyncio.sleep(self.token_delay)
+                delta = word if n == len(words) - 1 else word + " "
+                position = {"response_id": response["id"], "item_id": item_id, "output_index": 0,
+                            "content_index": 0}
+                await send({"type": "response.audio_transcript.delta", **position, "delta": delta})
+                await send({"type": "response.audio.delta", **position,
+                            "delta": base64.b64encode(b"\0" * (len(delta) * SPEECH_PCM_BYTES_PER_CHAR)).decode()})
+            output_tokens = self.answer_words * 6
+        response.update(status="completed", usage={"input_tokens": 200, "output_tokens": output_tokens,
+                                                   "total_tokens": 200 + output_tokens})
+        await send({"type": "response.done", "response": response})
+
+    async def start(self, port: int):
+        app = web.Application(middlewares=[self._faults], client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/v1/assistants/{assistant_id}", self.update_assistant, name="assistants")
+        app.router.add_post("/v1/threads", self.create_thread, name="threads")
+        app.router.add_post("/v1/threads/{thread_id}/messages", self.create_message, name="messages")
+        app.router.add_get("/v1/threads/{thread_id}/messages", self.list_messages, name="messages.list")
+        app.router.add_post("/v1/threads/{thread_id}/runs", self.create_run, name="runs")
+        app.router.add_get("/v1/threads/{thread_id}/runs/{run_id}", self.get_run, name="runs.poll")
+        app.router.add_post("/v1/threads/{thread_id}/runs/{run_id}/cancel", self.cancel_run, name="runs.cancel")
+        app.router.add_post("/v1/threads/{thread_id}/runs/{run_id}/submit_tool_outputs", self.submit_tool_outputs,
+                            name="runs.submit_tool_outputs")
+        app.router.add_post("/v1/audio/transcriptions", self.transcribe, name="transcriptions")
+        app.router.add_post("/v1/audio/speech", self.speech, name="speech")
+        app.router.add_post("/v1/chat/completions", self.chat, name="chat")
+        app.router.add_post("/v1/embeddings", self.embeddings, name="embeddings")
+        app.router.add_get("/v1/realtime", self.realtime, name="realtime")
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "127.0.0.1", port).start()
+        self.base = f"http://127.0.0.1:{port}/v1"
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def client(self, max_retries: int = 0) -> AsyncOpenAI:
+        # retries are the scheduler's job; the SDK's own would hide 429s from it
+        return AsyncOpenAI(api_key="sk-benchmark", base_url=self.base,
+                           websocket_base_url=self.base.replace("http", "ws", 1), max_retries=max_retries)
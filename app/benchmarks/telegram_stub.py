@@ -0,0 +1,156 @@
+"""A local stand-in for the Telegram Bot API, enough for polling and sending replies"""
+import asyncio
+import itertools
+import os
+import time
+from typing import List, Optional
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiohttp import web
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Benchmark", "username": "benchmark_bot"}
+
+
+def message_update(update_id: int, user_id: int, **content) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+            **content
+        }
+    }
+
+
+def text_update(update_id: int, user_id: int, text: str) -> dict:
+    entities = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}] if text.startswith("/") else []
+    return message_update(update_id, user_id, text=text, entities=entities)
+
+
+def voice_update(update_id: int, user_id: int, file_id: str, size: int, duration: int) -> dict:
+    return message_update(update_id, user_id, voice={
+        "file_id": file_id, "file_unique_id": file_id, "duration": duration, "mime_type": "audio/ogg",
+        "file_size": size
+    })
+
+
+def photo_update(update_id: int, user_id: int, sizes: List[tuple]) -> dict:
+    """``sizes`` are (file_id, width, height, file_size), smallest first like Telegram sends them"""
+    return message_update(update_id, user_id, photo=[
+        {"file_id": file_id, "file_unique_id": file_id, "width": width, "height": height, "file_size": size}
+        for file_id, width, height, size in sizes
+    ])
+
+
+class TelegramStub:
+    """Serves ``getUpdates`` from a queue and records every method the bot calls.
+
+    ``latency`` is added to each outgoing call to mimic the round trip to Telegram.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.pending: List[dict] = []
+        self.arrived = asyncio.Event()
+        self.calls: dict = {}
+        self.sent: List[dict] = []
+        self.sent_at: dict = {}
+        self.all_sent = asyncio.Event()
+        self.expected: Optional[int] = None
+        self.files: dict = {}
+        self._message_ids = itertools.count(1)
+        self._runner: Optional[web.AppRunner] = None
+        self.base = ""
+
+    def push(self, *updates: dict):
+        self.pending.extend(updates)
+        self.arrived.set()
+
+    def add_file(self, file_id: str, data: bytes):
+        """Content served for ``file_id`` by ``getFile`` and the file download URL"""
+        self.files[file_id] = data
+
+    def expect(self, replies: int):
+        self.expected = replies
+        self.all_sent.clear()
+        if len(self.sent) >= replies:
+            self.all_sent.set()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if method == "getUpdates":
+            return web.json_response({"ok": True, "result": await self._updates(params)})
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if method == "getMe":
+            return web.json_response({"ok": True, "result": BOT_USER})
+        if method == "getFile":
+            # files nobody registered, e.g. in replayed updates, get random content
+            data = self.files.setdefault(params["file_id"], os.urandom(32 * 1024))
+            return web.json_response({"ok": True, "result": {
+                "file_id": params["file_id"], "file_unique_id": params["file_id"],
+                "file_size": len(data), "file_path": params["file_id"]
+            }})
+        if method.startswith("send") or method == "editMessageText":
+            self.sent.append({"method": method, **params})
+            self.sent_at[params.get("chat_id")] = time.perf_counter()
+            if self.expected is not None and len(self.sent) >= self.expected:
+                self.all_sent.set()
+            return web.json_response({"ok": True, "result": self._message(params)})
+        return web.json_response({"ok": True, "result": True})
+
+    async def _updates(self, params: dict) -> List[dict]:
+        offset = int(params.get("offset") or 0)
+        self.pending = [u for u in self.pending if u["update_id"] >= offset]
+        if not self.pending:
+            self.arrived.clear()
+            try:
+                await asyncio.wait_for(self.arrived.wait(), float(params.get("timeout") or 0) or 0.01)
+            except asyncio.TimeoutError:
+                return []
+        return self.pending[:int(params.get("limit") or 100)]
+
+    async def download(self, request: web.Request) -> web.Response:
+        data = self.files.get(request.match_info["path"])
+        if data is None:
+            raise web.HTTPNotFound()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return web.Response(body=data)
+
+    def _message(self, params: dict) -> dict:
+        chat_id = int(params.get("chat_id") or 0)
+        message_id = next(self._message_ids)
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            "text": params.get("text", "")
+        }
+        if "voice" in params:
+            message["voice"] = {"file_id": f"sent-voice-{message_id}", "file_unique_id": f"sent-voice-{message_id}",
+                                "duration": 1}
+        return message
+
+    async def start(self, port: int):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        app.router.add_get("/file/bot{token}/{path:.+}", self.download)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "127.0.0.1", port).start()
+        self.base = f"http://127.0.0.1:{port}"
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def bot(self) -> Bot:
+        return Bot("42:benchmark", session=AiohttpSession(api=TelegramAPIServer.from_base(self.base)))
@@ -0,0 +1,130 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from argparse import Namespace
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List, Sequence
+
+from sqlalchemy import text
+
+from database import get_engine
+
+logger = logging.getLogger(__name__)
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+# any constant works as long as every replica uses the same one
+MIGRATION_LOCK_ID = 0x76616C756573
+
+
+@dataclass
+class BootstrapReport:
+    timings: Dict[str, float] = field(default_factory=dict)
+    assistant_updated: bool = False
+    migrated: bool = False
+
+    def snapshot(self) -> dict:
+        return {**asdict(self), "timings": {name: round(value, 3) for name, value in self.timings.items()}}
+
+
+def assistant_fingerprint(client_ai) -> str:
+    """Hash of everything ``update_new_instruction`` sends to OpenAI"""
+    config = {
+        "assistant_id": client_ai.assistant_id,
+        "instructions": client_ai.search_instruction,
+        "tools": client_ai.tools,
+        "tool_resources": client_ai.tool_search_resources
+    }
+    return hashlib.sha256(json.dumps(config, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+
+def answer_fingerprint(client_ai) -> str:
+    """``assistant_fingerprint`` plus the generation of the local retrieval index the answers were drawn from"""
+    fingerprint = assistant_fingerprint(client_ai)
+    retriever = client_ai.retriever
+    if retriever is None or retriever.index.meta is None:
+        return fingerprint
+    return f"{fingerprint}:{retriever.index.meta['generation']}"
+
+
+async def sync_assistant(client_ai, redis=None, prefix: str = "bootstrap", ttl: int = 7 * 24 * 3600) -> bool:
+    """Push the assistant's instructions, tools and vector store only when they changed.
+
+    The fingerprint of the last update is kept in Redis, so restarts and
+    replicas skip the OpenAI call. It expires after ``ttl`` so an assistant
+    edited by hand in the dashboard is put back eventually.
+    """
+    key = f"{prefix}:assistant:{client_ai.assistant_id}"
+    fingerprint = assistant_fingerprint(client_ai)
+    if redis is not None:
+        try:
+            cached = await redis.get(key)
+            if cached is not None and cached.decode() == fingerprint:
+                return False
+        except Exception as e:
+            logger.warning(f"Bootstrap cache unavailable: {e}")
+    await client_ai.update_new_instruction()
+    if redis is not None:
+        try:
+            await redis.set(key, fingerprint, ex=ttl)
+        except Exception as e:
+            logger.warning(f"Bootstrap cache unavailable: {e}")
+    return True
+
+
+def alembic_upgrade(revision: str = "head", x_arguments: Sequence[str] = ()):
+    """``alembic upgrade`` without a subprocess; blocking, so call it from a thread"""
+    from alembic import command
+    from alembic.config import Config
+
+    config = Config(os.path.join(APP_DIR, "alembic.ini"), cmd_opts=Namespace(x=list(x_arguments)))
+    config.set_main_option("script_location", os.path.join(APP_DIR, "alembic"))
+    # env.py would otherwise replace the application's logging setup with alembic.ini's
+    config.attributes["configure_logger"] = False
+    command.upgrade(config, revision)
+
+
+def migration_arguments(settings) -> List[str]:
+    """The ``-x`` arguments of the migrations, the same for ``migrate.py`` and MIGRATE_ON_START"""
+    return [f"unique_values={str(settings.MIGRATE_UNIQUE_VALUES).lower()}"]
+
+
+async def run_migrations(revision: str = "head", x_arguments: Sequence[str] = (), lock_id: int = MIGRATION_LOCK_ID):
+    """Upgrade the schema while holding a Postgres advisory lock.
+
+    Replicas starting together queue on the lock; the first one migrates and
+    the others find nothing left to do. The upgrade runs in a worker thread,
+    env.py starts its own event loop there.
+    """
+    async with get_engine().connect() as connection:
+        await connection.execute(text("SELECT pg_advisory_lock(:id)"), {"id": lock_id})
+        try:
+            await asyncio.to_thread(alembic_upgrade, revision, x_arguments)
+        finally:
+            await connection.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": lock_id})
+
+
+async def _timed(report: BootstrapReport, name: str, coro):
+    started = time.perf_counter()
+    try:
+        return await coro
+    finally:
+        report.timings[name] = time.perf_counter() - started
+
+
+async def bootstrap(client_ai, redis=None, migrate: bool = True,
+                    x_arguments: Sequence[str] = ()) -> BootstrapReport:
+    """Migrations and the assistant sync are independent, so they run side by side"""
+    report = BootstrapReport()
+    started = time.perf_counter()
+    jobs = [_timed(report, "assistant", sync_assistant(client_ai, redis))]
+    if migrate:
+        jobs.append(_timed(report, "migrations", run_migrations(x_arguments=x_arguments)))
+    results = await asyncio.gather(*jobs)
+    report.assistant_updated = results[0]
+    report.migrated = migrate
+    report.timings["total"] = time.perf_counter() - started
+    logger.info("Bootstrap finished", extra=report.snapshot())
+    return report
@@ -0,0 +1,215 @@
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from typing import Any, Callable, Optional
+
+from redis.asyncio import Redis
+
+logger = logging.getLogger(__name__)
+
+
+def _size(value) -> int:
+    return len(value) if isinstance(value, (bytes, bytearray, str)) else 1
+
+
+class LRUCache:
+    """In-process LRU bounded by entry count and total size of the values"""
+
+    def __init__(self, max_items: int = 1024, max_bytes: int = 0, ttl: float = 0,
+                 sizeof: Callable[[Any], int] = _size):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.bytes = 0
+        self.evictions = 0
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key: str):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, size, expires = item
+        if expires and expires < time.monotonic():
+            self.pop(key)
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value):
+        size = self.sizeof(value)
+        if self.max_bytes and size > self.max_bytes:
+            return
+        self.pop(key)
+        expires = time.monotonic() + self.ttl if self.ttl else 0
+        self._data[key] = (value, size, expires)
+        self.bytes += size
+        while self._data and (len(self._data) > self.max_items or (self.max_bytes and self.bytes > self.max_bytes)):
+            _, (_, evicted, _) = self._data.popitem(last=False)
+            self.bytes -= evicted
+            self.evictions += 1
+
+    def pop(self, key: str):
+        item = self._data.pop(key, None)
+        if item is None:
+            return None
+        self.bytes -= item[1]
+        return item[0]
+
+    def clear(self):
+        self._data.clear()
+        self.bytes = 0
+
+
+@dataclass
+class CacheStats:
+    memory_hits: int = 0
+    redis_hits: int = 0
+    misses: int = 0
+    bytes_served: int = 0
+    evictions: int = 0
+    memory_evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.memory_hits + self.redis_hits + self.misses
+        return (self.memory_hits + self.redis_hits) / total if total else 0.0
+
+    def snapshot(self) -> dict:
+        return {**asdict(self), "hit_rate": round(self.hit_rate, 4)}
+
+
+class TieredCache:
+    """LRU in front of Redis.
+
+    Values are stored in Redis as bytes under ``<prefix>:<key>`` with a TTL.
+    When ``redis_max_bytes`` is set, a sorted set of keys by last write and
+    a hash of their sizes let the least recently written values be evicted
+    once the tier grows past the limit. The total size is kept in a counter
+    next to them, so a write only scans the sizes when the counter has to
+    be set up or repaired.
+    """
+
+    def __init__(
+            self,
+            redis: Optional[Redis],
+            prefix: str,
+            memory: Optional[LRUCache] = None,
+            ttl: int = 24 * 3600,
+            redis_max_bytes: int = 0,
+            max_item_bytes: int = 0,
+            dumps: Callable[[Any], bytes] = lambda value: value,
+            loads: Callable[[bytes], Any] = lambda data: data
+    ):
+        self.redis = redis
+        self.prefix = prefix
+        self.memory = memory if memory is not None else LRUCache()
+        self.ttl = ttl
+        self.redis_max_bytes = redis_max_bytes
+        self.max_item_bytes = max_item_bytes
+        self.dumps = dumps
+        self.loads = loads
+        self.stats = CacheStats()
+        self._counted = False
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}:{key}"
+
+    def _remember(self, key: str, value):
+        evictions = self.memory.evictions
+        self.memory.set(key, value)
+        self.stats.memory_evictions += self.memory.evictions - evictions
+
+    async def get(self, key: str):
+        value = self.memory.get(key)
+        if value is not None:
+            self.stats.memory_hits += 1
+            self.stats.bytes_served += _size(value)
+            return value
+        if self.redis is not None:
+            try:
+                data = await self.redis.get(self._key(key))
+            except Exception as e:
+                logger.warning(f"Cache {self.prefix} read error: {e}")
+                data = None
+            if data is not None:
+                value = self.loads(data)
+                self._remember(key, value)
+                self.stats.redis_hits += 1
+                self.stats.bytes_served += len(data)
+                return value
+        self.stats.misses += 1
+        return None
+
+    async def set(self, key: str, value):
+        self._remember(key, value)
+        if self.redis is None:
+            return
+        data = self.dumps(value)
+        if self.max_item_bytes and len(data) > self.max_item_bytes:
+            return
+        try:
+            if self.redis_max_bytes and not self._counted:
+                await self._recount(only_missing=True)
+            async with self.redis.pipeline(transaction=False) as pipe:
+                if self.redis_max_bytes:
+                    pipe.hget(f"{self.prefix}:~sizes", key)
+                pipe.set(self._key(key), data, ex=self.ttl)
+                if self.redis_max_bytes:
+                    pipe.zadd(f"{self.prefix}:~index", {key: time.time()})
+                    pipe.hset(f"{self.prefix}:~sizes", key, len(data))
+                    pipe.incrby(f"{self.prefix}:~bytes", len(data))
+                results = await pipe.execute()
+            if self.redis_max_bytes:
+                previous, total = results[0], results[-1]
+                if previous is not None:
+                    # an overwrite replaces the old value's size
+                    total = await self.redis.decrby(f"{self.prefix}:~bytes", int(previous))
+                await self._evict(total)
+        except Exception as e:
+            logger.warning(f"Cache {self.prefix} write error: {e}")
+
+    async def delete(self, key: str):
+        self.memory.pop(key)
+        if self.redis is not None:
+            await self._drop_index([key], delete=True)
+
+    async def _recount(self, only_missing: bool = False) -> int:
+        """Set the size counter from the sizes hash, which is O(N)"""
+        total = sum(int(size) for size in await self.redis.hvals(f"{self.prefix}:~sizes"))
+        await self.redis.set(f"{self.prefix}:~bytes", total, nx=only_missing)
+        self._counted = True
+        return total
+
+    async def _evict(self, total: int):
+        index = f"{self.prefix}:~index"
+        expired = await self.redis.zrangebyscore(index, 0, time.time() - self.ttl)
+        if expired:
+            total -= await self._drop_index(expired)
+        while total > self.redis_max_bytes:
+            oldest = await self.redis.zrange(index, 0, 15)
+            if not oldest:
+                # the counter drifted, e.g. with concurrent overwrites of one key
+                await self._recount()
+                break
+            total -= await self._drop_index(oldest, delete=True)
+            self.stats.evictions += len(oldest)
+
+    async def _drop_index(self, keys, delete: bool = False) -> int:
+        """Remove ``keys`` from the index and the counter, and from the cache with ``delete``; returns their bytes"""
+        names = [k.decode() if isinstance(k, bytes) else k for k in keys]
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hmget(f"{self.prefix}:~sizes", names)
+            if delete:
+                pipe.delete(*[self._key(name) for name in names])
+            pipe.zrem(f"{self.prefix}:~index", *names)
+            pipe.hdel(f"{self.prefix}:~sizes", *names)
+            sizes = (await pipe.execute())[0]
+        dropped = sum(int(size or 0) for size in sizes)
+        if dropped:
+            await self.redis.decrby(f"{self.prefix}:~bytes", dropped)
+        return dropped
@@ -1,7 +1,8 @@
 import logging
 
 import os
-from openai import AsyncOpenAI
+from typing import Dict
+
 from pydantic_settings import BaseSettings
 
 
@@ -16,7 +17,128 @@ class Settings(BaseSettings):
     POSTGRES_PORT: str
     AMPLITUDE_API_KEY:str
     REDIS_URL: str = "redis://localhost:6379/0"
+    # one pool for FSM, caches and the job stream; callers wait for a free connection up to the timeout
+    REDIS_MAX_CONNECTIONS: int = 64
+    REDIS_POOL_TIMEOUT_SECONDS: float = 5.0
+    REDIS_HEALTH_CHECK_SECONDS: int = 30
+    # FSM near-cache, kept coherent through keyspace notifications; 0 items turns it off.
+    # The server needs notify-keyspace-events with K$gxe; with the flag on the bot sets it by CONFIG SET
+    FSM_NEAR_CACHE_ITEMS: int = 10000
+    FSM_NEAR_CACHE_TTL_SECONDS: float = 300.0
+    FSM_WRITE_WINDOW_SECONDS: float = 0.0
+    FSM_CONFIGURE_KEYSPACE_EVENTS: bool = False
     VECTOR_STORE_ID: str = "vs_67d666ef61148191bdc50f9085d9f524"
+    MAX_VOICE_BYTES: int = 20 * 1024 * 1024
+    MAX_SPEECH_BYTES: int = 10 * 1024 * 1024
+    THREAD_TTL_SECONDS: int = 3 * 24 * 3600
+    THREAD_MAX_MESSAGES: int = 40
+    THREAD_MAX_AGE_SECONDS: int = 24 * 3600
+    # Text handler threads: runs see the last messages only (0 lets the API decide); past the rollover size
+    # the user moves to a new thread seeded with a summary written in the background (0 never rolls over)
+    THREAD_TRUNCATE_LAST_MESSAGES: int = 20
+    THREAD_ROLLOVER_TOKENS: int = 8000
+    THREAD_SUMMARY_MODEL: str = "gpt-4o-mini"
+    THREAD_SUMMARY_WORDS: int = 200
+    STREAM_RUNS: bool = True
+    STREAM_EDIT_INTERVAL: float = 1.0
+    # per endpoint class overrides, e.g. {"tts": {"concurrency": 4, "rate": 2, "burst": 4}}
+    OPENAI_LIMITS: Dict[str, Dict[str, float]] = {}
+    OPENAI_MAX_RETRIES: int = 4
+    TTS_CACHE_MEMORY_BYTES: int = 32 * 1024 * 1024
+    TTS_CACHE_REDIS_BYTES: int = 256 * 1024 * 1024
+    TTS_CACHE_MAX_ITEM_BYTES: int = 2 * 1024 * 1024
+    TTS_CACHE_TTL_SECONDS: int = 7 * 24 * 3600
+    PHOTO_MIN_SIDE: int = 512
+    PHOTO_MAX_SIDE: int = 512
+    MOOD_CACHE_TTL_SECONDS: int = 30 * 24 * 3600
+    VALUE_MIN_WORDS: int = 3
+    VALUE_MAX_CHARS: int = 500
+    # one word per line; "stem*" rejects every word starting with the stem
+    PROFANITY_WORDLIST_PATH: str = ""
+    VERDICT_CACHE_TTL_SECONDS: int = 30 * 24 * 3600
+    AMPLITUDE_ENDPOINT: str = "https://api2.amplitude.com/2/httpapi"
+    ANALYTICS_QUEUE_SIZE: int = 10000
+    ANALYTICS_BATCH_SIZE: int = 100
+    ANALYTICS_FLUSH_INTERVAL: float = 5.0
+    ANALYTICS_SPILL_PATH: str = "analytics_spill.jsonl"
+    DB_ECHO: bool = False
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 5
+    DB_POOL_TIMEOUT: float = 10.0
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = True
+    DB_STATEMENT_CACHE_SIZE: int = 100
+    VALUE_BATCH_SIZE: int = 100
+    VALUE_FLUSH_INTERVAL: float = 0.05
+    VALUES_PAGE_SIZE: int = 10
+    VALUES_CACHE_TTL_SECONDS: int = 600
+    # "polling" or "webhook"; in webhook mode WEBHOOK_URL is the public https base of this service.
+    # Updates without WEBHOOK_SECRET are refused; when it is empty each process registers a random one,
+    # so replicas behind one URL must set it
+    BOT_MODE: str = "polling"
+    WEBHOOK_URL: str = ""
+    WEBHOOK_PATH: str = "/webhook"
+    WEBHOOK_SECRET: str = ""
+    WEBHOOK_HOST: str = "0.0.0.0"
+    WEBHOOK_PORT: int = 8080
+    # a chat's next update starts after the previous one finished or ran this long
+    WEBHOOK_ORDER_WINDOW_SECONDS: float = 0.2
+    WEBHOOK_QUEUE_SIZE: int = 1000
+    # "all" receives and processes updates; "intake" queues AI jobs to the JOB_STREAM for "worker" processes
+    APP_ROLE: str = "all"
+    JOB_STREAM: str = "jobs"
+    JOB_MAX_ATTEMPTS: int = 3
+    JOB_CLAIM_IDLE_SECONDS: int = 300
+    # a failed job is retried after the backoff, doubled per attempt
+    JOB_RETRY_BACKOFF_SECONDS: float = 5.0
+    # a user's jobs run one at a time; the lock is renewed while a job runs, and a job
+    # that finds its user busy is put back until it has waited JOB_LOCK_WAIT_SECONDS
+    JOB_LOCK_SECONDS: float = 30.0
+    JOB_LOCK_WAIT_SECONDS: float = 120.0
+    WORKER_NAME: str = ""
+    WORKER_CONCURRENCY: int = 16
+    # ffmpeg processes for voice preprocessing and Opus encoding; 0 disables the stage
+    AUDIO_WORKERS: int = 2
+    AUDIO_CHUNK_SECONDS: float = 120
+    AUDIO_SILENCE_DB: int = -45
+    TRANSCRIPT_CACHE_MEMORY_ITEMS: int = 10000
+    TRANSCRIPT_CACHE_REDIS_BYTES: int = 64 * 1024 * 1024
+    TRANSCRIPT_CACHE_TTL_SECONDS: int = 30 * 24 * 3600
+    # Observability: /metrics is off when METRICS_PORT is 0
+    LOG_LEVEL: str = "INFO"
+    LOG_JSON: bool = True
+    METRICS_HOST: str = "127.0.0.1"
+    METRICS_PORT: int = 9100
+    SLOW_UPDATE_SECONDS: float = 10.0
+    # Startup: off when an init container runs `python migrate.py`
+    MIGRATE_ON_START: bool = True
+    # one value name per user: the (user_id, value_name) index is made unique; fails on existing duplicates
+    MIGRATE_UNIQUE_VALUES: bool = False
+    # Semantic answer cache of the text handler: off by default, since it answers one user with
+    # what the assistant told another; with RETRIEVAL_MODE=local it embeds with the index's model
+    SEMANTIC_CACHE_ENABLED: bool = False
+    SEMANTIC_CACHE_THRESHOLD: float = 0.92
+    SEMANTIC_CACHE_MAX_ITEMS: int = 2000
+    SEMANTIC_CACHE_TTL_SECONDS: int = 24 * 3600
+    # users who got an answer from their thread this recently skip the cache
+    SEMANTIC_CACHE_BYPASS_SECONDS: int = 15 * 60
+    # "file_search" uses the hosted vector store; "local" the index built by `python ingest.py`
+    RETRIEVAL_MODE: str = "file_search"
+    RETRIEVAL_INDEX_PATH: str = "retrieval_index"
+    RETRIEVAL_TOP_K: int = 4
+    RETRIEVAL_MIN_SCORE: float = 0.3
+    # Text messages of one user: bursts are answered by one run, runs never overlap on a thread;
+    # only a message that comes in while the user's previous run is going waits out the debounce
+    RUN_DEBOUNCE_SECONDS: float = 1.0
+    RUN_MAX_WAIT_SECONDS: float = 4.0
+    RUN_CANCEL_STALE: bool = True
+    # "chain" is Whisper, an assistant run and TTS; "realtime" answers voice notes in one speech-to-speech
+    # session (needs ffmpeg, falls back to the chain when a session fails)
+    VOICE_MODE: str = "chain"
+    REALTIME_MODEL: str = "gpt-4o-realtime-preview"
+    REALTIME_VOICE: str = "shimmer"
+    REALTIME_HISTORY_TURNS: int = 4
+    REALTIME_TIMEOUT_SECONDS: float = 60.0
 
     class Config:
         case_sensitive = True
@@ -24,9 +146,10 @@ class Settings(BaseSettings):
 
     async def init_assistant(self):
         """Создает ассистента при первом запуске"""
-        print(self.ASSISTANT_ID, type(self.ASSISTANT_ID))
         if not self.ASSISTANT_ID or len(self.ASSISTANT_ID) < 3:
-            print('Create ASSISTANT_ID')
+            logging.info("ASSISTANT_ID is not set, creating an assistant")
+            from openai import AsyncOpenAI  # only needed on the very first start
+
             client = AsyncOpenAI(api_key=self.OPENAI_API_KEY)
             assistant = await client.beta.assistants.create(
                 name="AutoCreated Assistant",
@@ -38,4 +161,4 @@ class Settings(BaseSettings):
                 with open(".env", "a") as f:
                     f.write(f"\nASSISTANT_ID={assistant.id}")
 
-            print(f"🆕 Created new Assistant ID: {assistant.id}")
+            logging.info(f"Created new Assistant ID: {assistant.id}")
@@ -1,18 +1,114 @@
+import time
+from dataclasses import dataclass, asdict
+from typing import Optional
 
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 from config import Settings
 
-settings = Settings()
-DATABASE_URL = f"postgresql+asyncpg://{settings.POSTGRES_USER}:{settings.POSTGRES_PASSWORD}@{settings.POSTGRES_HOST}:{settings.POSTGRES_PORT}/{settings.POSTGRES_DB}"
-engine = create_async_engine(DATABASE_URL,echo=True)
+_engine: Optional[AsyncEngine] = None
+_sessionmaker: Optional[sessionmaker] = None
+
+
+def get_database_url(settings: Optional[Settings] = None) -> str:
+    settings = settings or Settings()
+    return f"postgresql+asyncpg://{settings.POSTGRES_USER}:{settings.POSTGRES_PASSWORD}@{settings.POSTGRES_HOST}:{settings.POSTGRES_PORT}/{settings.POSTGRES_DB}"
+
+
+@dataclass
+class PoolStats:
+    checkouts: int = 0
+    checked_out: int = 0
+    peak_checked_out: int = 0
+    connects: int = 0
+    invalidated: int = 0
+    hold_seconds: float = 0.0
+
+    def snapshot(self, pool=None) -> dict:
+        data = asdict(self)
+        data["hold_seconds"] = round(self.hold_seconds, 3)
+        if pool is not None:
+            data.update(size=pool.size(), idle=pool.checkedin(), overflow=pool.overflow())
+        return data
+
+
+pool_stats = PoolStats()
+
+
+def _watch_pool(engine: AsyncEngine):
+    pool_events = engine.sync_engine.pool
+
+    @event.listens_for(pool_events, "connect")
+    def on_connect(dbapi_connection, record):
+        pool_stats.connects += 1
+
+    @event.listens_for(pool_events, "checkout")
+    def on_checkout(dbapi_connection, record, proxy):
+        record.info["checked_out_at"] = time.monotonic()
+        pool_stats.checkouts += 1
+        pool_stats.checked_out += 1
+        pool_stats.peak_checked_out = max(pool_stats.peak_checked_out, pool_stats.checked_out)
+
+    @event.listens_for(pool_events, "checkin")
+    def on_checkin(dbapi_connection, record):
+        started = record.info.pop("checked_out_at", None)
+        if started is not None:
+            pool_stats.checked_out -= 1
+            pool_stats.hold_seconds += time.monotonic() - started
+
+    @event.listens_for(pool_events, "invalidate")
+    def on_invalidate(dbapi_connection, record, exception):
+        pool_stats.invalidated += 1
+
+
+def get_engine(settings: Optional[Settings] = None) -> AsyncEngine:
+    """Process-wide engine, created on first use from ``settings``"""
+    global _engine
+    if _engine is None:
+        settings = settings or Settings()
+        _engine = create_async_engine(
+            get_database_url(settings),
+            echo=settings.DB_ECHO,
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT,
+            pool_recycle=settings.DB_POOL_RECYCLE,
+            pool_pre_ping=settings.DB_POOL_PRE_PING,
+            # asyncpg's own prepared statement cache; set to 0 behind pgbouncer in transaction mode
+            connect_args={"statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE},
+        )
+        _watch_pool(_engine)
+    return _engine
+
+
+def get_sessionmaker(settings: Optional[Settings] = None) -> sessionmaker:
+    global _sessionmaker
+    if _sessionmaker is None:
+        _sessionmaker = sessionmaker(
+            bind=get_engine(settings),
+            class_=AsyncSession,
+            expire_on_commit=False
+        )
+    return _sessionmaker
+
+
+def AsyncSessionLocal() -> AsyncSession:
+    """A new session; hold it only around the statements that need it"""
+    return get_sessionmaker()()
+
+
+def pool_snapshot() -> dict:
+    return pool_stats.snapshot(_engine.sync_engine.pool if _engine is not None else None)
+
+
+async def dispose_engine():
+    global _engine, _sessionmaker
+    if _engine is not None:
+        await _engine.dispose()
+    _engine = _sessionmaker = None
 
-AsyncSessionLocal = sessionmaker(
-    bind=engine,
-    class_=AsyncSession,
-    expire_on_commit=False
-)
 
 async def get_db_session() -> AsyncSession:
     async with AsyncSessionLocal() as session:
-        yield session
\ No newline at end of file
+        yield session
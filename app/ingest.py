@@ -0,0 +1,50 @@
+"""Build or refresh the local retrieval index used with RETRIEVAL_MODE=local.
+
+    python ingest.py DOCS_DIR [--index retrieval_index] [--dimensions 512]
+
+Only new and changed documents are embedded again, so it is cheap to run
+after every edit of the knowledge base; a running bot picks the new index
+up on its next question. Text and Markdown files are read as UTF-8, PDFs
+need ``pypdf``.
+"""
+import argparse
+import asyncio
+import json
+from dataclasses import asdict
+
+from openai import AsyncOpenAI
+
+from config import Settings
+from logging_config import setup_logging
+from metrics import count_tokens
+from retrieval import DocumentIndex, unit_rows, update_index
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("docs", help="a directory of .txt/.md/.pdf files, or one file")
+    parser.add_argument("--index", help="defaults to RETRIEVAL_INDEX_PATH")
+    parser.add_argument("--model", default="text-embedding-3-small")
+    parser.add_argument("--dimensions", type=int, default=512)
+    parser.add_argument("--max-chars", type=int, default=1200)
+    parser.add_argument("--overlap", type=int, default=200)
+    args = parser.parse_args()
+
+    settings = Settings()
+    setup_logging(settings.LOG_LEVEL, settings.LOG_JSON)
+    client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
+
+    async def embed(texts):
+        response = await client.embeddings.create(model=args.model, input=texts, dimensions=args.dimensions)
+        count_tokens("embeddings", response)
+        return unit_rows([item.embedding for item in response.data])
+
+    index = DocumentIndex(args.index or settings.RETRIEVAL_INDEX_PATH)
+    report = await update_index(index, args.docs, embed, args.model, args.dimensions,
+                                max_chars=args.max_chars, overlap=args.overlap)
+    print(json.dumps({**asdict(report), "seconds": round(report.seconds, 3)}))
+    await client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,43 +1,272 @@
 import asyncio
 import logging
-import subprocess
-import sys
+import signal
 
 from aiogram import Bot, Dispatcher
 
 from analytics import AnalyticsService
+from audio_processing import AudioProcessor
+from bootstrap import bootstrap, migration_arguments
 from storage import create_storage
 from config import Settings
 from context_middleware import ContextMiddleware
+from database import AsyncSessionLocal, dispose_engine, get_engine, pool_snapshot
 from main_router import router
-from openai_client import OpenAIService
+from logging_config import setup_logging
+from metrics import MetricsMiddleware, start_metrics_server
+from openai_client import OpenAIService, STATIC_REPLIES
+from run_coordinator import RunCoordinator
+from scheduler import EndpointLimit, OpenAIScheduler
+from semantic_cache import SemanticCache
+from thread_context import ThreadContext
+from thread_registry import ThreadRegistry
+from transcripts import TranscriptCache
+from tts_cache import TTSCache
+from validation import DEFAULT_PROFANITY, PROFANITY_STEMS, ValueValidator, load_wordlist
+from user_values import UserValuesStore
+from value_writer import ValueWriter
+from vision import PhotoMoodAnalyzer
+from webhook import run_webhook
+from work_queue import IntakeMiddleware, JobQueue, JobWorker
 
 
-
-def run_migrations():
-    logging.info("Running Alembic migrations...")
-    ret = subprocess.run(["alembic", "upgrade", "head"])
-    if ret.returncode != 0:
-        logging.error("Alembic migration failed.")
-        sys.exit(1)
-
 async def main():
     settings = Settings()
+    setup_logging(settings.LOG_LEVEL, settings.LOG_JSON)
     await settings.init_assistant()
 
     if not settings.ASSISTANT_ID or settings.ASSISTANT_ID == "":
         raise RuntimeError("Failed to create assistant")
-    run_migrations()
+    get_engine(settings)
     bot = Bot(settings.BOT_TOKEN)
-    storage = create_storage(settings.REDIS_URL)
+    storage = create_storage(
+        settings.REDIS_URL,
+        max_connections=settings.REDIS_MAX_CONNECTIONS,
+        pool_timeout=settings.REDIS_POOL_TIMEOUT_SECONDS,
+        health_check_interval=settings.REDIS_HEALTH_CHECK_SECONDS,
+        near_cache_items=settings.FSM_NEAR_CACHE_ITEMS,
+        near_cache_ttl=settings.FSM_NEAR_CACHE_TTL_SECONDS,
+        write_window=settings.FSM_WRITE_WINDOW_SECONDS,
+        configure_keyspace_events=settings.FSM_CONFIGURE_KEYSPACE_EVENTS
+    )
+    await storage.start()
     dp = Dispatcher(storage=storage)
-    client = OpenAIService(settings.ASSISTANT_ID, settings.OPENAI_API_KEY,settings.VECTOR_STORE_ID)
-    analytics = AnalyticsService(settings.AMPLITUDE_API_KEY)
+    thread_registry = ThreadRegistry(
+        storage.redis,
+        ttl=settings.THREAD_TTL_SECONDS,
+        max_messages=settings.THREAD_MAX_MESSAGES,
+        max_age=settings.THREAD_MAX_AGE_SECONDS
+    )
+    thread_context = ThreadContext(
+        storage.redis,
+        truncate_last_messages=settings.THREAD_TRUNCATE_LAST_MESSAGES,
+        rollover_tokens=settings.THREAD_ROLLOVER_TOKENS,
+        summary_model=settings.THREAD_SUMMARY_MODEL,
+        summary_words=settings.THREAD_SUMMARY_WORDS,
+        ttl=settings.THREAD_TTL_SECONDS
+    )
+    scheduler = OpenAIScheduler(
+        limits={
+            name: EndpointLimit(int(limit["concurrency"]), limit["rate"], int(limit["burst"]))
+            for name, limit in settings.OPENAI_LIMITS.items()
+        },
+        max_retries=settings.OPENAI_MAX_RETRIES
+    )
+    tts_cache = TTSCache(
+        storage.redis,
+        static_phrases=STATIC_REPLIES,
+        memory_bytes=settings.TTS_CACHE_MEMORY_BYTES,
+        redis_bytes=settings.TTS_CACHE_REDIS_BYTES,
+        max_item_bytes=settings.TTS_CACHE_MAX_ITEM_BYTES,
+        ttl=settings.TTS_CACHE_TTL_SECONDS
+    )
+    photo_moods = PhotoMoodAnalyzer(
+        storage.redis,
+        min_side=settings.PHOTO_MIN_SIDE,
+        max_side=settings.PHOTO_MAX_SIDE,
+        ttl=settings.MOOD_CACHE_TTL_SECONDS
+    )
+    extra_words, extra_stems = (
+        load_wordlist(settings.PROFANITY_WORDLIST_PATH) if settings.PROFANITY_WORDLIST_PATH else ((), ())
+    )
+    validator = ValueValidator(
+        storage.redis,
+        min_words=settings.VALUE_MIN_WORDS,
+        max_chars=settings.VALUE_MAX_CHARS,
+        profanity=DEFAULT_PROFANITY + extra_words,
+        profanity_stems=PROFANITY_STEMS + extra_stems,
+        ttl=settings.VERDICT_CACHE_TTL_SECONDS,
+        session_factory=AsyncSessionLocal
+    )
+    user_values = UserValuesStore(
+        storage.redis,
+        AsyncSessionLocal,
+        page_size=settings.VALUES_PAGE_SIZE,
+        ttl=settings.VALUES_CACHE_TTL_SECONDS
+    )
+    value_writer = ValueWriter(
+        AsyncSessionLocal,
+        batch_size=settings.VALUE_BATCH_SIZE,
+        flush_interval=settings.VALUE_FLUSH_INTERVAL,
+        on_commit=user_values.invalidate
+    )
+    audio = AudioProcessor(
+        workers=settings.AUDIO_WORKERS,
+        chunk_seconds=settings.AUDIO_CHUNK_SECONDS,
+        silence_db=settings.AUDIO_SILENCE_DB
+    )
+    transcripts = TranscriptCache(
+        storage.redis,
+        memory_items=settings.TRANSCRIPT_CACHE_MEMORY_ITEMS,
+        redis_bytes=settings.TRANSCRIPT_CACHE_REDIS_BYTES,
+        ttl=settings.TRANSCRIPT_CACHE_TTL_SECONDS
+    )
+    retriever = None
+    if settings.RETRIEVAL_MODE == "local":
+        # numpy and the index are only loaded when local retrieval is on
+        from retrieval import DocumentIndex, Retriever
+        retriever = Retriever(
+            DocumentIndex(settings.RETRIEVAL_INDEX_PATH),
+            top_k=settings.RETRIEVAL_TOP_K,
+            min_score=settings.RETRIEVAL_MIN_SCORE
+        )
+        if not await retriever.index.refresh_async() or not len(retriever.index):
+            # the hosted file_search is off in this mode, so answers get no document excerpts until it is built
+            logging.warning(f"RETRIEVAL_MODE=local but the index at {settings.RETRIEVAL_INDEX_PATH} is missing "
+                            f"or empty; build it with `python ingest.py`")
+    answer_cache = None
+    if settings.SEMANTIC_CACHE_ENABLED:
+        embedding = {}
+        if retriever is not None and retriever.index.meta:
+            # questions embedded like the index, so the retriever searches with the cache's vector
+            embedding = {"model": retriever.index.meta["model"], "dimensions": retriever.index.dimensions}
+        answer_cache = SemanticCache(
+            threshold=settings.SEMANTIC_CACHE_THRESHOLD,
+            max_items=settings.SEMANTIC_CACHE_MAX_ITEMS,
+            ttl=settings.SEMANTIC_CACHE_TTL_SECONDS,
+            **embedding
+        )
+    coordinator = RunCoordinator(
+        debounce=settings.RUN_DEBOUNCE_SECONDS,
+        max_wait=settings.RUN_MAX_WAIT_SECONDS,
+        cancel_stale=settings.RUN_CANCEL_STALE
+    )
+    realtime = None
+    if settings.VOICE_MODE == "realtime":
+        if audio.available:
+            # the realtime client needs websockets, which only this mode requires
+            from realtime import RealtimeVoice
+            realtime = RealtimeVoice(
+                model=settings.REALTIME_MODEL,
+                voice=settings.REALTIME_VOICE,
+                history_turns=settings.REALTIME_HISTORY_TURNS,
+                timeout=settings.REALTIME_TIMEOUT_SECONDS
+            )
+        else:
+            logging.warning("VOICE_MODE=realtime needs ffmpeg to decode voice notes, using the Whisper chain")
+    client = OpenAIService(settings.ASSISTANT_ID, settings.OPENAI_API_KEY,settings.VECTOR_STORE_ID,
+                           max_speech_bytes=settings.MAX_SPEECH_BYTES,
+                           thread_registry=thread_registry,
+                           stream_runs=settings.STREAM_RUNS,
+                           scheduler=scheduler,
+                           tts_cache=tts_cache,
+                           photo_moods=photo_moods,
+                           validator=validator,
+                           value_writer=value_writer,
+                           user_values=user_values,
+                           audio=audio,
+                           transcripts=transcripts,
+                           answer_cache=answer_cache,
+                           retriever=retriever,
+                           coordinator=coordinator,
+                           realtime=realtime,
+                           thread_context=thread_context)
+    # with MIGRATE_ON_START off, `python migrate.py` is expected to have run before
+    await bootstrap(client, storage.redis, migrate=settings.MIGRATE_ON_START,
+                    x_arguments=migration_arguments(settings))
+    analytics = AnalyticsService(
+        settings.AMPLITUDE_API_KEY,
+        endpoint=settings.AMPLITUDE_ENDPOINT,
+        queue_size=settings.ANALYTICS_QUEUE_SIZE,
+        batch_size=settings.ANALYTICS_BATCH_SIZE,
+        flush_interval=settings.ANALYTICS_FLUSH_INTERVAL,
+        spill_path=settings.ANALYTICS_SPILL_PATH
+    )
+    await analytics.start()
+    job_queue = JobQueue(
+        storage.redis,
+        stream=settings.JOB_STREAM,
+        max_attempts=settings.JOB_MAX_ATTEMPTS,
+        claim_idle_ms=settings.JOB_CLAIM_IDLE_SECONDS * 1000,
+        lock_seconds=settings.JOB_LOCK_SECONDS,
+        lock_wait_seconds=settings.JOB_LOCK_WAIT_SECONDS,
+        retry_backoff=settings.JOB_RETRY_BACKOFF_SECONDS
+    )
+    metrics = None
+    if settings.METRICS_PORT:
+        components = {
+            "scheduler": scheduler,
+            "threads": thread_registry.stats,
+            "thread_context": thread_context.stats,
+            "tts_cache": tts_cache,
+            "photo_moods": photo_moods.stats,
+            "validation": validator.stats,
+            "user_values": user_values.stats,
+            "value_writer": value_writer.stats,
+            "audio": audio.stats,
+            "transcripts": transcripts.stats,
+            "runs": coordinator.stats,
+            "fsm_storage": storage.stats,
+            "analytics": analytics.stats,
+            "jobs": job_queue.stats,
+            "db_pool": pool_snapshot
+        }
+        if answer_cache is not None:
+            components["answer_cache"] = answer_cache.stats
+        if retriever is not None:
+            components["retrieval"] = retriever.stats
+        if realtime is not None:
+            components["realtime"] = realtime.stats
+        metrics = await start_metrics_server(settings.METRICS_HOST, settings.METRICS_PORT, components=components)
+    # outer middlewares run in registration order, so this one also times the intake hand-off
+    dp.update.outer_middleware(MetricsMiddleware(settings.SLOW_UPDATE_SECONDS))
     dp.update.middleware(ContextMiddleware(client, bot, settings,analytics))
     dp.include_router(router)
-    await bot.delete_webhook(drop_pending_updates=False)
-    logging.info('Bot starting')
-    await dp.start_polling(bot)
+    logging.info(f'Bot starting as {settings.APP_ROLE} in {settings.BOT_MODE} mode')
+    try:
+        if settings.APP_ROLE == "worker":
+            # no updates from Telegram here, only jobs queued by the intake processes
+            worker = JobWorker(job_queue, dp, bot, settings.WORKER_NAME or None, settings.WORKER_CONCURRENCY)
+            # on shutdown, jobs in hand finish and are acknowledged instead of waiting to be reclaimed
+            loop = asyncio.get_running_loop()
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                loop.add_signal_handler(signum, worker.stop)
+            await worker.run()
+            return
+        if settings.APP_ROLE == "intake":
+            await job_queue.ensure_group()
+            dp.update.outer_middleware(IntakeMiddleware(job_queue))
+        if settings.BOT_MODE == "webhook":
+            await run_webhook(
+                dp, bot,
+                url=settings.WEBHOOK_URL,
+                secret_token=settings.WEBHOOK_SECRET,
+                host=settings.WEBHOOK_HOST,
+                port=settings.WEBHOOK_PORT,
+                path=settings.WEBHOOK_PATH,
+                order_window=settings.WEBHOOK_ORDER_WINDOW_SECONDS,
+                queue_size=settings.WEBHOOK_QUEUE_SIZE
+            )
+        else:
+            await bot.delete_webhook(drop_pending_updates=False)
+            await dp.start_polling(bot)
+    finally:
+        await thread_context.close()
+        await analytics.close()
+        await value_writer.close()
+        await dispose_engine()
+        if metrics is not None:
+            await metrics.cleanup()
 
 
 if __name__ == "__main__":
@@ -1,17 +1,26 @@
 import asyncio
 import logging
+import time
+from functools import partial
 from io import BytesIO
+from typing import Optional
 
 from aiogram import Router, types, Bot
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
-from aiogram.types import Message
+from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, Message
 from openai import AsyncOpenAI
 from aiogram import F
 
 from analytics import AnalyticsService
-from openai_client import OpenAIService, validate_value, process_assistant_response
-from utils import generate_unique_name, cleanup_files
+from bootstrap import answer_fingerprint
+from config import Settings
+from metrics import count_tokens, stage
+from openai_client import OpenAIService, validate_value, process_assistant_response, process_realtime_voice
+from run_coordinator import Turn
+from streaming import ProgressiveReply, StreamTimings
+from thread_context import approx_tokens
+from work_queue import JobProgress
 
 router = Router()
 
@@ -21,18 +30,55 @@ async def start(message: types.Message):
     await message.answer("👋 Отправьте голосовое сообщение для общения с AI")
 
 
+def values_reply(page):
+    if not page.items:
+        return "У вас пока нет сохранённых ценностей", None
+    text = "📋 Ваши ценности:\n\n" + "\n".join(f"• {item['name']} — {item['description']}" for item in page.items)
+    markup = None
+    if page.next_cursor is not None:
+        markup = InlineKeyboardMarkup(inline_keyboard=[[
+            InlineKeyboardButton(text="Ещё ➡️", callback_data=f"values:{page.next_cursor}")
+        ]])
+    return text, markup
+
+
+@router.message(Command("values"))
+async def list_values(message: types.Message, client_ai: OpenAIService):
+    page = await client_ai.user_values.page(message.from_user.id)
+    text, markup = values_reply(page)
+    await message.answer(text, reply_markup=markup)
+
+
+@router.callback_query(F.data.startswith("values:"))
+async def more_values(callback: CallbackQuery, client_ai: OpenAIService):
+    cursor = callback.data.split(":", 1)[1]
+    try:
+        page = await client_ai.user_values.page(callback.from_user.id, cursor)
+    except ValueError:
+        # a button from before cursors carried the name; start over
+        logging.info(f"Unreadable values cursor: {cursor}")
+        page = await client_ai.user_values.page(callback.from_user.id)
+    text, markup = values_reply(page)
+    await callback.message.answer(text, reply_markup=markup)
+    await callback.answer()
+
+
 @router.message(F.photo)
 async def handle_photo(
         message: types.Message,
         client_ai: OpenAIService,
         analytics: AnalyticsService,
-        bot: Bot
+        bot: Bot,
+        job: Optional[JobProgress] = None
 ):
+    if job is not None and job.get("replied"):
+        # an earlier attempt of this job already answered
+        return
     try:
-        file = await bot.get_file(message.photo[-1].file_id)
-        image_url = f"https://api.telegram.org/file/bot{bot.token}/{file.file_path}"
-        mood = await client_ai.analyze_mood(image_url)
+        mood = await client_ai.analyze_photo(bot, message.photo, message.from_user.id)
         await message.answer(f"Ваше настроение: {mood}")
+        if job is not None:
+            await job.mark("replied")
 
         analytics.track_event(
             user_id=message.from_user.id,
@@ -45,28 +91,39 @@ async def handle_photo(
         await message.answer("Ошибка обработки фото")
 
 @router.message(F.content_type.in_({'voice', 'audio'}))
-async def handle_voice(message: types.Message, client_ai: OpenAIService, bot: Bot,analytics):
+async def handle_voice(message: types.Message, client_ai: OpenAIService, bot: Bot,analytics,settings: Settings,
+                       job: Optional[JobProgress] = None):
+    if job is not None and job.get("replied"):
+        return
     try:
-        audio_path = f"voice_{generate_unique_name()}.ogg"
-        file = await bot.get_file(message.voice.file_id)
-        await bot.download_file(file.file_path, audio_path)
-
-        with open(audio_path, "rb") as f:
-            transcript = await client_ai.client.audio.transcriptions.create(
-                file=f, model="whisper-1"
+        media = message.voice or message.audio
+        if client_ai.realtime is not None:
+            text, audio = await process_realtime_voice(
+                message.from_user.id, client_ai, bot, media, settings.MAX_VOICE_BYTES
             )
+        else:
+            transcript = await client_ai.voice_to_text(bot, media, message.from_user.id, settings.MAX_VOICE_BYTES)
 
-        text,audio = await process_assistant_response(
-            user_id=message.from_user.id,
-            client_ai=client_ai,
-            input_text=transcript.text,
-            is_voice=True,
-            bot=bot
-        )
+            text,audio = await process_assistant_response(
+                user_id=message.from_user.id,
+                client_ai=client_ai,
+                input_text=transcript,
+                is_voice=True,
+                bot=bot
+            )
         if not audio:
             await message.answer(text)
         else:
-            await message.answer_voice(audio,caption=text[:1000])
+            try:
+                with stage("upload"):
+                    sent = await message.answer_voice(audio,caption=text[:1000])
+            except Exception as e:
+                logging.error(f"Voice reply error: {str(e)}")
+                await message.answer(text)
+            else:
+                await client_ai.remember_voice(text, sent)
+        if job is not None:
+            await job.mark("replied")
 
         analytics.track_event(
             user_id=message.from_user.id,
@@ -78,48 +135,148 @@ async def handle_voice(message: types.Message, client_ai: OpenAIService, bot: Bo
         logging.error(f"Voice processing error: {str(e)}")
         await message.answer(f"🚨 Ошибка обработки аудио: {str(e)}")
 
-    finally:
-        cleanup_files(audio_path)
-
 @router.message(~F.voice & ~F.audio & ~F.photo & ~F.command)  # catch text messages that are not voice, audio, photo, or commands
-async def answer_user_question(message: Message, state: FSMContext, client_ai: OpenAIService):
+async def answer_user_question(message: Message, state: FSMContext, client_ai: OpenAIService, settings: Settings,
+                               job: Optional[JobProgress] = None):
     user_input = message.text.strip()
-    if not user_input:
+    if not user_input or (job is not None and job.get("replied")):
         return
+    # Messages sent in a quick burst get one answer, and a user's runs never overlap on the thread
+    async with client_ai.coordinator.turn(message.from_user.id, user_input) as turn:
+        if turn is not None:
+            await answer_turn(message, state, client_ai, settings, turn, job)
+
+
+async def answer_turn(message: Message, state: FSMContext, client_ai: OpenAIService, settings: Settings, turn: Turn,
+                      job: Optional[JobProgress] = None):
+    user_input = turn.text
+    user_id = message.from_user.id
+    scheduler = client_ai.scheduler
+    coordinator = client_ai.coordinator
 
     # 1. Retrieve or create an OpenAI conversation thread for this user
     data = await state.get_data()  # FSM state data for this user (Chat + User in Aiogram)
-    thread_id = data.get("thread_id")
-    if thread_id is None:
-        # No thread yet for this user: create a new thread and store it
-        thread = await client_ai.client.beta.threads.create(
-            # We could attach tool_resources here if needed, but since the assistant has it, it's not required
+
+    # A user who talked to the assistant recently may be asking a follow-up,
+    # which only the thread can answer; everyone else can get a cached answer
+    cache, lookup = client_ai.answer_cache, None
+    if cache is not None:
+        if time.time() - data.get("thread_active_at", 0) < settings.SEMANTIC_CACHE_BYPASS_SECONDS:
+            cache.bypass()
+        else:
+            lookup = await cache.lookup(client_ai, user_input, answer_fingerprint(client_ai), user_id)
+            if lookup.answer is not None:
+                await message.answer(lookup.answer)
+                if job is not None:
+                    await job.mark("replied")
+                return
+    started = time.perf_counter()
+
+    # A new user gets a thread; an existing one is reused to maintain context across messages,
+    # until it grows past the rollover size and is replaced by one seeded with its summary
+    context = client_ai.thread_context
+    # only an answer given without any earlier conversation is fit to share with other users
+    fresh = data.get("thread_id") is None
+    thread_id = await context.thread_for(client_ai, state, data, user_id)
+
+    # 2. Send the user's message to the OpenAI thread, unless an earlier attempt of this job did
+    if job is not None and job.get("posted") == thread_id:
+        content = user_input
+    else:
+        content = await client_ai.with_context(user_input, user_id,
+                                               lookup.embedding if lookup is not None else None)
+        await scheduler.create(
+            "threads", user_id,
+            client_ai.client.beta.threads.messages.create,
+            thread_id=thread_id,
+            role="user",
+            content=content
         )
-        thread_id = thread.id
-        await state.update_data(thread_id=thread_id)
-    # If a thread exists, we will reuse it to maintain context across messages
+        if job is not None:
+            await job.mark("posted", thread_id)
+
+    async def finish(run=None, answer_text: str = "", run_seconds=None):
+        # the thread's size and age go into the FSM data together with the activity time
+        fields = context.after_turn(client_ai, data, user_id, approx_tokens(content) + approx_tokens(answer_text),
+                                    run, run_seconds)
+        await state.update_data(thread_active_at=time.time(), **fields)
 
-    # 2. Send the user's message to the OpenAI thread
-    await client_ai.client.beta.threads.messages.create(
-        thread_id=thread_id,
-        role="user",
-        content=user_input
-    )
+    async def replied():
+        if job is not None:
+            await job.mark("replied")
+
+    if turn.superseded:
+        # newer messages arrived meanwhile; their turn answers this one too
+        await finish()
+        return
 
     # 3. Run the assistant to get a response (using the pre-configured assistant with file_search)
-    run = await client_ai.client.beta.threads.runs.create_and_poll(
-        thread_id=thread_id,
-        assistant_id=client_ai.assistant_id   # use the existing assistant with file_search
-    )
+    if client_ai.stream_runs:
+        # Stream the answer into one message that is edited as tokens arrive
+        reply = ProgressiveReply(message, interval=settings.STREAM_EDIT_INTERVAL)
+        timings = StreamTimings()
+
+        async def push(delta: str):
+            turn.delivering = True
+            await reply.push(delta)
+
+        run_started = time.perf_counter()
+        with stage("assistant_run"):
+            run, answer_text = await client_ai.stream_run(
+                thread_id, user_id,
+                on_text=push,
+                timings=timings,
+                on_run=lambda created: coordinator.attach(
+                    turn, partial(client_ai.cancel_run, thread_id, created.id, user_id)
+                ),
+                **context.run_params()
+            )
+        run_seconds = time.perf_counter() - run_started
+        count_tokens("assistant_run", run)
+        status = run.status if run is not None else "unknown"
+        if status == "cancelled" and turn.superseded:
+            # the next turn answers this message together with the newer ones
+            await reply.finish()
+        elif status == "completed":
+            await reply.finish(answer_text)
+            if lookup is not None and fresh:
+                cache.store(lookup, answer_text, time.perf_counter() - started)
+        else:
+            await reply.finish()
+            await message.answer(f"⚠️ Assistant run did not complete (status: {status}).")
+        await replied()
+        logging.debug(f"Text run: ttft={timings.time_to_first_token} total={timings.total}")
+        await finish(run, answer_text or "", run_seconds)
+        return
+
+    run_started = time.perf_counter()
+    with stage("assistant_run"):
+        # created and polled separately, so a newer message can cancel the run in between
+        run = await client_ai.poll_run(
+            thread_id, user_id,
+            on_run=lambda created: coordinator.attach(
+                turn, partial(client_ai.cancel_run, thread_id, created.id, user_id)
+            ),
+            **context.run_params()
+        )
+    run_seconds = time.perf_counter() - run_started
+    count_tokens("assistant_run", run)
+    if run.status == "cancelled" and turn.superseded:
+        await finish(run, "", run_seconds)
+        return
 
     # 4. Retrieve the assistant's answer from the thread messages
     if run.status == "completed":
-        messages = await client_ai.client.beta.threads.messages.list(thread_id)
+        messages = await scheduler.call("threads", user_id, client_ai.client.beta.threads.messages.list, thread_id)
         # The latest assistant message should be included.
         # Assuming messages.data[0] is the assistant's reply (OpenAI Beta may return latest first):
         answer_text = messages.data[0].content[0].text.value
+        if lookup is not None and fresh:
+            cache.store(lookup, answer_text, time.perf_counter() - started)
     else:
         answer_text = f"⚠️ Assistant run did not complete (status: {run.status})."
 
     # 5. Send the answer back to the user
-    await message.answer(answer_text)
\ No newline at end of file
+    await message.answer(answer_text)
+    await replied()
+    await finish(run, answer_text if run.status == "completed" else "", run_seconds)
@@ -0,0 +1,148 @@
+import logging
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram.dispatcher.middlewares.base import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+from aiohttp import web
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+
+logger = logging.getLogger(__name__)
+
+# OpenAI calls and uploads take seconds, so the buckets reach further than the defaults
+BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120)
+STAGES = (
+    "telegram_download", "whisper", "retrieval", "run_queue", "assistant_run", "realtime", "tool_call", "validation",
+    "db_write", "tts", "upload", "summary"
+)
+
+STAGE_SECONDS = Histogram("bot_stage_seconds", "Latency of one pipeline stage", ["stage"], buckets=BUCKETS)
+UPDATE_SECONDS = Histogram("bot_update_seconds", "End-to-end handling time of a Telegram update", ["kind"],
+                           buckets=BUCKETS)
+ERRORS = Counter("bot_errors_total", "Errors by pipeline stage", ["stage"])
+OPENAI_TOKENS = Counter("bot_openai_tokens_total", "Tokens billed by OpenAI", ["endpoint", "kind"])
+# by thread age in turns, to see what a growing thread costs
+THREAD_PROMPT_TOKENS = Histogram("bot_thread_prompt_tokens", "Prompt tokens of a run on a user's thread", ["age"],
+                                 buckets=(250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000, 128000))
+THREAD_RUN_SECONDS = Histogram("bot_thread_run_seconds", "Latency of a run on a user's thread", ["age"],
+                               buckets=BUCKETS)
+OPENAI_RETRIES = Counter("bot_openai_retries_total", "OpenAI calls retried after a rate limit", ["endpoint"])
+
+
+@contextmanager
+def stage(name: str):
+    """Times the block into ``bot_stage_seconds`` and counts it in ``bot_errors_total`` if it raises"""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        ERRORS.labels(stage=name).inc()
+        raise
+    finally:
+        STAGE_SECONDS.labels(stage=name).observe(time.perf_counter() - started)
+
+
+def count_tokens(endpoint: str, response) -> None:
+    """Adds the ``usage`` block of an OpenAI response or run, if it has one"""
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    # realtime responses report input/output tokens
+    for field, kind in (("prompt_tokens", "prompt"), ("completion_tokens", "completion"),
+                        ("input_tokens", "prompt"), ("output_tokens", "completion")):
+        value = getattr(usage, field, None)
+        if value:
+            OPENAI_TOKENS.labels(endpoint=endpoint, kind=kind).inc(value)
+
+
+def update_kind(update: Update) -> str:
+    message = update.message
+    if message is None:
+        return update.event_type
+    if message.voice or message.audio:
+        return "voice"
+    if message.photo:
+        return "photo"
+    if message.text and message.text.startswith("/"):
+        return "command"
+    return "text"
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """Outer update middleware: times every update end to end and logs the slow ones"""
+
+    def __init__(self, slow_seconds: float = 10.0):
+        super().__init__()
+        self.slow_seconds = slow_seconds
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: Update, data: Dict[str, Any]):
+        kind = update_kind(event)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            ERRORS.labels(stage="update").inc()
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            UPDATE_SECONDS.labels(kind=kind).observe(elapsed)
+            if elapsed >= self.slow_seconds:
+                user = data.get("event_from_user")
+                logger.warning("slow update", extra={
+                    "update_id": event.update_id,
+                    "kind": kind,
+                    "user_id": user.id if user else None,
+                    "seconds": round(elapsed, 3)
+                })
+
+
+class SnapshotCollector:
+    """Publishes the ``snapshot()`` counters of the bot's components as gauges.
+
+    ``components`` maps a name to an object with ``snapshot()`` or to a
+    callable returning a dict. Nested dicts are flattened, non-numbers skipped.
+    """
+
+    def __init__(self, components: Dict[str, Any]):
+        self.components = components
+
+    def _values(self, prefix: str, snapshot: dict):
+        for key, value in snapshot.items():
+            name = f"{prefix}_{key}"
+            if isinstance(value, dict):
+                yield from self._values(name, value)
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                yield name, value
+
+    def collect(self):
+        for component, source in self.components.items():
+            try:
+                snapshot = source() if callable(source) else source.snapshot()
+            except Exception as e:
+                logger.warning(f"Snapshot of {component} failed: {e}")
+                continue
+            gauge = GaugeMetricFamily(f"bot_{component}", f"Counters of {component}", labels=["name"])
+            for name, value in self._values(component, snapshot):
+                gauge.add_metric([name[len(component) + 1:]], value)
+            yield gauge
+
+
+async def start_metrics_server(host: str = "0.0.0.0", port: int = 9100,
+                               components: Optional[Dict[str, Any]] = None) -> web.AppRunner:
+    """Serves ``/metrics`` from the event loop, so snapshots are read on the loop that owns them"""
+    if components:
+        REGISTRY.register(SnapshotCollector(components))
+
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(body=generate_latest(REGISTRY), headers={"Content-Type": CONTENT_TYPE_LATEST})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Metrics on http://{host}:{port}/metrics")
+    return runner
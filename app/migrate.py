@@ -0,0 +1,37 @@
+"""Upgrade the database schema and exit.
+
+    python migrate.py [revision] [-x unique_values=true]
+
+The ``-x`` arguments default to those MIGRATE_ON_START uses, taken from
+the settings (MIGRATE_UNIQUE_VALUES); ones given here come after them.
+
+Meant for an init container or a release step, with MIGRATE_ON_START=false
+on the bot itself. It imports neither aiogram nor openai, so it starts in a
+fraction of the bot's time.
+"""
+import argparse
+import asyncio
+
+from bootstrap import migration_arguments, run_migrations
+from config import Settings
+from database import dispose_engine, get_engine
+from logging_config import setup_logging
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("revision", nargs="?", default="head")
+    parser.add_argument("-x", action="append", default=[], help="passed to the migrations like alembic's -x")
+    args = parser.parse_args()
+
+    settings = Settings()
+    setup_logging(settings.LOG_LEVEL, settings.LOG_JSON)
+    get_engine(settings)
+    try:
+        await run_migrations(args.revision, migration_arguments(settings) + args.x)
+    finally:
+        await dispose_engine()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,21 +1,100 @@
+import asyncio
 import json
 import logging
+from contextlib import nullcontext
+from dataclasses import dataclass
+from functools import partial
+from typing import TYPE_CHECKING, Any, Optional, Union
 
 from aiogram import types, Bot
+from aiogram.types import InputFile
 from openai import AsyncOpenAI, OpenAI
 
-from database import AsyncSessionLocal
-from models import UserValue
-from utils import generate_unique_name, cleanup_files
+from audio import SpeechInputFile, DEFAULT_MAX_SPEECH_BYTES, DEFAULT_MAX_VOICE_BYTES, download_voice, synthesize_speech
+from audio_processing import AudioProcessor
 from config import Settings
+from metrics import count_tokens, stage
+from run_coordinator import RunCoordinator
+from scheduler import OpenAIScheduler
+from semantic_cache import SemanticCache
+from streaming import SpeechSegments, stream_run
+from thread_context import ThreadContext
+from thread_registry import ThreadRegistry
+from transcripts import TranscriptCache
+from tts_cache import TTSCache
+from user_values import UserValuesStore
+from validation import DUPLICATE, INVALID, VALID, ValueValidator
+from value_writer import ValueWriter
+from vision import PhotoMoodAnalyzer
+
+if TYPE_CHECKING:
+    # optional features, imported by main.py only when they are turned on
+    from realtime import RealtimeVoice
+    from retrieval import Retriever
+
+VALUE_SAVED_TEXT = "✅ Ценность сохранена!"
+VALUE_INVALID_TEXT = "🚫 Некорректное описание. Попробуйте снова."
+VALUE_DUPLICATE_TEXT = "📌 Эта ценность у вас уже сохранена."
+STATIC_REPLIES = (VALUE_SAVED_TEXT, VALUE_INVALID_TEXT, VALUE_DUPLICATE_TEXT)
+VALUE_REPLIES = {VALID: VALUE_SAVED_TEXT, INVALID: VALUE_INVALID_TEXT, DUPLICATE: VALUE_DUPLICATE_TEXT}
+RUN_TERMINAL_STATUSES = {"requires_action", "cancelled", "completed", "failed", "expired", "incomplete"}
+
+
+@dataclass
+class Conversation:
+    """Assistants API state of a single request, owned by the caller"""
+    user_id: Optional[int] = None
+    thread_id: Optional[str] = None
+    run: Any = None
+
+    @property
+    def run_id(self) -> Optional[str]:
+        return self.run.id if self.run else None
 
 
 class OpenAIService:
-    def __init__(self, assistant_id: str,api_key: str,vector_store_id=None):
-        self.client = AsyncOpenAI(api_key=api_key)
+    def __init__(self, assistant_id: str,api_key: str,vector_store_id=None,
+                 max_speech_bytes: int = DEFAULT_MAX_SPEECH_BYTES,
+                 thread_registry: Optional[ThreadRegistry] = None,
+                 stream_runs: bool = False,
+                 scheduler: Optional[OpenAIScheduler] = None,
+                 tts_cache: Optional[TTSCache] = None,
+                 photo_moods: Optional[PhotoMoodAnalyzer] = None,
+                 validator: Optional[ValueValidator] = None,
+                 value_writer: Optional[ValueWriter] = None,
+                 user_values: Optional[UserValuesStore] = None,
+                 audio: Optional[AudioProcessor] = None,
+                 transcripts: Optional[TranscriptCache] = None,
+                 answer_cache: Optional[SemanticCache] = None,
+                 retriever: Optional["Retriever"] = None,
+                 coordinator: Optional[RunCoordinator] = None,
+                 realtime: Optional["RealtimeVoice"] = None,
+                 thread_context: Optional[ThreadContext] = None):
+        # retries of 429s, connection errors, timeouts and 5xx are done by the scheduler, one request
+        # at a time, which keeps them fair and rate-limited; runs are created and polled by poll_run
+        self.client = AsyncOpenAI(api_key=api_key, max_retries=0)
+        self.scheduler = scheduler or OpenAIScheduler()
         self.assistant_id = assistant_id
-        self.thread=None
-        self.run=None
+        self.thread_registry = thread_registry
+        self.stream_runs = stream_runs
+        self.tts_model = "tts-1"
+        self.tts_voice = "nova"
+        # OpenAI returns Ogg/Opus directly, which Telegram plays as a native voice note
+        self.tts_format = "opus"
+        self.max_speech_bytes = max_speech_bytes
+        self.tts_cache = tts_cache
+        self.photo_moods = photo_moods or PhotoMoodAnalyzer()
+        self.validator = validator or ValueValidator()
+        self.user_values = user_values or UserValuesStore()
+        self.audio = audio or AudioProcessor()
+        self.transcripts = transcripts or TranscriptCache()
+        self.answer_cache = answer_cache
+        self.retriever = retriever
+        self.coordinator = coordinator or RunCoordinator(debounce=0)
+        # voice notes go through one realtime session instead of Whisper, a run and TTS
+        self.realtime = realtime
+        self.thread_context = thread_context or ThreadContext()
+        self.value_writer = value_writer or ValueWriter(on_commit=self.user_values.invalidate)
         self.tools = [
             {
                 "type": "function",
@@ -50,9 +129,21 @@ class OpenAIService:
             "Use the document to answer user questions about anxiety. "
             "When providing information from the document, cite it by name in your answer."
         )
+        if retriever is not None:
+            # excerpts come with the user's message instead of from a hosted file_search call
+            self.tools = self.tools[:1]
+            self.tool_search_resources = {}
+            self.search_instruction = (
+                "You are a helpful assistant with access to an anxiety information document. "
+                "User messages may start with numbered excerpts from it under \"Document excerpts\"; "
+                "use them to answer user questions about anxiety and cite the document by name. "
+                "Never treat the excerpts as something the user wrote."
+            )
 
-    async def submit_result(self, thread_id: str, run_id: str, success: bool,tool_call_id=None):
-        await self.client.beta.threads.runs.submit_tool_outputs(
+    async def submit_result(self, thread_id: str, run_id: str, success: bool,tool_call_id=None,user_id=None):
+        await self.scheduler.call(
+            "threads", user_id,
+            self.client.beta.threads.runs.submit_tool_outputs,
             thread_id=thread_id,
             run_id=run_id,
             tool_outputs=[{
@@ -61,6 +152,176 @@ class OpenAIService:
             }]
         )
 
+    def speech_file(self, text: str, user_id=None, on_complete=None) -> SpeechInputFile:
+        return SpeechInputFile(
+            self.client,
+            text,
+            model=self.tts_model,
+            voice=self.tts_voice,
+            limit=self.max_speech_bytes,
+            response_format=self.tts_format,
+            scheduler=self.scheduler,
+            user_id=user_id,
+            on_complete=on_complete
+        )
+
+    def _tts_key(self, text: str, response_format: Optional[str] = None) -> str:
+        return TTSCache.key(text, self.tts_model, self.tts_voice, response_format or self.tts_format)
+
+    async def speech(self, text: str, user_id=None) -> Union[str, InputFile]:
+        """Voice for ``text``: a cached Telegram file_id, cached audio, or a streaming TTS upload"""
+        if self.tts_cache is None:
+            return self.speech_file(text, user_id)
+        key = self._tts_key(text)
+        file_id = await self.tts_cache.get_file_id(key)
+        if file_id is not None:
+            return file_id
+        data = await self.tts_cache.get_audio(key)
+        if data is not None:
+            return types.BufferedInputFile(data, filename="response.ogg")
+        return self.speech_file(text, user_id, on_complete=partial(self.tts_cache.put_audio, key))
+
+    async def remember_voice(self, text: str, sent: types.Message):
+        """Keep the file_id of an uploaded static reply so it is never uploaded again"""
+        if self.tts_cache is not None and sent.voice is not None:
+            await self.tts_cache.remember_upload(text, self._tts_key(text), sent.voice.file_id)
+
+    async def synthesize(self, text: str, user_id=None, response_format: Optional[str] = None) -> bytes:
+        response_format = response_format or self.tts_format
+        key = self._tts_key(text, response_format) if self.tts_cache is not None else None
+        if key is not None:
+            data = await self.tts_cache.get_audio(key)
+            if data is not None:
+                return data
+        with stage("tts"):
+            data = await self.scheduler.call(
+                "tts", user_id,
+                synthesize_speech,
+                self.client,
+                text,
+                model=self.tts_model,
+                voice=self.tts_voice,
+                limit=self.max_speech_bytes,
+                response_format=response_format
+            )
+        if key is not None:
+            await self.tts_cache.put_audio(key, data)
+        return data
+
+    async def transcribe(self, file, user_id=None) -> str:
+        with stage("whisper"):
+            transcript = await self.scheduler.call(
+                "transcription", user_id,
+                self.client.audio.transcriptions.create,
+                file=file, model="whisper-1"
+            )
+        return transcript.text
+
+    async def transcribe_voice(self, data: bytes, user_id=None) -> str:
+        """Trimmed 16 kHz mono chunks of a voice note, transcribed in parallel"""
+        if not self.audio.available:
+            return await self.transcribe(("voice.ogg", data), user_id)
+        chunks = await self.audio.prepare_voice(data)
+        texts = await asyncio.gather(*(
+            self.transcribe((f"voice{n}.ogg", chunk), user_id) for n, chunk in enumerate(chunks)
+        ))
+        return " ".join(text.strip() for text in texts if text.strip())
+
+    async def voice_to_text(self, bot: Bot, media, user_id=None, limit: int = DEFAULT_MAX_VOICE_BYTES) -> str:
+        """Transcript of a voice or audio message, from cache when the same audio was heard before"""
+        return await self.transcripts.transcribe(bot, self, media, user_id, limit)
+
+    def speech_segments(self, user_id=None) -> SpeechSegments:
+        """Segments are synthesized as PCM and encoded to Opus once, or as concatenable MP3 without ffmpeg"""
+        response_format = "pcm" if self.audio.available else "mp3"
+        return SpeechSegments(partial(self.synthesize, user_id=user_id, response_format=response_format))
+
+    def segments_file(self, segments: SpeechSegments) -> InputFile:
+        if self.audio.available:
+            return segments.input_file("response.ogg", encode=self.audio.encode_opus)
+        return segments.input_file("response.mp3")
+
+    async def _thread_id(self, user_id: Optional[int]) -> str:
+        if self.thread_registry is not None and user_id is not None:
+            return await self.thread_registry.acquire(user_id, self)
+        thread = await self.scheduler.create("threads", user_id, self.client.beta.threads.create)
+        return thread.id
+
+    def thread_turn(self, user_id: Optional[int]):
+        """Held around a run on the user's reused thread; without a registry every run has its own thread"""
+        if self.thread_registry is None or user_id is None:
+            return nullcontext()
+        return self.thread_registry.turn(user_id)
+
+    async def release_tool_run(self, conversation: Conversation):
+        """Call after submit_result so a reused thread waits for the run to finish"""
+        if self.thread_registry is not None and conversation.user_id is not None:
+            await self.thread_registry.mark_pending_run(conversation.user_id, conversation.run_id)
+
+    async def cancel_run(self, thread_id: str, run_id: str, user_id=None):
+        """Cancel a run that a newer message made stale; it may have finished in the meantime"""
+        try:
+            await self.scheduler.call(
+                "threads", user_id,
+                self.client.beta.threads.runs.cancel, run_id, thread_id=thread_id
+            )
+        except Exception as e:
+            logging.info(f"Run {run_id} not cancelled: {e}")
+
+    async def wait_run(self, thread_id: str, run_id: str, user_id=None):
+        """Poll a run until it stops; every poll is one request, retried on its own"""
+        while True:
+            response = await self.scheduler.call(
+                "threads", user_id,
+                self.client.beta.threads.runs.with_raw_response.retrieve, run_id, thread_id=thread_id
+            )
+            run = response.parse()
+            if run.status in RUN_TERMINAL_STATUSES:
+                return run
+            await asyncio.sleep(int(response.headers.get("openai-poll-after-ms") or 1000) / 1000)
+
+    async def poll_run(self, thread_id: str, user_id=None, on_run=None, **params):
+        """Create a run and poll it until it stops.
+
+        The run is created exactly once (only a 429 is retried), then handed
+        to ``on_run``; a failing poll never starts another run.
+        """
+        run = await self.scheduler.create(
+            "assistant_run", user_id,
+            self.client.beta.threads.runs.create,
+            thread_id=thread_id,
+            assistant_id=self.assistant_id,
+            **params
+        )
+        if on_run is not None:
+            on_run(run)
+        return await self.wait_run(thread_id, run.id, user_id)
+
+    async def stream_run(self, thread_id: str, user_id=None, on_text=None, timings=None, on_run=None, **params):
+        """``streaming.stream_run`` on the assistant: an interrupted stream is followed by polling its run"""
+        return await self.scheduler.create(
+            "assistant_run", user_id,
+            stream_run,
+            self.client,
+            thread_id,
+            self.assistant_id,
+            on_text=on_text,
+            timings=timings,
+            on_run=on_run,
+            resume=partial(self._resume_run, thread_id, user_id=user_id),
+            **params
+        )
+
+    async def _resume_run(self, thread_id: str, run, user_id=None):
+        run = await self.wait_run(thread_id, run.id, user_id)
+        if run.status != "completed":
+            return run, None
+        messages = await self.scheduler.call(
+            "threads", user_id,
+            self.client.beta.threads.messages.list, thread_id, limit=1
+        )
+        return run, messages.data[0].content[0].text.value
+
     async def update_new_instruction(self):
         await self.client.beta.assistants.update(
             assistant_id=self.assistant_id,
@@ -68,52 +329,119 @@ class OpenAIService:
             tools=self.tools,
             tool_resources=self.tool_search_resources
         )
-        print("✅ Assistant updated with file_search tool and attached vector store.")
-        logging.warning("✅ Assistant updated with file_search tool and attached vector store.")
+        logging.info("Assistant updated with file_search tool and attached vector store")
+
+    async def mood_completion(self, image_url: str, user_id=None, detail: str = "auto"):
+        response = await self.scheduler.call(
+            "vision", user_id,
+            self.client.chat.completions.create,
+            model="gpt-4o",
+            messages=[{
+                "role": "user",
+                "content": [
+                    {"type": "text",
+                     "text": "Опиши настроение человека на фото. Только одно слово из списка: радость, грусть, злость, нейтральное, страх, удивление"},
+                    {"type": "image_url", "image_url": {"url": image_url, "detail": detail}}
+                ]
+            }],
+            max_tokens=300
+        )
+        count_tokens("vision", response)
+        return response
 
-    async def analyze_mood(self, image_url: str) -> str:
+    async def analyze_mood(self, image_url: str, user_id=None, detail: str = "auto") -> str:
         try:
-            response = await self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=[{
-                    "role": "user",
-                    "content": [
-                        {"type": "text",
-                         "text": "Опиши настроение человека на фото. Только одно слово из списка: радость, грусть, злость, нейтральное, страх, удивление"},
-                        {"type": "image_url", "image_url": {"url": image_url}}
-                    ]
-                }],
-                max_tokens=300
-            )
-            logging.warning(response.choices)
+            response = await self.mood_completion(image_url, user_id, detail)
             return response.choices[0].message.content
         except Exception as e:
             logging.error(f"Vision API error: {e.__dict__}")
             return "Не могу определить настроение"
 
-    async def identify_value(self, user_input: str) -> dict:
+    async def analyze_photo(self, bot: Bot, photos, user_id=None) -> str:
+        try:
+            return await self.photo_moods.analyze(bot, self, photos, user_id)
+        except Exception as e:
+            logging.error(f"Vision API error: {e}")
+            return "Не могу определить настроение"
+
+    async def request_validation(self, description: str, user_id=None) -> bool:
+        """Ask GPT-4 whether ``description`` is a legitimate personal value"""
+        response = await self.scheduler.call(
+            "validation", user_id,
+            self.client.chat.completions.create,
+            model="gpt-4-1106-preview",
+            messages=[{
+                "role": "system",
+                "content": """
+                Validate if the input is a legitimate personal value. 
+                Return JSON: {"valid": boolean}
+                Criteria:
+                1. Minimum 3 words
+                2. No offensive content
+                3. Meaningful concept
+                """
+            }, {
+                "role": "user",
+                "content": description
+            }],
+            response_format={"type": "json_object"}
+        )
+        count_tokens("validation", response)
+        result = json.loads(response.choices[0].message.content)
+        return result.get("valid", False)
+
+    async def with_context(self, text: str, user_id=None, embedding=None) -> str:
+        """Message content for the thread: ``text`` with local excerpts when the local retriever is on.
+
+        ``embedding`` is the answer cache's (model, vector) of the question, searched with if it fits the index.
+        """
+        if self.retriever is None:
+            return text
+        with stage("retrieval"):
+            return await self.retriever.with_context(self, text, user_id, embedding)
+
+    async def identify_value(self, user_input: str, conversation: Conversation, on_text=None) -> dict:
         try:
-            thread = await self.client.beta.threads.create()
-            await self.client.beta.threads.messages.create(
-                thread_id=thread.id,
-                content=user_input,
+            conversation.thread_id = await self._thread_id(conversation.user_id)
+            await self.scheduler.create(
+                "threads", conversation.user_id,
+                self.client.beta.threads.messages.create,
+                thread_id=conversation.thread_id,
+                content=await self.with_context(user_input, conversation.user_id),
                 role="user"
             )
-            self.thread=thread
 
-            run = await self.client.beta.threads.runs.create_and_poll(
-                thread_id=thread.id,
-                assistant_id=self.assistant_id,
-                tools=self.tools
-            )
-            self.run=run
+            text = None
+            with stage("assistant_run"):
+                if self.stream_runs:
+                    run, text = await self.stream_run(
+                        conversation.thread_id, conversation.user_id,
+                        on_text=on_text,
+                        tools=self.tools,
+                        **self.thread_context.run_params()
+                    )
+                    if run is None:
+                        return {"error": "Поток выполнения завершился без статуса"}
+                else:
+                    run = await self.poll_run(
+                        conversation.thread_id, conversation.user_id,
+                        tools=self.tools,
+                        **self.thread_context.run_params()
+                    )
+            count_tokens("assistant_run", run)
+            conversation.run = run
 
             if run.status == "requires_action":
                 return self._handle_function_call(run)
 
             if run.status == "completed":
-                messages = await self.client.beta.threads.messages.list(thread.id)
-                return {"response": messages.data[0].content[0].text.value}
+                if text is None:
+                    messages = await self.scheduler.call(
+                        "threads", conversation.user_id,
+                        self.client.beta.threads.messages.list, conversation.thread_id, limit=1
+                    )
+                    text = messages.data[0].content[0].text.value
+                return {"response": text}
 
             return {"error": f"Неизвестный статус выполнения: {run.status}"}
 
@@ -127,6 +455,7 @@ class OpenAIService:
             if tool_call.function.name == "save_value":
                 return {
                     "function_call": {
+                        "id": tool_call.id,
                         "name": "save_value",
                         "arguments": json.loads(tool_call.function.arguments)
                     }
@@ -137,22 +466,24 @@ class OpenAIService:
             logging.error(f"Ошибка обработки функции: {str(e)}")
             return {"error": f"Некорректный формат запроса: {str(e)}"}
 
-    async def process_message(self, text: str) -> str:
+    async def process_message(self, text: str, user_id: Optional[int] = None) -> str:
         try:
-            thread = await self.client.beta.threads.create()
-            await self.client.beta.threads.messages.create(
-                thread_id=thread.id,
+            thread_id = await self._thread_id(user_id)
+            await self.scheduler.create(
+                "threads", user_id,
+                self.client.beta.threads.messages.create,
+                thread_id=thread_id,
                 content=text,
                 role="user"
             )
 
-            run = await self.client.beta.threads.runs.create_and_poll(
-                thread_id=thread.id,
-                assistant_id=self.assistant_id
-            )
+            run = await self.poll_run(thread_id, user_id, **self.thread_context.run_params())
 
             if run.status == "completed":
-                messages = await self.client.beta.threads.messages.list(thread.id)
+                messages = await self.scheduler.call(
+                    "threads", user_id,
+                    self.client.beta.threads.messages.list, thread_id, limit=1
+                )
                 return messages.data[0].content[0].text.value
             else:
                 return f"❌ Ошибка обработки: {run.status}"
@@ -162,38 +493,32 @@ class OpenAIService:
 
 
 
-async def validate_value(description: str,client:OpenAIService) -> bool:
+async def validate_value(description: str,client:OpenAIService,user_id=None) -> bool:
     """Validate value description using GPT-4"""
-
-
     try:
-        response = await client.client.chat.completions.create(
-            model="gpt-4-1106-preview",
-            messages=[{
-                "role": "system",
-                "content": """
-                Validate if the input is a legitimate personal value. 
-                Return JSON: {"valid": boolean}
-                Criteria:
-                1. Minimum 3 words
-                2. No offensive content
-                3. Meaningful concept
-                """
-            }, {
-                "role": "user",
-                "content": description
-            }],
-            response_format={"type": "json_object"}
-        )
-
-        result = json.loads(response.choices[0].message.content)
-        return result.get("valid", False)
-
+        return await client.request_validation(description, user_id)
     except Exception as e:
-        print(f"Validation error: {str(e)}")
+        logging.error(f"Validation error: {str(e)}")
         return False
 
 
+async def store_value(client_ai: OpenAIService, user_id, args: dict) -> str:
+    """Validate a ``save_value`` call and save the value if it passes; returns the validation outcome"""
+    try:
+        row = ValueWriter.make_row(user_id, args)
+    except ValueError as e:
+        logging.info(f"Value rejected: {e}")
+        return INVALID
+    with stage("validation"):
+        outcome = await client_ai.validator.review(row["description"], client_ai, user_id, name=row["value_name"])
+    if outcome == VALID:
+        # batched with other users' values; returns once committed
+        with stage("db_write"):
+            if not await client_ai.value_writer.save(user_id, args):
+                return DUPLICATE
+    return outcome
+
+
 async def process_assistant_response(
         user_id,
         client_ai: OpenAIService,
@@ -201,34 +526,33 @@ async def process_assistant_response(
         is_voice: bool = False,
         bot: Bot = None
 ):
-    audio_path = None
     audio=None
-    speech_path = None
-    session = None
     response_text=""
+    conversation = Conversation(user_id=user_id)
+    segments = client_ai.speech_segments(user_id) if is_voice and client_ai.stream_runs else None
     try:
-        async with AsyncSessionLocal() as session:
-            result = await client_ai.identify_value(input_text)
+        # the thread is reused, so another message of the user waits until this run is done
+        async with client_ai.thread_turn(user_id):
+            result = await client_ai.identify_value(
+                input_text,
+                conversation,
+                on_text=segments.push if segments is not None else None
+            )
 
             if "error" in result:
+                if segments is not None:
+                    segments.cancel()
                 return f"Ошибка: {result['error']}"
 
             if "function_call" in result:
                 args = result["function_call"]["arguments"]
-                tool_call = client_ai.run.required_action.submit_tool_outputs.tool_calls[0]
-                if await validate_value(args["description"],client_ai):
-                    value = UserValue(
-                        user_id=user_id,
-                        value_name=args["name"],
-                        description=args["description"]
-                    )
-                    session.add(value)
-                    await session.commit()
-                    response_text = "✅ Ценность сохранена!"
-                    await client_ai.submit_result(client_ai.thread.id,client_ai.run.id,True,tool_call.id)
-                else:
-                    response_text = "🚫 Некорректное описание. Попробуйте снова."
-                    await client_ai.submit_result(client_ai.thread.id, client_ai.run.id, False,tool_call.id)
+                tool_call_id = result["function_call"]["id"]
+                with stage("tool_call"):
+                    outcome = await store_value(client_ai, user_id, args)
+                    response_text = VALUE_REPLIES[outcome]
+                    await client_ai.submit_result(conversation.thread_id, conversation.run_id, outcome == VALID,
+                                                  tool_call_id, user_id)
+                    await client_ai.release_tool_run(conversation)
 
                 if not is_voice:
                     return response_text
@@ -236,29 +560,57 @@ async def process_assistant_response(
             else:
                 response_text = result["response"]
 
-            if is_voice:
-                speech_path = f"speech_{generate_unique_name()}.mp3"
+        if is_voice:
+            if segments is not None and "response" in result:
+                segments.finish()
+                if segments:
+                    audio = client_ai.segments_file(segments)
+            if audio is None:
+                if segments is not None:
+                    segments.cancel()
+                audio = await client_ai.speech(response_text, user_id)
 
-                response = await client_ai.client.audio.speech.create(
-                    model="tts-1",
-                    voice="nova",
-                    input=response_text
-                )
 
-                response.stream_to_file(speech_path)
+    except Exception as e:
+        logging.error(f"Error: {str(e)}")
+        if segments is not None:
+            segments.cancel()
+        response_text = f"🚨 Ошибка: {str(e)}"
+
+    finally:
+        return response_text,audio
 
-                with open(speech_path, "rb") as audio_file:
-                    audio = types.BufferedInputFile(
-                        audio_file.read(),
-                        filename="response.mp3"
-                    )
 
+async def process_realtime_voice(
+        user_id,
+        client_ai: OpenAIService,
+        bot: Bot,
+        media,
+        limit: int = DEFAULT_MAX_VOICE_BYTES
+):
+    """(text, audio) for a voice note from one realtime session, or from the Whisper chain if the session fails"""
+    try:
+        data = (await download_voice(bot, media.file_id, limit)).getvalue()
+        pcm = await client_ai.audio.decode_pcm(data, client_ai.realtime.sample_rate)
+        with stage("realtime"):
+            reply = await client_ai.realtime.respond(client_ai, pcm, user_id)
+    except Exception as e:
+        logging.warning(f"Realtime voice failed, using the Whisper chain: {e}")
+        client_ai.realtime.stats.fallbacks += 1
+        transcript = await client_ai.voice_to_text(bot, media, user_id, limit)
+        return await process_assistant_response(user_id, client_ai, transcript, is_voice=True, bot=bot)
 
+    audio = None
+    try:
+        if reply.function_call is not None:
+            with stage("tool_call"):
+                outcome = await store_value(client_ai, user_id, reply.function_call["arguments"])
+            response_text = VALUE_REPLIES[outcome]
+            audio = await client_ai.speech(response_text, user_id)
+        else:
+            response_text = reply.text
+            audio = types.BufferedInputFile(await client_ai.audio.encode_opus(reply.audio), filename="response.ogg")
     except Exception as e:
         logging.error(f"Error: {str(e)}")
-        await session.rollback()
         response_text = f"🚨 Ошибка: {str(e)}"
-
-    finally:
-        cleanup_files(audio_path, speech_path)
-        return response_text,audio
\ No newline at end of file
+    return response_text, audio
@@ -0,0 +1,202 @@
+import asyncio
+import base64
+import json
+import logging
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, asdict
+from typing import Deque, List, Optional, Tuple
+
+from metrics import count_tokens, stage
+
+logger = logging.getLogger(__name__)
+
+# pcm16 of the Realtime API: 24 kHz mono s16le
+PCM_SAMPLE_RATE = 24000
+PCM_BYTES_PER_SECOND = PCM_SAMPLE_RATE * 2
+# input_audio_buffer.append events stay well below the 15 MiB event limit
+APPEND_BYTES = 256 * 1024
+
+
+class RealtimeError(RuntimeError):
+    pass
+
+
+@dataclass
+class RealtimeReply:
+    """What one session made of a voice note"""
+    transcript: str = ""
+    text: str = ""
+    audio: bytes = b""
+    # {"id", "name", "arguments"} like ``OpenAIService._handle_function_call`` returns
+    function_call: Optional[dict] = None
+
+
+@dataclass
+class RealtimeStats:
+    sessions: int = 0
+    answered: int = 0
+    tool_calls: int = 0
+    failures: int = 0
+    fallbacks: int = 0
+    audio_in_seconds: float = 0.0
+    audio_out_seconds: float = 0.0
+    session_seconds: float = 0.0
+    first_audio_seconds: float = 0.0
+
+    def snapshot(self) -> dict:
+        return {
+            **asdict(self),
+            "audio_in_seconds": round(self.audio_in_seconds, 1),
+            "audio_out_seconds": round(self.audio_out_seconds, 1),
+            "session_seconds": round(self.session_seconds, 3),
+            "first_audio_seconds": round(self.first_audio_seconds, 3)
+        }
+
+
+def _message(role: str, text: str) -> dict:
+    return {"type": "message", "role": role,
+            "content": [{"type": "text" if role == "assistant" else "input_text", "text": text}]}
+
+
+class RealtimeVoice:
+    """Voice notes answered by one Realtime API session instead of Whisper, an assistant run and TTS.
+
+    The decoded note goes into a fresh session as 24 kHz PCM; the model
+    hears it, transcribes it, and either speaks its answer or calls
+    ``save_value``. The call is handed back to the caller, which validates
+    and stores the value exactly as for a run. Sessions do not see the
+    Assistants thread, so the last ``history_turns`` exchanges of each user
+    are kept here, per process, and replayed as conversation items. With the
+    local retriever on, excerpts for the transcript are added before the
+    response is requested; hosted file_search has no realtime equivalent.
+    """
+
+    def __init__(
+            self,
+            model: str = "gpt-4o-realtime-preview",
+            voice: str = "shimmer",
+            history_turns: int = 4,
+            history_users: int = 10000,
+            timeout: float = 60.0
+    ):
+        self.model = model
+        self.voice = voice
+        self.history_turns = history_turns
+        self.history_users = history_users
+        self.timeout = timeout
+        self.sample_rate = PCM_SAMPLE_RATE
+        self.stats = RealtimeStats()
+        self._history: "OrderedDict[int, Deque[Tuple[str, str]]]" = OrderedDict()
+
+    def history(self, user_id: Optional[int]) -> List[Tuple[str, str]]:
+        return list(self._history.get(user_id, ()))
+
+    def remember(self, user_id: Optional[int], transcript: str, text: str):
+        if user_id is None or not self.history_turns or not transcript:
+            return
+        turns = self._history.pop(user_id, None) or deque(maxlen=self.history_turns)
+        turns.append((transcript, text))
+        self._history[user_id] = turns
+        while len(self._history) > self.history_users:
+            self._history.popitem(last=False)
+
+    def session_config(self, client_ai) -> dict:
+        return {
+            "modalities": ["text", "audio"],
+            "instructions": client_ai.search_instruction + (
+                " Your reply is spoken: answer in the user's language, briefly and without markup."
+            ),
+            "voice": self.voice,
+            "input_audio_format": "pcm16",
+            "output_audio_format": "pcm16",
+            "input_audio_transcription": {"model": "whisper-1"},
+            # one committed note per session, the response is requested explicitly
+            "turn_detection": None,
+            "tools": [{"type": "function", **tool["function"]} for tool in client_ai.tools
+                      if tool["type"] == "function"],
+            "tool_choice": "auto"
+        }
+
+    async def respond(self, client_ai, pcm: bytes, user_id: Optional[int] = None) -> RealtimeReply:
+        """Answer the PCM of one voice note in a new session; raises ``RealtimeError`` if the session fails"""
+        self.stats.sessions += 1
+        self.stats.audio_in_seconds += len(pcm) / PCM_BYTES_PER_SECOND
+        reply = RealtimeReply()
+        started = time.perf_counter()
+        try:
+            async with client_ai.scheduler.slot("realtime", user_id):
+                await asyncio.wait_for(self._converse(client_ai, pcm, user_id, reply), self.timeout)
+        except Exception:
+            self.stats.failures += 1
+            raise
+        finally:
+            self.stats.session_seconds += time.perf_counter() - started
+        if reply.function_call is not None:
+            self.stats.tool_calls += 1
+        else:
+            self.stats.answered += 1
+            self.stats.audio_out_seconds += len(reply.audio) / PCM_BYTES_PER_SECOND
+            self.remember(user_id, reply.transcript, reply.text)
+        return reply
+
+    async def _converse(self, client_ai, pcm: bytes, user_id: Optional[int], reply: RealtimeReply):
+        async with client_ai.client.beta.realtime.connect(model=self.model) as connection:
+            await connection.session.update(session=self.session_config(client_ai))
+            for transcript, text in self.history(user_id):
+                await connection.conversation.item.create(item=_message("user", transcript))
+                await connection.conversation.item.create(item=_message("assistant", text))
+            for i in range(0, len(pcm), APPEND_BYTES):
+                await connection.input_audio_buffer.append(audio=base64.b64encode(pcm[i:i + APPEND_BYTES]).decode())
+            await connection.input_audio_buffer.commit()
+            committed = time.perf_counter()
+
+            # without the retriever nothing waits for the transcript
+            requested = client_ai.retriever is None
+            if requested:
+                await connection.response.create()
+            audio, text = [], []
+            transcribed = responded = False
+            async for event in connection:
+                if event.type == "error":
+                    raise RealtimeError(event.error.message)
+                if event.type == "conversation.item.input_audio_transcription.completed":
+                    reply.transcript = event.transcript.strip()
+                    transcribed = True
+                elif event.type == "conversation.item.input_audio_transcription.failed":
+                    logger.info(f"Realtime transcription failed: {event.error.message}")
+                    transcribed = True
+                elif event.type == "response.audio.delta":
+                    if not audio:
+                        self.stats.first_audio_seconds += time.perf_counter() - committed
+                    audio.append(base64.b64decode(event.delta))
+                elif event.type == "response.audio_transcript.delta":
+                    text.append(event.delta)
+                elif event.type == "response.function_call_arguments.done":
+                    if event.name != "save_value":
+                        raise RealtimeError(f"Неизвестная функция: {event.name}")
+                    reply.function_call = {"id": event.call_id, "name": event.name,
+                                           "arguments": json.loads(event.arguments)}
+                elif event.type == "response.done":
+                    count_tokens("realtime", event.response)
+                    if event.response.status not in ("completed", "incomplete"):
+                        raise RealtimeError(f"Response {event.response.status}: {event.response.status_details}")
+                    responded = True
+
+                if transcribed and not requested:
+                    requested = True
+                    if reply.transcript:
+                        with stage("retrieval"):
+                            excerpts = await client_ai.retriever.excerpts(client_ai, reply.transcript, user_id)
+                        if excerpts:
+                            await connection.conversation.item.create(item=_message("system", excerpts))
+                    await connection.response.create()
+                if transcribed and responded:
+                    break
+            else:
+                raise RealtimeError("Session closed before the response was done")
+
+        reply.text = "".join(text).strip()
+        reply.audio = b"".join(audio)
+        if reply.function_call is None and not reply.audio:
+            raise RealtimeError("Response without audio")
@@ -0,0 +1,353 @@
+import asyncio
+import glob
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from dataclasses import dataclass, asdict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from metrics import count_tokens
+
+logger = logging.getLogger(__name__)
+
+DOCUMENT_PATTERNS = ("*.txt", "*.md", "*.pdf")
+META_FILE = "meta.json"
+
+_PARAGRAPHS = re.compile(r"\n\s*\n")
+_SENTENCES = re.compile(r"(?<=[.!?…])\s+")
+
+
+def read_document(path: str) -> str:
+    if path.lower().endswith(".pdf"):
+        try:
+            from pypdf import PdfReader
+        except ImportError:
+            raise RuntimeError(f"pypdf is needed to index {path}; install it or convert the file to text")
+        return "\n\n".join(page.extract_text() or "" for page in PdfReader(path).pages)
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+def chunk_text(text: str, max_chars: int = 1200, overlap: int = 200) -> List[str]:
+    """Chunks of at most ``max_chars`` made of whole paragraphs or sentences where possible.
+
+    Each chunk repeats up to ``overlap`` characters from the end of the
+    previous one, so a passage cut at a boundary is still found whole.
+    """
+    pieces = []
+    for paragraph in _PARAGRAPHS.split(text):
+        paragraph = " ".join(paragraph.split())
+        if not paragraph:
+            continue
+        if len(paragraph) <= max_chars:
+            pieces.append(paragraph)
+            continue
+        for sentence in _SENTENCES.split(paragraph):
+            pieces.extend(sentence[i:i + max_chars] for i in range(0, len(sentence), max_chars))
+
+    chunks, current = [], ""
+    for piece in pieces:
+        if current and len(current) + 1 + len(piece) > max_chars:
+            chunks.append(current)
+            tail = current[-overlap:] if overlap else ""
+            current = tail[tail.find(" ") + 1:] if " " in tail else tail
+        current = f"{current} {piece}".strip() if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the ``k`` highest scores, best first"""
+    if len(scores) <= k:
+        return np.argsort(-scores)
+    best = np.argpartition(-scores, k)[:k]
+    return best[np.argsort(-scores[best])]
+
+
+class DocumentIndex:
+    """Chunk embeddings in a memory-mapped float32 matrix with a JSON sidecar.
+
+    ``<path>/meta.json`` lists the documents, their chunks and the
+    generation of the matrix file ``vectors-<generation>.f32`` that holds
+    one unit-length row per chunk. Writers create a new generation and
+    swap the sidecar atomically, so a reader always sees a matching pair
+    and picks up a rebuilt index on its next ``refresh``.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.meta: Optional[dict] = None
+        self.matrix: Optional[np.ndarray] = None
+        self._mtime = 0.0
+
+    def __len__(self):
+        return 0 if self.matrix is None else len(self.matrix)
+
+    @property
+    def dimensions(self) -> Optional[int]:
+        return self.meta["dimensions"] if self.meta else None
+
+    def _matrix_path(self, generation: int) -> str:
+        return os.path.join(self.path, f"vectors-{generation}.f32")
+
+    def _read(self) -> Optional[Tuple[dict, np.ndarray, float]]:
+        """Sidecar, matrix and sidecar mtime if the sidecar changed on disk since the last load"""
+        meta_path = os.path.join(self.path, META_FILE)
+        try:
+            mtime = os.stat(meta_path).st_mtime
+        except FileNotFoundError:
+            return None
+        if mtime == self._mtime:
+            return None
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        rows = len(meta["chunks"])
+        matrix = np.memmap(self._matrix_path(meta["generation"]), dtype=np.float32, mode="r",
+                           shape=(rows, meta["dimensions"])) if rows else np.zeros((0, meta["dimensions"]),
+                                                                                  dtype=np.float32)
+        return meta, matrix, mtime
+
+    def _apply(self, loaded) -> bool:
+        if loaded is None:
+            return False
+        self.meta, self.matrix, self._mtime = loaded
+        return True
+
+    def refresh(self) -> bool:
+        """(Re)load the index if the sidecar changed on disk"""
+        return self._apply(self._read())
+
+    async def refresh_async(self) -> bool:
+        """``refresh`` with the file reads in a worker thread, cheap enough to await before every search"""
+        return self._apply(await asyncio.to_thread(self._read))
+
+    def search(self, vector: np.ndarray, k: int = 4, block_rows: int = 16384) -> List[Tuple[float, dict]]:
+        """Top ``k`` chunks by cosine similarity to the unit ``vector``.
+
+        The matrix is scored in blocks of ``block_rows``, so pages are
+        read in sequence and the temporaries stay small however large the
+        index grows; each block keeps its own top ``k`` for the final merge.
+        """
+        if not len(self):
+            return []
+        vector = np.asarray(vector, dtype=np.float32)
+        best_scores, best_rows = [], []
+        for start in range(0, len(self.matrix), block_rows):
+            scores = self.matrix[start:start + block_rows] @ vector
+            rows = top_k(scores, k)
+            best_scores.append(scores[rows])
+            best_rows.append(rows + start)
+        scores, rows = np.concatenate(best_scores), np.concatenate(best_rows)
+        order = top_k(scores, k)
+        return [(float(scores[i]), self.meta["chunks"][int(rows[i])]) for i in order]
+
+    def vectors_of(self, document: str) -> Optional[np.ndarray]:
+        entry = self.meta["documents"].get(document) if self.meta else None
+        if entry is None:
+            return None
+        return np.asarray(self.matrix[entry["rows"][0]:entry["rows"][1]])
+
+    def write(self, documents: Dict[str, dict], chunks: List[dict], vectors: np.ndarray, model: str):
+        """Store a complete new generation and make it current"""
+        os.makedirs(self.path, exist_ok=True)
+        generation = self.meta["generation"] + 1 if self.meta else 0
+        matrix_path = self._matrix_path(generation)
+        np.asarray(vectors, dtype=np.float32).tofile(matrix_path)
+        meta = {"generation": generation, "model": model, "dimensions": int(vectors.shape[1]),
+                "documents": documents, "chunks": chunks}
+        tmp = os.path.join(self.path, META_FILE + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp, os.path.join(self.path, META_FILE))
+        previous = self.meta["generation"] if self.meta else None
+        self._mtime = 0.0
+        self.refresh()
+        # readers still mapping the previous generation keep it until they refresh
+        for name in os.listdir(self.path):
+            if name.startswith("vectors-") and name not in (f"vectors-{generation}.f32", f"vectors-{previous}.f32"):
+                os.remove(os.path.join(self.path, name))
+
+
+@dataclass
+class IngestReport:
+    unchanged: int = 0
+    added: int = 0
+    changed: int = 0
+    removed: int = 0
+    chunks: int = 0
+    chunks_embedded: int = 0
+    seconds: float = 0.0
+
+
+async def update_index(
+        index: DocumentIndex,
+        root: str,
+        embed: Callable[[List[str]], Awaitable[np.ndarray]],
+        model: str,
+        dimensions: int,
+        max_chars: int = 1200,
+        overlap: int = 200,
+        batch_size: int = 256
+) -> IngestReport:
+    """Bring ``index`` in line with the documents under ``root``.
+
+    Only new and changed documents (by content hash) are chunked and
+    embedded; the rows of unchanged ones are copied from the current
+    generation. A different embedding model or size re-embeds everything.
+    """
+    started = time.perf_counter()
+    report = IngestReport()
+    index.refresh()
+    reusable = index.meta is not None and (index.meta["model"], index.dimensions) == (model, dimensions)
+    previous = index.meta["documents"] if reusable else {}
+
+    documents, chunks, parts, pending = {}, [], [], []
+    for path in document_paths(root):
+        name = os.path.relpath(path, root if os.path.isdir(root) else os.path.dirname(root))
+        digest = _file_hash(path)
+        old = previous.get(name)
+        if old is not None and old["sha256"] == digest:
+            report.unchanged += 1
+            vectors = index.vectors_of(name)
+            texts = [chunk["text"] for chunk in index.meta["chunks"][old["rows"][0]:old["rows"][1]]]
+        else:
+            report.changed += old is not None
+            report.added += old is None
+            texts = chunk_text(read_document(path), max_chars, overlap)
+            vectors = None
+            pending.append((len(parts), texts))
+        start = len(chunks)
+        chunks.extend({"document": name, "chunk": n, "text": text} for n, text in enumerate(texts))
+        documents[name] = {"sha256": digest, "rows": [start, len(chunks)]}
+        parts.append(vectors)
+    report.removed = len(set(previous) - set(documents))
+
+    texts = [text for _, document_texts in pending for text in document_texts]
+    embedded = [await embed(texts[i:i + batch_size]) for i in range(0, len(texts), batch_size)]
+    embedded = np.concatenate(embedded) if embedded else None
+    offset = 0
+    for position, document_texts in pending:
+        parts[position] = embedded[offset:offset + len(document_texts)]
+        offset += len(document_texts)
+    report.chunks = len(chunks)
+    report.chunks_embedded = len(texts)
+
+    if pending or report.removed or not reusable:
+        vectors = np.concatenate([part for part in parts if part is not None and len(part)]) if chunks \
+            else np.zeros((0, dimensions), dtype=np.float32)
+        index.write(documents, chunks, vectors, model)
+    report.seconds = time.perf_counter() - started
+    return report
+
+
+def document_paths(root: str) -> List[str]:
+    if os.path.isfile(root):
+        return [root]
+    return sorted({path for pattern in DOCUMENT_PATTERNS
+                   for path in glob.glob(os.path.join(root, "**", pattern), recursive=True)})
+
+
+def unit_rows(vectors) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+@dataclass
+class RetrievalStats:
+    queries: int = 0
+    chunks_returned: int = 0
+    empty: int = 0
+    failures: int = 0
+    # queries that reused the answer cache's embedding instead of embedding again
+    shared_embeddings: int = 0
+    embed_seconds: float = 0.0
+    search_seconds: float = 0.0
+
+    def snapshot(self) -> dict:
+        return {
+            **asdict(self),
+            "embed_seconds": round(self.embed_seconds, 3),
+            "search_seconds": round(self.search_seconds, 3)
+        }
+
+
+class Retriever:
+    """Local stand-in for the hosted ``file_search``: embeds the question and searches the ``DocumentIndex``"""
+
+    def __init__(self, index: DocumentIndex, top_k: int = 4, min_score: float = 0.3):
+        self.index = index
+        self.top_k = top_k
+        self.min_score = min_score
+        self.stats = RetrievalStats()
+
+    async def embed(self, client_ai, texts: List[str], user_id=None) -> np.ndarray:
+        response = await client_ai.scheduler.call(
+            "embeddings", user_id,
+            client_ai.client.embeddings.create,
+            model=self.index.meta["model"], input=texts, dimensions=self.index.dimensions
+        )
+        count_tokens("embeddings", response)
+        return unit_rows([item.embedding for item in response.data])
+
+    def accepts(self, embedding: Optional[Tuple[str, np.ndarray]]) -> bool:
+        """Whether a (model, unit vector) pair embedded elsewhere can be searched with as it is"""
+        return (embedding is not None and self.index.meta is not None
+                and embedding[0] == self.index.meta["model"] and len(embedding[1]) == self.index.dimensions)
+
+    async def search(self, client_ai, query: str, user_id=None,
+                     embedding: Optional[Tuple[str, np.ndarray]] = None) -> List[Tuple[float, dict]]:
+        """Chunks matching ``query``; ``embedding`` of the query saves the embeddings call when it fits the index"""
+        await self.index.refresh_async()
+        if not len(self.index):
+            return []
+        self.stats.queries += 1
+        if self.accepts(embedding):
+            self.stats.shared_embeddings += 1
+            vector = embedding[1]
+        else:
+            started = time.perf_counter()
+            try:
+                vector = (await self.embed(client_ai, [query], user_id))[0]
+            except Exception as e:
+                self.stats.failures += 1
+                logger.warning(f"Retrieval embedding failed: {e}")
+                return []
+            finally:
+                self.stats.embed_seconds += time.perf_counter() - started
+        started = time.perf_counter()
+        results = [(score, chunk) for score, chunk in self.index.search(vector, self.top_k) if score >= self.min_score]
+        self.stats.search_seconds += time.perf_counter() - started
+        self.stats.chunks_returned += len(results)
+        self.stats.empty += not results
+        return results
+
+    async def excerpts(self, client_ai, text: str, user_id=None, embedding=None) -> str:
+        """The best matching excerpts for ``text`` under a "Document excerpts" heading, or "" if none match"""
+        results = await self.search(client_ai, text, user_id, embedding)
+        if not results:
+            return ""
+        excerpts = "\n\n".join(f"[{n}] ({chunk['document']}) {chunk['text']}"
+                               for n, (_, chunk) in enumerate(results, 1))
+        return f"Document excerpts:\n{excerpts}"
+
+    async def with_context(self, client_ai, text: str, user_id=None, embedding=None) -> str:
+        """``text`` preceded by the best matching excerpts, as the message to put on the thread"""
+        excerpts = await self.excerpts(client_ai, text, user_id, embedding)
+        if not excerpts:
+            return text
+        return f"{excerpts}\n\nUser message:\n{text}"
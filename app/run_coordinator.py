@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field, asdict
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from metrics import STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RunCoordinatorStats:
+    messages: int = 0
+    turns: int = 0
+    merged: int = 0
+    # turns that waited for the burst to end, having come in behind a queued or running turn
+    debounced: int = 0
+    superseded: int = 0
+    cancelled: int = 0
+    queue_seconds: float = 0.0
+    max_queue_seconds: float = 0.0
+
+    @property
+    def runs_saved(self) -> int:
+        return self.merged
+
+    def snapshot(self) -> dict:
+        return {
+            **asdict(self),
+            "runs_saved": self.runs_saved,
+            "queue_seconds": round(self.queue_seconds, 3),
+            "max_queue_seconds": round(self.max_queue_seconds, 3)
+        }
+
+
+@dataclass
+class Turn:
+    """Messages of one user answered by a single run"""
+    user_id: int
+    texts: List[str]
+    first_at: float
+    last_at: float
+    queue_seconds: float = 0.0
+    # set once the answer reached the user; such a run is never cancelled
+    delivering: bool = False
+    superseded: bool = False
+    _cancel: Optional[Callable[[], Awaitable]] = field(default=None, repr=False)
+
+    @property
+    def text(self) -> str:
+        return "\n".join(self.texts)
+
+
+@dataclass
+class _Lane:
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    pending: Optional[Turn] = None
+    active: Optional[Turn] = None
+
+
+class RunCoordinator:
+    """One run at a time per user, with bursts of messages merged into one run.
+
+    A message to an idle user starts its run at once. One that comes in
+    while the user's previous turn is still running opens a turn that waits
+    until no new message came for ``debounce`` seconds (``max_wait`` at
+    most); messages arriving meanwhile join it instead of starting runs of
+    their own, so only bursts pay for the wait. A run that has not
+    started delivering its answer is cancelled when a newer message comes
+    in, since the next turn answers everything on the thread at once.
+    Coordination is per process: with several job workers a user's
+    messages are only coordinated within the worker that took them.
+    """
+
+    def __init__(self, debounce: float = 1.5, max_wait: float = 5.0, cancel_stale: bool = True):
+        self.debounce = debounce
+        self.max_wait = max_wait
+        self.cancel_stale = cancel_stale
+        self.stats = RunCoordinatorStats()
+        self._lanes: Dict[int, _Lane] = {}
+        self._tasks = set()
+
+    async def _settle(self, turn: Turn):
+        while True:
+            wait = min(turn.last_at + self.debounce, turn.first_at + self.max_wait) - time.monotonic()
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    def _supersede(self, turn: Turn):
+        if not self.cancel_stale or turn.superseded or turn.delivering:
+            return
+        turn.superseded = True
+        self.stats.superseded += 1
+        if turn._cancel is not None:
+            self._spawn_cancel(turn)
+
+    def _spawn_cancel(self, turn: Turn):
+        self.stats.cancelled += 1
+        task = asyncio.create_task(turn._cancel())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def attach(self, turn: Turn, cancel: Callable[[], Awaitable]):
+        """Give ``turn`` the way to cancel its run, as soon as the run id is known"""
+        turn._cancel = cancel
+        if turn.superseded and not turn.delivering:
+            self._spawn_cancel(turn)
+
+    @asynccontextmanager
+    async def turn(self, user_id: int, text: str) -> AsyncIterator[Optional[Turn]]:
+        """The turn to run for ``text``, or None when it was merged into another message's turn"""
+        self.stats.messages += 1
+        lane = self._lanes.setdefault(user_id, _Lane())
+        now = time.monotonic()
+        if lane.pending is not None:
+            lane.pending.texts.append(text)
+            lane.pending.last_at = now
+            self.stats.merged += 1
+            if lane.active is not None:
+                self._supersede(lane.active)
+            yield None
+            return
+
+        turn = lane.pending = Turn(user_id, [text], now, now)
+        try:
+            if lane.active is not None:
+                self._supersede(lane.active)
+                self.stats.debounced += 1
+                await self._settle(turn)
+            async with lane.lock:
+                lane.pending = None
+                lane.active = turn
+                turn.queue_seconds = time.monotonic() - turn.first_at
+                self.stats.turns += 1
+                self.stats.queue_seconds += turn.queue_seconds
+                self.stats.max_queue_seconds = max(self.stats.max_queue_seconds, turn.queue_seconds)
+                STAGE_SECONDS.labels("run_queue").observe(turn.queue_seconds)
+                try:
+                    yield turn
+                finally:
+                    lane.active = None
+        finally:
+            if lane.pending is turn:
+                lane.pending = None
+            if lane.pending is None and lane.active is None and not lane.lock.locked():
+                self._lanes.pop(user_id, None)
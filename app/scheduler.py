@@ -0,0 +1,212 @@
+import asyncio
+import logging
+import random
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, asdict
+from typing import Dict, Optional
+
+from openai import APIConnectionError, APIError, InternalServerError, RateLimitError
+
+from metrics import OPENAI_RETRIES
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class EndpointLimit:
+    concurrency: int
+    rate: float  # requests per second
+    burst: int
+
+
+DEFAULT_LIMITS = {
+    "transcription": EndpointLimit(concurrency=8, rate=5, burst=10),
+    "threads": EndpointLimit(concurrency=16, rate=20, burst=40),
+    "assistant_run": EndpointLimit(concurrency=8, rate=5, burst=10),
+    "vision": EndpointLimit(concurrency=4, rate=3, burst=6),
+    "tts": EndpointLimit(concurrency=8, rate=5, burst=10),
+    "validation": EndpointLimit(concurrency=8, rate=5, burst=10),
+    "embeddings": EndpointLimit(concurrency=16, rate=50, burst=100),
+    # open sessions, each one voice note long
+    "realtime": EndpointLimit(concurrency=8, rate=5, burst=10),
+    # thread summaries are written in the background and can wait
+    "summary": EndpointLimit(concurrency=2, rate=1, burst=4),
+}
+
+
+@dataclass
+class EndpointStats:
+    queued: int = 0
+    active: int = 0
+    max_queued: int = 0
+    completed: int = 0
+    rate_limited: int = 0
+    # connection errors, timeouts and 5xx responses
+    transient_errors: int = 0
+    retries: int = 0
+    wait_seconds: float = 0.0
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Consume a token and return 0, or return the seconds until one is available"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def drain(self):
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+
+
+class EndpointQueue:
+    """Concurrency slots and rate tokens for one endpoint class, handed out round-robin per user"""
+
+    def __init__(self, limit: EndpointLimit):
+        self.limit = limit
+        self.bucket = TokenBucket(limit.rate, limit.burst)
+        self.waiters: "OrderedDict[object, deque]" = OrderedDict()
+        self.stats = EndpointStats()
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    async def acquire(self, user_id):
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.setdefault(user_id, deque()).append(future)
+        self.stats.queued += 1
+        self.stats.max_queued = max(self.stats.max_queued, self.stats.queued)
+        started = time.monotonic()
+        self._pump()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()
+            else:
+                self.stats.queued -= 1
+                self._discard(user_id, future)
+            raise
+        self.stats.wait_seconds += time.monotonic() - started
+
+    def release(self):
+        self.stats.active -= 1
+        self.stats.completed += 1
+        self._pump()
+
+    def _discard(self, user_id, future):
+        queue = self.waiters.get(user_id)
+        if queue is not None and future in queue:
+            queue.remove(future)
+            if not queue:
+                del self.waiters[user_id]
+
+    def _pump(self):
+        self._timer = None
+        while self.waiters and self.stats.active < self.limit.concurrency:
+            wait = self.bucket.take()
+            if wait > 0:
+                self._timer = asyncio.get_running_loop().call_later(wait, self._pump)
+                return
+            user_id, queue = self.waiters.popitem(last=False)
+            future = queue.popleft()
+            if queue:
+                # the user goes to the back of the line
+                self.waiters[user_id] = queue
+            self.stats.queued -= 1
+            self.stats.active += 1
+            future.set_result(None)
+
+
+class OpenAIScheduler:
+    """Bounded, rate-limited and per-user fair access to OpenAI endpoint classes.
+
+    429 responses are retried with jittered exponential backoff; a 429 also
+    empties the endpoint's token bucket so other callers slow down too.
+    Connection errors, timeouts (``APITimeoutError`` is an
+    ``APIConnectionError``) and 5xx responses are retried the same way,
+    without touching the bucket, except for requests sent through
+    ``create``. Other errors go straight to the caller. A retry repeats the
+    whole callable, so it must be one request: a run is created with
+    ``create`` and polled with ``call``, one request at a time.
+    """
+
+    def __init__(
+            self,
+            limits: Optional[Dict[str, EndpointLimit]] = None,
+            max_retries: int = 4,
+            backoff_base: float = 0.5,
+            backoff_cap: float = 20.0
+    ):
+        self.queues = {name: EndpointQueue(limit) for name, limit in {**DEFAULT_LIMITS, **(limits or {})}.items()}
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+
+    @asynccontextmanager
+    async def slot(self, endpoint: str, user_id=None):
+        queue = self.queues[endpoint]
+        await queue.acquire(user_id)
+        try:
+            yield
+        finally:
+            queue.release()
+
+    async def call(self, endpoint: str, user_id, fn, *args, **kwargs):
+        """Run ``fn``, a single idempotent request, in a slot of ``endpoint``, retrying it as a whole"""
+        return await self._call(endpoint, user_id, True, fn, args, kwargs)
+
+    async def create(self, endpoint: str, user_id, fn, *args, **kwargs):
+        """Like ``call`` for a request that creates something, such as a message or a run.
+
+        Only 429s are retried: OpenAI refuses those before doing anything,
+        while after a connection error or 5xx the object may exist already.
+        """
+        return await self._call(endpoint, user_id, False, fn, args, kwargs)
+
+    async def _call(self, endpoint: str, user_id, transient: bool, fn, args, kwargs):
+        queue = self.queues[endpoint]
+        retried = (RateLimitError, APIConnectionError, InternalServerError) if transient else RateLimitError
+        attempt = 0
+        while True:
+            try:
+                async with self.slot(endpoint, user_id):
+                    return await fn(*args, **kwargs)
+            except (RateLimitError, APIConnectionError, InternalServerError) as e:
+                if isinstance(e, RateLimitError):
+                    queue.stats.rate_limited += 1
+                    queue.bucket.drain()
+                else:
+                    queue.stats.transient_errors += 1
+                if attempt >= self.max_retries or not isinstance(e, retried):
+                    raise
+                delay = self._backoff(attempt, e)
+                queue.stats.retries += 1
+                OPENAI_RETRIES.labels(endpoint=endpoint).inc()
+                attempt += 1
+                reason = "rate limited" if isinstance(e, RateLimitError) else f"failed ({type(e).__name__})"
+                logger.warning(f"OpenAI {endpoint} {reason}, retry {attempt} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+    def _backoff(self, attempt: int, error: APIError) -> float:
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        try:
+            floor = float(retry_after) if retry_after else 0.0
+        except ValueError:
+            floor = 0.0
+        delay = min(self.backoff_cap, self.backoff_base * 2 ** attempt)
+        return max(floor, delay * random.uniform(0.5, 1.5))
+
+    def snapshot(self) -> dict:
+        return {name: asdict(queue.stats) for name, queue in self.queues.items()}
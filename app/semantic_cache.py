@@ -0,0 +1,202 @@
+import logging
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from metrics import count_tokens
+
+logger = logging.getLogger(__name__)
+
+_PUNCTUATION = re.compile(r"[^\w\s]+")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_question(text: str) -> str:
+    text = text.lower().replace("ё", "е")
+    return _SPACES.sub(" ", _PUNCTUATION.sub(" ", text)).strip()
+
+
+@dataclass
+class SemanticCacheStats:
+    exact_hits: int = 0
+    semantic_hits: int = 0
+    misses: int = 0
+    bypassed: int = 0
+    stored: int = 0
+    evictions: int = 0
+    expired: int = 0
+    invalidations: int = 0
+    embed_failures: int = 0
+    embed_seconds: float = 0.0
+    seconds_saved: float = 0.0
+
+    @property
+    def hit_rate(self) -> float:
+        hits = self.exact_hits + self.semantic_hits
+        total = hits + self.misses
+        return hits / total if total else 0.0
+
+    def snapshot(self) -> dict:
+        return {
+            **asdict(self),
+            "hit_rate": round(self.hit_rate, 4),
+            "embed_seconds": round(self.embed_seconds, 3),
+            "seconds_saved": round(self.seconds_saved, 3)
+        }
+
+
+@dataclass
+class CacheLookup:
+    question: str
+    fingerprint: str
+    vector: Optional[np.ndarray] = None
+    answer: Optional[str] = None
+    model: str = ""
+
+    @property
+    def embedding(self) -> Optional[Tuple[str, np.ndarray]]:
+        """(model, unit vector) of the question, for the local retriever to search with"""
+        return (self.model, self.vector) if self.vector is not None else None
+
+
+@dataclass
+class _Entry:
+    question: str
+    answer: str
+    seconds: float
+    expires: float
+
+
+class SemanticCache:
+    """Answers to earlier text questions, matched by embedding similarity.
+
+    Embeddings are unit vectors in a fixed ``max_items`` x ``dimensions``
+    float32 matrix, so a lookup is one matrix-vector product and an argmax.
+    Slots are recycled in LRU order. A question that normalizes to one
+    already stored is served without calling the embeddings API at all.
+    Everything is dropped when the assistant's fingerprint (instructions,
+    tools, vector store, local index generation) changes, since the old
+    answers may no longer hold. Only answers from a brand-new thread are
+    stored, so nothing a user told the assistant reaches someone else.
+    """
+
+    def __init__(
+            self,
+            threshold: float = 0.92,
+            max_items: int = 2000,
+            ttl: float = 24 * 3600,
+            model: str = "text-embedding-3-small",
+            dimensions: int = 256
+    ):
+        self.threshold = threshold
+        self.max_items = max_items
+        self.ttl = ttl
+        self.model = model
+        self.dimensions = dimensions
+        self.matrix = np.zeros((max_items, dimensions), dtype=np.float32)
+        self.fingerprint: Optional[str] = None
+        self.stats = SemanticCacheStats()
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._exact: Dict[str, int] = {}
+        self._free = list(range(max_items - 1, -1, -1))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        self.matrix[:] = 0
+        self._entries.clear()
+        self._exact.clear()
+        self._free = list(range(self.max_items - 1, -1, -1))
+
+    def _check_fingerprint(self, fingerprint: str):
+        if fingerprint != self.fingerprint:
+            if self._entries:
+                self.stats.invalidations += 1
+                self.clear()
+            self.fingerprint = fingerprint
+
+    def _drop(self, slot: int):
+        entry = self._entries.pop(slot)
+        self._exact.pop(entry.question, None)
+        self.matrix[slot] = 0
+        self._free.append(slot)
+
+    def _hit(self, slot: int, semantic: bool) -> Optional[str]:
+        entry = self._entries[slot]
+        if entry.expires < time.monotonic():
+            self.stats.expired += 1
+            self._drop(slot)
+            return None
+        self._entries.move_to_end(slot)
+        if semantic:
+            self.stats.semantic_hits += 1
+        else:
+            self.stats.exact_hits += 1
+        self.stats.seconds_saved += entry.seconds
+        return entry.answer
+
+    async def _embed(self, client_ai, text: str, user_id=None) -> Optional[np.ndarray]:
+        started = time.perf_counter()
+        try:
+            response = await client_ai.scheduler.call(
+                "embeddings", user_id,
+                client_ai.client.embeddings.create,
+                model=self.model, input=text, dimensions=self.dimensions
+            )
+        except Exception as e:
+            self.stats.embed_failures += 1
+            logger.warning(f"Embedding failed, answer cache skipped: {e}")
+            return None
+        finally:
+            self.stats.embed_seconds += time.perf_counter() - started
+        count_tokens("embeddings", response)
+        vector = np.asarray(response.data[0].embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    async def lookup(self, client_ai, text: str, fingerprint: str, user_id=None) -> CacheLookup:
+        """Cached answer for ``text`` if there is one; pass the result to ``store`` after a miss"""
+        self._check_fingerprint(fingerprint)
+        lookup = CacheLookup(normalize_question(text), fingerprint, model=self.model)
+        slot = self._exact.get(lookup.question)
+        if slot is not None:
+            lookup.answer = self._hit(slot, semantic=False)
+            if lookup.answer is not None:
+                return lookup
+        lookup.vector = await self._embed(client_ai, lookup.question, user_id)
+        if lookup.vector is not None and self._entries:
+            scores = self.matrix @ lookup.vector
+            slot = int(np.argmax(scores))
+            if scores[slot] >= self.threshold and slot in self._entries:
+                lookup.answer = self._hit(slot, semantic=True)
+        if lookup.answer is None:
+            self.stats.misses += 1
+        return lookup
+
+    def bypass(self):
+        """Counts a question answered in a live thread, where a cached answer would ignore the context"""
+        self.stats.bypassed += 1
+
+    def store(self, lookup: CacheLookup, answer: str, seconds: float):
+        """Remember the answer to a missed question, ``seconds`` being what producing it took.
+
+        Callers only store answers given on a thread without earlier messages.
+        """
+        if lookup.vector is None or lookup.fingerprint != self.fingerprint or not answer:
+            return
+        slot = self._exact.get(lookup.question)
+        if slot is not None:
+            self._drop(slot)
+        if not self._free:
+            self._drop(next(iter(self._entries)))
+            self.stats.evictions += 1
+        slot = self._free.pop()
+        self.matrix[slot] = lookup.vector
+        self._entries[slot] = _Entry(lookup.question, answer, seconds, time.monotonic() + self.ttl)
+        self._exact[lookup.question] = slot
+        self.stats.stored += 1
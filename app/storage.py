@@ -1,6 +1,336 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from typing import Any, Dict, Optional, Tuple
+
+import msgpack
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import StateType, StorageKey
 from aiogram.fsm.storage.redis import RedisStorage
-from redis.asyncio import Redis
+from redis.asyncio import BlockingConnectionPool, Redis
+from redis.exceptions import ResponseError
+
+logger = logging.getLogger(__name__)
+
+# keyspace events for string commands, generic commands, expiry and eviction
+KEYSPACE_EVENTS = "K$gxe"
+
+
+def pack_data(data: Dict[str, Any]) -> bytes:
+    return msgpack.packb(data, use_bin_type=True)
+
+
+def unpack_data(raw: bytes) -> Dict[str, Any]:
+    if raw[:1] == b"{":
+        # written as JSON by the stock RedisStorage before the switch
+        return json.loads(raw)
+    return msgpack.unpackb(raw, raw=False, strict_map_key=False)
+
+
+def create_redis(
+        redis_url: str,
+        max_connections: int = 64,
+        pool_timeout: float = 5.0,
+        health_check_interval: int = 30,
+        socket_timeout: Optional[float] = None
+) -> Redis:
+    """Client on a bounded pool: callers wait up to ``pool_timeout`` for a free connection instead of failing"""
+    pool = BlockingConnectionPool.from_url(
+        redis_url,
+        max_connections=max_connections,
+        timeout=pool_timeout,
+        health_check_interval=health_check_interval,
+        socket_keepalive=True,
+        socket_connect_timeout=5,
+        socket_timeout=socket_timeout
+    )
+    return Redis(connection_pool=pool)
+
+
+@dataclass
+class FSMStorageStats:
+    hits: int = 0
+    misses: int = 0
+    invalidations: int = 0
+    writes: int = 0
+    flushes: int = 0
+    flush_failures: int = 0
+    resubscribes: int = 0
+    near_cache: bool = False
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def snapshot(self) -> dict:
+        return {**asdict(self), "hit_rate": round(self.hit_rate, 4)}
+
+
+class NearCacheRedisStorage(RedisStorage):
+    """``RedisStorage`` with msgpack data, an in-process near-cache and group-committed writes.
+
+    State and data of recently seen users stay in an LRU of packed values,
+    so the usual get_state/get_data pair of an update costs no round trip;
+    on a miss both parts are fetched with one MGET. The cache is only used
+    while a subscription to Redis keyspace notifications is up: a write
+    from another process evicts the key, and losing the subscription
+    clears everything. Notifications are turned on by the storage only with
+    ``configure_keyspace_events``; otherwise the operator enables them and
+    the near-cache stays off while they are missing. Writes are group-committed: while one pipeline is
+    in flight the next batch collects (for at least ``write_window``
+    seconds), so concurrent writers share round trips; each writer still
+    waits until its own write is stored.
+    """
+
+    def __init__(
+            self,
+            redis: Redis,
+            near_cache_items: int = 10000,
+            near_cache_ttl: float = 300.0,
+            write_window: float = 0.0,
+            configure_keyspace_events: bool = False,
+            **kwargs
+    ):
+        super().__init__(redis=redis, **kwargs)
+        self.near_cache_items = near_cache_items
+        self.near_cache_ttl = near_cache_ttl
+        self.write_window = write_window
+        self.configure_keyspace_events = configure_keyspace_events
+        self.stats = FSMStorageStats()
+        self._cache: "OrderedDict[str, Tuple[Optional[bytes], float]]" = OrderedDict()
+        # notifications our own SETs will produce, which must not evict what we just cached
+        self._own_sets: Dict[str, int] = {}
+        # keys being read, and those of them invalidated while the read was in flight
+        self._reading: Dict[str, int] = {}
+        self._stale = set()
+        self._pending: Dict[str, Tuple[Optional[bytes], Optional[int]]] = {}
+        self._flushed: Optional[asyncio.Future] = None
+        self._flusher: Optional[asyncio.Task] = None
+        self._listener: Optional[asyncio.Task] = None
+        self._listening = asyncio.Event()
+
+    # near-cache
+
+    @property
+    def _cache_on(self) -> bool:
+        return self.near_cache_items > 0 and self._listening.is_set()
+
+    def _cached(self, redis_key: str) -> Tuple[bool, Optional[bytes]]:
+        entry = self._cache.get(redis_key)
+        if entry is None or not self._cache_on:
+            return False, None
+        if entry[1] < time.monotonic():
+            del self._cache[redis_key]
+            return False, None
+        self._cache.move_to_end(redis_key)
+        return True, entry[0]
+
+    def _remember(self, redis_key: str, value: Optional[bytes], written: bool = False):
+        if not self._cache_on:
+            return
+        if written:
+            # a read still in flight may return the value this write replaces
+            if redis_key in self._reading:
+                self._stale.add(redis_key)
+        elif redis_key in self._stale:
+            return
+        self._cache[redis_key] = (value, time.monotonic() + self.near_cache_ttl)
+        self._cache.move_to_end(redis_key)
+        while len(self._cache) > self.near_cache_items:
+            self._cache.popitem(last=False)
+
+    def _invalidate(self, redis_key: str):
+        self._cache.pop(redis_key, None)
+        if redis_key in self._reading:
+            self._stale.add(redis_key)
+        self.stats.invalidations += 1
+
+    async def _read(self, key: StorageKey, part: str) -> Optional[bytes]:
+        redis_key = self.key_builder.build(key, part)
+        found, value = self._cached(redis_key)
+        if found:
+            self.stats.hits += 1
+            return value
+        self.stats.misses += 1
+        if not self._cache_on:
+            return await self.redis.get(redis_key)
+
+        # an update reads its state and then its data, so fetch both at once
+        keys = [self.key_builder.build(key, "state"), self.key_builder.build(key, "data")]
+        for k in keys:
+            self._reading[k] = self._reading.get(k, 0) + 1
+        try:
+            values = await self.redis.mget(keys)
+            for k, v in zip(keys, values):
+                self._remember(k, v)
+        finally:
+            for k in keys:
+                self._reading[k] -= 1
+                if not self._reading[k]:
+                    del self._reading[k]
+                    self._stale.discard(k)
+        return values[keys.index(redis_key)]
+
+    # group-committed writes
+
+    async def _write(self, redis_key: str, value: Optional[bytes], ttl: Optional[int]):
+        self.stats.writes += 1
+        self._pending[redis_key] = (value, ttl)
+        self._remember(redis_key, value, written=True)
+        if self._flushed is None:
+            self._flushed = asyncio.get_running_loop().create_future()
+        flushed = self._flushed
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_all())
+        await asyncio.shield(flushed)
+
+    async def _flush_all(self):
+        # one pipeline in flight at a time; writes issued meanwhile form the next one
+        try:
+            while self._pending:
+                await asyncio.sleep(self.write_window)
+                batch, flushed = self._pending, self._flushed
+                self._pending, self._flushed = {}, None
+                await self._flush(batch, flushed)
+        finally:
+            self._flusher = None
+
+    async def _flush(self, batch: Dict[str, Tuple[Optional[bytes], Optional[int]]], flushed: asyncio.Future):
+        counted = []
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for redis_key, (value, ttl) in batch.items():
+                    if value is None:
+                        pipe.delete(redis_key)
+                    else:
+                        pipe.set(redis_key, value, ex=ttl)
+                        if self._cache_on:
+                            self._own_sets[redis_key] = self._own_sets.get(redis_key, 0) + 1
+                            counted.append(redis_key)
+                await pipe.execute()
+        except Exception as e:
+            self.stats.flush_failures += 1
+            for redis_key in counted:
+                self._forget_own_set(redis_key)
+            for redis_key in batch:
+                self._cache.pop(redis_key, None)
+            flushed.set_exception(e)
+            # retrieved here so a batch without waiters left does not log "exception never retrieved"
+            flushed.exception()
+        else:
+            self.stats.flushes += 1
+            flushed.set_result(None)
+
+    def _forget_own_set(self, redis_key: str):
+        left = self._own_sets.get(redis_key, 0) - 1
+        if left > 0:
+            self._own_sets[redis_key] = left
+        else:
+            self._own_sets.pop(redis_key, None)
+
+    # keyspace notifications
+
+    async def start(self):
+        """Check (or with ``configure_keyspace_events`` enable) keyspace notifications and start the listener"""
+        if self.near_cache_items <= 0 or self._listener is not None:
+            return
+        try:
+            config = await self.redis.config_get("notify-keyspace-events")
+            current = config.get("notify-keyspace-events", config.get(b"notify-keyspace-events", ""))
+            current = current.decode() if isinstance(current, bytes) else current
+            if not set(KEYSPACE_EVENTS) <= set(current.replace("A", "g$lshzxetd")):
+                if not self.configure_keyspace_events:
+                    logger.warning(f"Redis has notify-keyspace-events={current!r} without {KEYSPACE_EVENTS!r}, "
+                                   f"FSM near-cache disabled; add them to the server config to turn it on")
+                    return
+                await self.redis.config_set("notify-keyspace-events", "".join(sorted(set(current + KEYSPACE_EVENTS))))
+        except ResponseError as e:
+            # managed Redis may forbid CONFIG; notifications then have to be enabled by the provider
+            logger.warning(f"Could not check keyspace notifications, FSM near-cache disabled: {e}")
+            return
+        self._listener = asyncio.create_task(self._listen())
+        try:
+            await asyncio.wait_for(self._listening.wait(), 5)
+        except asyncio.TimeoutError:
+            logger.warning("Keyspace notification subscription not confirmed yet, near-cache stays off until it is")
+
+    async def _listen(self):
+        db = self.redis.connection_pool.connection_kwargs.get("db", 0)
+        channel_prefix = f"__keyspace@{db}__:"
+        pattern = f"{channel_prefix}{self.key_builder.prefix}{self.key_builder.separator}*"
+        delay = 0.5
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.psubscribe(pattern)
+                async for message in pubsub.listen():
+                    if message["type"] == "psubscribe":
+                        self._listening.set()
+                        self.stats.near_cache = True
+                        delay = 0.5
+                        continue
+                    if message["type"] != "pmessage":
+                        continue
+                    redis_key = message["channel"].decode()[len(channel_prefix):]
+                    event = message["data"].decode()
+                    if event == "expire":
+                        # a new TTL, the value is unchanged
+                        continue
+                    if event == "set" and redis_key in self._own_sets:
+                        self._forget_own_set(redis_key)
+                        continue
+                    self._invalidate(redis_key)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Keyspace notifications lost, FSM near-cache cleared: {e}")
+            finally:
+                # whatever happened meanwhile went unnoticed
+                self._listening.clear()
+                self.stats.near_cache = False
+                self._cache.clear()
+                self._own_sets.clear()
+                await pubsub.aclose()
+            self.stats.resubscribes += 1
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30)
+
+    # BaseStorage
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        value = None if state is None else (state.state if isinstance(state, State) else state)
+        await self._write(self.key_builder.build(key, "state"),
+                          value.encode() if value is not None else None, self.state_ttl)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        value = await self._read(key, "state")
+        return value.decode() if value is not None else None
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await self._write(self.key_builder.build(key, "data"), pack_data(data) if data else None, self.data_ttl)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        value = await self._read(key, "data")
+        # unpacked on every read, so callers never share a dict with the cache
+        return unpack_data(value) if value is not None else {}
+
+    async def close(self) -> None:
+        if self._flusher is not None:
+            await asyncio.gather(self._flusher, return_exceptions=True)
+        if self._listener is not None:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+        await super().close()
+
 
-def create_storage(redis_url: str):
-    redis = Redis.from_url(redis_url)
-    return RedisStorage(redis=redis)
\ No newline at end of file
+def create_storage(redis_url: str, max_connections: int = 64, pool_timeout: float = 5.0,
+                   health_check_interval: int = 30, near_cache_items: int = 10000,
+                   near_cache_ttl: float = 300.0, write_window: float = 0.0,
+                   configure_keyspace_events: bool = False) -> NearCacheRedisStorage:
+    redis = create_redis(redis_url, max_connections, pool_timeout, health_check_interval)
+    return NearCacheRedisStorage(redis, near_cache_items=near_cache_items, near_cache_ttl=near_cache_ttl,
+                                 write_window=write_window, configure_keyspace_events=configure_keyspace_events)
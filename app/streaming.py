@@ -0,0 +1,271 @@
+import asyncio
+import logging
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Any, AsyncGenerator, Awaitable, Callable, List, Optional, Tuple
+
+import httpx
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import InputFile, Message
+from openai import APIError
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_TEXT_LIMIT = 4096
+RUN_FINAL_EVENTS = {
+    "thread.run.requires_action",
+    "thread.run.completed",
+    "thread.run.incomplete",
+    "thread.run.failed",
+    "thread.run.cancelled",
+    "thread.run.expired",
+}
+SENTENCE_END = re.compile(r"[.!?…\n]+[\"»)]*\s")
+
+
+@dataclass
+class StreamTimings:
+    started: float = field(default_factory=time.perf_counter)
+    first_token: Optional[float] = None
+    first_audio: Optional[float] = None
+    finished: Optional[float] = None
+
+    @property
+    def time_to_first_token(self) -> Optional[float]:
+        return self.first_token - self.started if self.first_token else None
+
+    @property
+    def time_to_first_audio(self) -> Optional[float]:
+        return self.first_audio - self.started if self.first_audio else None
+
+    @property
+    def total(self) -> Optional[float]:
+        return self.finished - self.started if self.finished else None
+
+
+async def stream_run(
+        client,
+        thread_id: str,
+        assistant_id: str,
+        on_text: Optional[Callable[[str], Awaitable[None]]] = None,
+        timings: Optional[StreamTimings] = None,
+        on_run: Optional[Callable[[Any], None]] = None,
+        resume: Optional[Callable[[Any], Awaitable[Tuple[Any, Optional[str]]]]] = None,
+        **params
+):
+    """Execute a run over the Assistants event stream.
+
+    Text deltas are passed to ``on_text`` as they arrive, the new run to
+    ``on_run`` as soon as it is created. Returns the run from
+    the last lifecycle event together with the full assistant text, so the
+    caller does not need a ``messages.list`` round trip. When the stream
+    breaks after the run was created, ``resume`` is given that run and
+    returns it finished with its answer text; only the part of the text
+    not delivered yet goes to ``on_text``.
+    """
+    timings = timings or StreamTimings()
+    run = created = None
+    parts = []
+    try:
+        async with client.beta.threads.runs.stream(
+                thread_id=thread_id,
+                assistant_id=assistant_id,
+                **params
+        ) as stream:
+            async for event in stream:
+                if event.event == "thread.message.delta":
+                    for block in event.data.delta.content or []:
+                        if block.type != "text" or not block.text or not block.text.value:
+                            continue
+                        if timings.first_token is None:
+                            timings.first_token = time.perf_counter()
+                        parts.append(block.text.value)
+                        if on_text is not None:
+                            await on_text(block.text.value)
+                elif event.event in RUN_FINAL_EVENTS:
+                    run = event.data
+                elif event.event == "thread.run.created":
+                    created = event.data
+                    if on_run is not None:
+                        on_run(event.data)
+    except (APIError, httpx.HTTPError) as e:
+        if run is not None:
+            # broke after the last lifecycle event; the run is done
+            logger.info(f"Stream of run {run.id} closed uncleanly: {e}")
+            timings.finished = time.perf_counter()
+            return run, "".join(parts)
+        if resume is None or created is None:
+            raise
+        logger.warning(f"Stream of run {created.id} broke ({type(e).__name__}), polling it instead")
+        run, text = await resume(created)
+        delivered = "".join(parts)
+        if text is not None and text.startswith(delivered):
+            rest = text[len(delivered):]
+            if rest:
+                parts.append(rest)
+                if on_text is not None:
+                    await on_text(rest)
+        elif text is not None:
+            parts = [text]
+    timings.finished = time.perf_counter()
+    return run, "".join(parts)
+
+
+class ProgressiveReply:
+    """Shows a streamed answer by editing one Telegram message at most every ``interval`` seconds.
+
+    When Telegram answers with flood control, edits are skipped until its
+    ``retry_after`` has passed; ``finish`` waits it out, so the final text
+    is always delivered.
+    """
+
+    def __init__(self, message: Message, interval: float = 1.0):
+        self.message = message
+        self.interval = interval
+        self.text = ""
+        self.sent: Optional[Message] = None
+        self._shown = ""
+        self._last_flush = 0.0
+        self._resume_at = 0.0
+
+    async def push(self, delta: str):
+        self.text += delta
+        now = time.monotonic()
+        if now >= self._resume_at and now - self._last_flush >= self.interval:
+            await self._flush()
+
+    async def _flush(self, final: bool = False):
+        visible = self.text[:TELEGRAM_TEXT_LIMIT]
+        self._last_flush = time.monotonic()
+        if not visible.strip() or visible == self._shown:
+            return
+        while True:
+            if final:
+                await asyncio.sleep(max(0.0, self._resume_at - time.monotonic()))
+            try:
+                if self.sent is None:
+                    self.sent = await self.message.answer(visible)
+                else:
+                    await self.sent.edit_text(visible)
+                self._shown = visible
+                return
+            except TelegramRetryAfter as e:
+                self._resume_at = time.monotonic() + e.retry_after
+                logger.info(f"Progressive reply paused for {e.retry_after}s by flood control")
+                if not final:
+                    return
+            except TelegramBadRequest as e:
+                logger.warning(f"Progressive reply edit failed: {e}")
+                return
+
+    async def _answer(self, text: str) -> Message:
+        while True:
+            await asyncio.sleep(max(0.0, self._resume_at - time.monotonic()))
+            try:
+                return await self.message.answer(text)
+            except TelegramRetryAfter as e:
+                self._resume_at = time.monotonic() + e.retry_after
+
+    async def finish(self, text: Optional[str] = None):
+        """Write the final text; anything beyond the Telegram limit goes into extra messages"""
+        if text is not None:
+            self.text = text
+        await self._flush(final=True)
+        if self.sent is None and self.text.strip():
+            # the first flush failed, fall back to a plain reply
+            self.sent = await self._answer(self.text[:TELEGRAM_TEXT_LIMIT])
+        for start in range(TELEGRAM_TEXT_LIMIT, len(self.text), TELEGRAM_TEXT_LIMIT):
+            await self._answer(self.text[start:start + TELEGRAM_TEXT_LIMIT])
+
+
+class SentenceSplitter:
+    """Cuts streamed text into sentence groups of at least ``min_chars`` characters"""
+
+    def __init__(self, min_chars: int = 60):
+        self.min_chars = min_chars
+        self.buffer = ""
+
+    def feed(self, delta: str) -> List[str]:
+        self.buffer += delta
+        ready = []
+        while True:
+            cut = None
+            for match in SENTENCE_END.finditer(self.buffer):
+                if match.end() >= self.min_chars:
+                    cut = match.end()
+                    break
+            if cut is None:
+                return ready
+            sentence, self.buffer = self.buffer[:cut].strip(), self.buffer[cut:]
+            if sentence:
+                ready.append(sentence)
+
+    def flush(self) -> Optional[str]:
+        rest, self.buffer = self.buffer.strip(), ""
+        return rest or None
+
+
+class SpeechSegments:
+    """Starts TTS for each complete sentence group while the run is still streaming"""
+
+    def __init__(
+            self,
+            synthesize: Callable[[str], Awaitable[bytes]],
+            min_chars: int = 60,
+            timings: Optional[StreamTimings] = None
+    ):
+        self.synthesize = synthesize
+        self.splitter = SentenceSplitter(min_chars)
+        self.timings = timings or StreamTimings()
+        self.tasks: List[asyncio.Task] = []
+
+    def __bool__(self):
+        return bool(self.tasks)
+
+    async def push(self, delta: str):
+        for sentence in self.splitter.feed(delta):
+            self._start(sentence)
+
+    def finish(self):
+        rest = self.splitter.flush()
+        if rest:
+            self._start(rest)
+
+    def cancel(self):
+        for task in self.tasks:
+            task.cancel()
+
+    def _start(self, text: str):
+        task = asyncio.create_task(self.synthesize(text))
+        task.add_done_callback(self._on_done)
+        self.tasks.append(task)
+
+    def _on_done(self, task: asyncio.Task):
+        if self.timings.first_audio is None and not task.cancelled() and task.exception() is None:
+            self.timings.first_audio = time.perf_counter()
+
+    def input_file(self, filename: str = "response.mp3", encode=None) -> "SegmentedSpeechFile":
+        return SegmentedSpeechFile(self.tasks, filename=filename, encode=encode)
+
+
+class SegmentedSpeechFile(InputFile):
+    """Uploads synthesized segments in order, each one as soon as it is ready.
+
+    MP3 frames can simply be concatenated. Other formats are joined as raw
+    PCM and go through ``encode`` once every segment is ready.
+    """
+
+    def __init__(self, tasks: List[asyncio.Task], filename: str = "response.mp3",
+                 encode: Optional[Callable[[bytes], Awaitable[bytes]]] = None):
+        super().__init__(filename=filename)
+        self.tasks = tasks
+        self.encode = encode
+
+    async def read(self, bot: Bot) -> AsyncGenerator[bytes, None]:
+        if self.encode is not None:
+            yield await self.encode(b"".join([await task for task in self.tasks]))
+            return
+        for task in self.tasks:
+            yield await task
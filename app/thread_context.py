@@ -0,0 +1,233 @@
+import asyncio
+import json
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from redis.asyncio import Redis
+
+from cache import LRUCache, TieredCache
+from metrics import THREAD_PROMPT_TOKENS, THREAD_RUN_SECONDS, count_tokens, stage
+
+logger = logging.getLogger(__name__)
+
+# thread age in turns, bucketed so the metrics stay low-cardinality
+AGE_BUCKETS = (1, 2, 4, 8, 16, 32)
+SUMMARY_PREFIX = "Краткое содержание нашего предыдущего разговора:\n"
+SUMMARY_PROMPT = (
+    "Summarise the conversation below between a user and an assistant that helps with anxiety. "
+    "The summary replaces the conversation as context for the assistant's next replies, so keep "
+    "what the user told about themselves, their situation, values and preferences, advice already "
+    "given and open questions. Leave out document excerpts and greetings. At most {words} words, "
+    "in the language of the conversation."
+)
+
+
+def approx_tokens(text: str) -> int:
+    """Rough token count: four UTF-8 bytes per token fits English and Russian text alike"""
+    return (len(text.encode()) + 3) // 4
+
+
+def age_bucket(turns: int) -> str:
+    for low, high in zip(AGE_BUCKETS, AGE_BUCKETS[1:]):
+        if turns < high:
+            return str(low) if high - low == 1 else f"{low}-{high - 1}"
+    return f"{AGE_BUCKETS[-1]}+"
+
+
+def message_text(message) -> str:
+    return "".join(part.text.value for part in message.content if part.type == "text")
+
+
+@dataclass
+class ThreadContextStats:
+    turns: int = 0
+    rollovers: int = 0
+    # rollovers that also copied turns newer than the summary
+    rollovers_with_tail: int = 0
+    summaries: int = 0
+    summary_failures: int = 0
+    summary_seconds: float = 0.0
+    # age bucket -> runs, prompt tokens and run seconds summed
+    by_age: Dict[str, Dict[str, float]] = field(default_factory=dict)
+
+    def observe(self, age: str, prompt_tokens: Optional[int], seconds: float):
+        bucket = self.by_age.setdefault(age, {"runs": 0, "prompt_tokens": 0, "run_seconds": 0.0})
+        bucket["runs"] += 1
+        bucket["prompt_tokens"] += prompt_tokens or 0
+        bucket["run_seconds"] += seconds
+
+    def snapshot(self) -> dict:
+        return {
+            "turns": self.turns,
+            "rollovers": self.rollovers,
+            "rollovers_with_tail": self.rollovers_with_tail,
+            "summaries": self.summaries,
+            "summary_failures": self.summary_failures,
+            "summary_seconds": round(self.summary_seconds, 3),
+            "by_age": {
+                age: {
+                    "runs": int(bucket["runs"]),
+                    "mean_prompt_tokens": round(bucket["prompt_tokens"] / bucket["runs"]),
+                    "mean_run_seconds": round(bucket["run_seconds"] / bucket["runs"], 3)
+                }
+                for age, bucket in sorted(self.by_age.items(), key=lambda item: int(item[0].rstrip("+").split("-")[0]))
+            }
+        }
+
+
+class ThreadContext:
+    """Keeps the text handler's per-user threads, kept in FSM data, to a bounded context.
+
+    Every run sees at most the last ``truncate_last_messages`` messages of
+    its thread. The FSM data also carries an approximate token size of the
+    thread (``thread_tokens``) and its age in turns (``thread_turns``); once
+    the size passes ``rollover_tokens`` a summary of the thread is written
+    in the background, and the next turn after it is ready moves the user
+    to a new thread seeded with it, plus any turns newer than the summary.
+    Until then the old thread keeps serving, with truncation as the bound.
+    Summaries live in Redis under the old thread's id, so any worker can
+    use one another started.
+    """
+
+    def __init__(
+            self,
+            redis: Optional[Redis] = None,
+            truncate_last_messages: int = 20,
+            rollover_tokens: int = 8000,
+            summary_model: str = "gpt-4o-mini",
+            summary_words: int = 200,
+            summary_messages: int = 100,
+            ttl: int = 3 * 24 * 3600
+    ):
+        self.truncate_last_messages = truncate_last_messages
+        self.rollover_tokens = rollover_tokens
+        self.summary_model = summary_model
+        self.summary_words = summary_words
+        self.summary_messages = summary_messages
+        self.summaries = TieredCache(
+            redis,
+            prefix="thread_summary",
+            memory=LRUCache(max_items=1000, ttl=ttl),
+            ttl=ttl,
+            dumps=lambda entry: json.dumps(entry, ensure_ascii=False).encode(),
+            loads=json.loads
+        )
+        self.stats = ThreadContextStats()
+        self._summarising = set()
+        self._tasks = set()
+
+    def run_params(self) -> dict:
+        """Extra parameters of every run on a user's thread"""
+        if not self.truncate_last_messages:
+            return {}
+        return {"truncation_strategy": {"type": "last_messages", "last_messages": self.truncate_last_messages}}
+
+    async def thread_for(self, client_ai, state, data: dict, user_id: Optional[int]) -> str:
+        """The thread for the user's next turn: created, rolled over, or the one in ``data``, which is updated"""
+        thread_id = data.get("thread_id")
+        if thread_id is not None:
+            if not self.rollover_tokens or data.get("thread_tokens", 0) < self.rollover_tokens:
+                return thread_id
+            summary = await self.summaries.get(thread_id)
+            if summary is None:
+                # started again if the worker that was writing it went away
+                self.summarise(client_ai, thread_id, data.get("thread_turns", 0), user_id)
+                return thread_id
+            seed = await self._seed(client_ai, thread_id, summary, data.get("thread_turns", 0), user_id)
+            self.stats.rollovers += 1
+        else:
+            seed = None
+
+        params = {"messages": seed} if seed else {}
+        thread = await client_ai.scheduler.create("threads", user_id, client_ai.client.beta.threads.create, **params)
+        fields = {"thread_id": thread.id, "thread_tokens": sum(approx_tokens(m["content"]) for m in seed or []),
+                  "thread_turns": 0}
+        data.update(fields)
+        await state.update_data(**fields)
+        if seed:
+            logger.info(f"Rolled thread of user {user_id} over: {thread_id} -> {thread.id}")
+            await self.summaries.delete(thread_id)
+        return thread.id
+
+    async def _seed(self, client_ai, thread_id: str, summary: dict, turns: int, user_id) -> List[dict]:
+        seed = [{"role": "assistant", "content": SUMMARY_PREFIX + summary["text"]}]
+        if turns > summary["turns"] and summary["after"]:
+            # turns that came in while the summary was being written go over verbatim
+            tail = await client_ai.scheduler.call(
+                "threads", user_id,
+                client_ai.client.beta.threads.messages.list, thread_id, order="asc", after=summary["after"], limit=30
+            )
+            seed += [{"role": m.role, "content": message_text(m)} for m in tail.data if message_text(m)]
+            self.stats.rollovers_with_tail += 1
+        return seed
+
+    def after_turn(self, client_ai, data: dict, user_id: Optional[int], added_tokens: int,
+                   run=None, run_seconds: Optional[float] = None) -> dict:
+        """FSM fields to store after a turn that added ``added_tokens`` to the thread"""
+        turns = data.get("thread_turns", 0) + 1
+        tokens = data.get("thread_tokens", 0) + added_tokens
+        self.stats.turns += 1
+        if run is not None and run_seconds is not None:
+            age = age_bucket(turns)
+            usage = getattr(run, "usage", None)
+            prompt_tokens = usage.prompt_tokens if usage is not None else None
+            THREAD_RUN_SECONDS.labels(age=age).observe(run_seconds)
+            if prompt_tokens:
+                THREAD_PROMPT_TOKENS.labels(age=age).observe(prompt_tokens)
+            self.stats.observe(age, prompt_tokens, run_seconds)
+        if self.rollover_tokens and tokens >= self.rollover_tokens and data.get("thread_id"):
+            self.summarise(client_ai, data["thread_id"], turns, user_id)
+        return {"thread_tokens": tokens, "thread_turns": turns}
+
+    def summarise(self, client_ai, thread_id: str, turns: int, user_id: Optional[int]):
+        """Write the summary of ``thread_id`` in the background, unless this process already is"""
+        if thread_id in self._summarising:
+            return
+        self._summarising.add(thread_id)
+        task = asyncio.create_task(self._summarise(client_ai, thread_id, turns, user_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _summarise(self, client_ai, thread_id: str, turns: int, user_id: Optional[int]):
+        started = time.perf_counter()
+        try:
+            if await self.summaries.get(thread_id) is not None:
+                return
+            with stage("summary"):
+                messages = await client_ai.scheduler.call(
+                    "threads", user_id,
+                    client_ai.client.beta.threads.messages.list, thread_id, order="desc",
+                    limit=self.summary_messages
+                )
+                ordered = [m for m in reversed(messages.data) if message_text(m)]
+                if not ordered:
+                    return
+                response = await client_ai.scheduler.call(
+                    "summary", user_id,
+                    client_ai.client.chat.completions.create,
+                    model=self.summary_model,
+                    messages=[
+                        {"role": "system", "content": SUMMARY_PROMPT.format(words=self.summary_words)},
+                        {"role": "user", "content": "\n\n".join(f"{m.role}: {message_text(m)}" for m in ordered)}
+                    ],
+                    max_tokens=self.summary_words * 3
+                )
+            count_tokens("summary", response)
+            await self.summaries.set(thread_id, {
+                "text": response.choices[0].message.content.strip(),
+                "after": ordered[-1].id,
+                "turns": turns
+            })
+            self.stats.summaries += 1
+        except Exception as e:
+            self.stats.summary_failures += 1
+            logger.warning(f"Summary of thread {thread_id} failed: {e}")
+        finally:
+            self.stats.summary_seconds += time.perf_counter() - started
+            self._summarising.discard(thread_id)
+
+    async def close(self):
+        """Let summaries being written finish"""
+        await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -0,0 +1,108 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, asdict
+from typing import Dict, List
+
+from redis.asyncio import Redis
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ThreadRegistryStats:
+    created: int = 0
+    reused: int = 0
+    rotated: int = 0
+    # turns that waited for another turn of the same user to finish its run
+    serialised: int = 0
+
+    def snapshot(self) -> dict:
+        return asdict(self)
+
+
+class ThreadRegistry:
+    """Per-user Assistants thread ids kept in Redis next to the FSM data.
+
+    A record expires after ``ttl`` seconds of inactivity. A thread is
+    rotated (replaced by a fresh one) once it has seen ``max_messages``
+    messages or is older than ``max_age`` seconds, which keeps run context
+    and token usage bounded for chatty users. Since the thread is shared,
+    a user's turns must run one at a time: callers hold ``turn(user_id)``
+    from ``acquire`` until their run is done or its tool outputs are in.
+    """
+
+    def __init__(
+            self,
+            redis: Redis,
+            ttl: int = 3 * 24 * 3600,
+            max_messages: int = 40,
+            max_age: int = 24 * 3600,
+            prefix: str = "threads"
+    ):
+        self.redis = redis
+        self.ttl = ttl
+        self.max_messages = max_messages
+        self.max_age = max_age
+        self.prefix = prefix
+        self.stats = ThreadRegistryStats()
+        # user -> [lock, holders and waiters]
+        self._locks: Dict[int, List] = {}
+
+    def _key(self, user_id: int) -> str:
+        return f"{self.prefix}:{user_id}"
+
+    def _should_rotate(self, record: dict) -> bool:
+        return (
+            int(record.get("messages", 0)) >= self.max_messages
+            or time.time() - float(record.get("created_at", 0)) >= self.max_age
+        )
+
+    @asynccontextmanager
+    async def turn(self, user_id: int):
+        """One turn at a time on the user's thread, within this process"""
+        lane = self._locks.setdefault(user_id, [asyncio.Lock(), 0])
+        lane[1] += 1
+        if lane[0].locked():
+            self.stats.serialised += 1
+        try:
+            async with lane[0]:
+                yield
+        finally:
+            lane[1] -= 1
+            if not lane[1]:
+                del self._locks[user_id]
+
+    async def acquire(self, user_id: int, client_ai) -> str:
+        """Return the user's current thread id, creating or rotating it if needed"""
+        key = self._key(user_id)
+        record = {k.decode(): v.decode() for k, v in (await self.redis.hgetall(key)).items()}
+
+        if record.get("thread_id") and not self._should_rotate(record):
+            if record.get("pending_run"):
+                # a run submitted with tool outputs must finish before the thread takes new messages
+                await client_ai.wait_run(record["thread_id"], record["pending_run"], user_id)
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.hincrby(key, "messages", 1)
+                pipe.hdel(key, "pending_run")
+                pipe.expire(key, self.ttl)
+                await pipe.execute()
+            self.stats.reused += 1
+            return record["thread_id"]
+
+        thread = await client_ai.scheduler.create("threads", user_id, client_ai.client.beta.threads.create)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(key)
+            pipe.hset(key, mapping={"thread_id": thread.id, "created_at": time.time(), "messages": 1})
+            pipe.expire(key, self.ttl)
+            await pipe.execute()
+        self.stats.created += 1
+        if record.get("thread_id"):
+            self.stats.rotated += 1
+            logger.info(f"Rotated thread for user {user_id}: {record['thread_id']} -> {thread.id}")
+        return thread.id
+
+    async def mark_pending_run(self, user_id: int, run_id: str):
+        """Remember a run that is still executing after tool outputs were submitted"""
+        await self.redis.hset(self._key(user_id), "pending_run", run_id)
@@ -0,0 +1,95 @@
+import hashlib
+import json
+import time
+from dataclasses import dataclass, asdict
+from typing import Optional
+
+from aiogram import Bot
+
+from audio import DEFAULT_MAX_VOICE_BYTES, download_voice
+from cache import LRUCache, TieredCache
+
+
+@dataclass
+class TranscriptStats:
+    file_hits: int = 0
+    hash_hits: int = 0
+    misses: int = 0
+    seconds_saved: float = 0.0
+    download_bytes_saved: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.file_hits + self.hash_hits + self.misses
+        return (self.file_hits + self.hash_hits) / total if total else 0.0
+
+    def snapshot(self) -> dict:
+        return {
+            **asdict(self),
+            "hit_rate": round(self.hit_rate, 4),
+            "seconds_saved": round(self.seconds_saved, 3)
+        }
+
+
+class TranscriptCache:
+    """Whisper transcripts of voice notes, looked up before anything is downloaded.
+
+    A forwarded or re-sent voice note keeps its ``file_unique_id``, so a hit
+    on ``file:<id>`` skips both the Telegram download and Whisper. The same
+    audio uploaded again gets a new id but hits ``sha:<hash>`` after the
+    download. Entries remember how long the download and the transcription
+    took, which is what a hit saves.
+    """
+
+    def __init__(
+            self,
+            redis=None,
+            memory_items: int = 10000,
+            redis_bytes: int = 64 * 1024 * 1024,
+            max_item_bytes: int = 64 * 1024,
+            ttl: int = 30 * 24 * 3600
+    ):
+        self.cache = TieredCache(
+            redis,
+            prefix="transcript",
+            memory=LRUCache(max_items=memory_items, ttl=ttl),
+            ttl=ttl,
+            redis_max_bytes=redis_bytes,
+            max_item_bytes=max_item_bytes,
+            dumps=lambda entry: json.dumps(entry, ensure_ascii=False).encode(),
+            loads=json.loads
+        )
+        self.stats = TranscriptStats()
+
+    async def transcribe(self, bot: Bot, client_ai, media, user_id: Optional[int] = None,
+                         limit: int = DEFAULT_MAX_VOICE_BYTES) -> str:
+        """Transcript of a Telegram voice or audio message"""
+        started = time.perf_counter()
+        file_key = f"file:{media.file_unique_id}"
+        entry = await self.cache.get(file_key)
+        if entry is not None:
+            self.stats.file_hits += 1
+            self.stats.seconds_saved += entry["download"] + entry["transcribe"]
+            self.stats.download_bytes_saved += media.file_size or 0
+            return entry["text"]
+
+        data = (await download_voice(bot, media.file_id, limit)).getvalue()
+        downloaded = time.perf_counter()
+        hash_key = f"sha:{hashlib.sha256(data).hexdigest()}"
+        entry = await self.cache.get(hash_key)
+        if entry is not None:
+            self.stats.hash_hits += 1
+            self.stats.seconds_saved += entry["transcribe"]
+            await self.cache.set(file_key, {**entry, "download": round(downloaded - started, 3)})
+            return entry["text"]
+
+        self.stats.misses += 1
+        text = await client_ai.transcribe_voice(data, user_id)
+        entry = {
+            "text": text,
+            "download": round(downloaded - started, 3),
+            "transcribe": round(time.perf_counter() - downloaded, 3)
+        }
+        await self.cache.set(file_key, entry)
+        await self.cache.set(hash_key, entry)
+        return text
@@ -0,0 +1,89 @@
+import hashlib
+import logging
+from dataclasses import dataclass, asdict
+from typing import Iterable, Optional
+
+from redis.asyncio import Redis
+
+from cache import LRUCache, TieredCache
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class TTSCacheStats:
+    synthesized: int = 0
+    synthesized_bytes: int = 0
+    audio_hits: int = 0
+    audio_bytes_saved: int = 0
+    upload_hits: int = 0
+
+    def snapshot(self) -> dict:
+        return asdict(self)
+
+
+class TTSCache:
+    """Content-addressed cache of synthesized speech.
+
+    Audio is keyed by a hash of model, voice, format and text. For the
+    fixed phrases in ``static_phrases`` the Telegram ``file_id`` of the first
+    upload is remembered too, so repeat replies skip synthesis and upload.
+    """
+
+    def __init__(
+            self,
+            redis: Optional[Redis],
+            static_phrases: Iterable[str] = (),
+            memory_bytes: int = 32 * 1024 * 1024,
+            redis_bytes: int = 256 * 1024 * 1024,
+            max_item_bytes: int = 2 * 1024 * 1024,
+            ttl: int = 7 * 24 * 3600
+    ):
+        self.redis = redis
+        self.static_phrases = set(static_phrases)
+        self.audio = TieredCache(
+            redis,
+            prefix="tts",
+            memory=LRUCache(max_items=4096, max_bytes=memory_bytes),
+            ttl=ttl,
+            redis_max_bytes=redis_bytes,
+            max_item_bytes=max_item_bytes
+        )
+        self.file_ids = {}
+        self.stats = TTSCacheStats()
+
+    @staticmethod
+    def key(text: str, model: str, voice: str, response_format: str = "mp3") -> str:
+        return hashlib.sha256(f"{model}\0{voice}\0{response_format}\0{text}".encode()).hexdigest()
+
+    async def get_file_id(self, key: str) -> Optional[str]:
+        file_id = self.file_ids.get(key)
+        if file_id is None and self.redis is not None:
+            raw = await self.redis.hget("tts:file_ids", key)
+            if raw is not None:
+                file_id = self.file_ids[key] = raw.decode()
+        if file_id is not None:
+            self.stats.upload_hits += 1
+        return file_id
+
+    async def remember_upload(self, text: str, key: str, file_id: Optional[str]):
+        if not file_id or text not in self.static_phrases or key in self.file_ids:
+            return
+        self.file_ids[key] = file_id
+        if self.redis is not None:
+            await self.redis.hset("tts:file_ids", key, file_id)
+
+    async def get_audio(self, key: str) -> Optional[bytes]:
+        data = await self.audio.get(key)
+        if data is not None:
+            self.stats.audio_hits += 1
+            self.stats.audio_bytes_saved += len(data)
+        return data
+
+    async def put_audio(self, key: str, data: bytes):
+        self.stats.synthesized += 1
+        self.stats.synthesized_bytes += len(data)
+        await self.audio.set(key, data)
+
+    def snapshot(self) -> dict:
+        return {**self.stats.snapshot(), "tiers": self.audio.stats.snapshot()}
@@ -0,0 +1,189 @@
+import json
+import logging
+import time
+from dataclasses import dataclass, asdict, field
+from typing import List, Optional, Tuple
+
+from redis.exceptions import WatchError
+from sqlalchemy import func, literal, select, tuple_
+
+from cache import LRUCache
+from database import AsyncSessionLocal
+from models import UserValue
+
+logger = logging.getLogger(__name__)
+
+# a cursor goes into Telegram callback_data (64 bytes) after a "values:" prefix
+CURSOR_BYTES = 56
+# marks a cursor whose name did not fit and was clipped
+CLIPPED = "~"
+
+
+@dataclass
+class ValuesPage:
+    items: List[dict] = field(default_factory=list)
+    # sort key of the last item, see make_cursor; pass it back to get the next page
+    next_cursor: Optional[str] = None
+
+
+@dataclass
+class UserValuesStats:
+    hits: int = 0
+    misses: int = 0
+    invalidations: int = 0
+    # pages read before an invalidation, not cached
+    stale_skipped: int = 0
+    query_seconds: float = 0.0
+
+    def snapshot(self) -> dict:
+        return {**asdict(self), "query_seconds": round(self.query_seconds, 3)}
+
+
+def make_cursor(row_id: int, name: str) -> str:
+    """``<id>:<value_name>`` of the last row of a page, clipped to ``CURSOR_BYTES``"""
+    cursor = f"{row_id}:{name}"
+    if len(cursor.encode()) <= CURSOR_BYTES:
+        return cursor
+    return CLIPPED + cursor.encode()[:CURSOR_BYTES - len(CLIPPED)].decode(errors="ignore")
+
+
+def parse_cursor(cursor: str) -> Tuple[int, str, bool]:
+    """Row id, value name and whether the name was clipped; raises ``ValueError`` for a malformed cursor"""
+    clipped = cursor.startswith(CLIPPED)
+    row_id, name = cursor[len(CLIPPED):].split(":", 1) if clipped else cursor.split(":", 1)
+    return int(row_id), name, clipped
+
+
+async def fetch_values(session, user_id: int, cursor: Optional[str] = None, limit: int = 10) -> ValuesPage:
+    """One page of a user's values ordered by name, keyset-paginated on (value_name, id).
+
+    Served by the (user_id, value_name) index. ``cursor`` carries the sort key
+    of the last row of the previous page, so the next page does not depend on
+    that row still existing. Only a name too long for the cursor is looked up
+    again, falling back to its clipped prefix if the row is gone.
+    """
+    query = select(UserValue.id, UserValue.value_name, UserValue.description).where(UserValue.user_id == user_id)
+    if cursor is not None:
+        row_id, name, clipped = parse_cursor(cursor)
+        last_name = literal(name)
+        if clipped:
+            stored = select(UserValue.value_name).where(UserValue.id == row_id).scalar_subquery()
+            last_name = func.coalesce(stored, name)
+        query = query.where(tuple_(UserValue.value_name, UserValue.id) > tuple_(last_name, row_id))
+    result = await session.execute(query.order_by(UserValue.value_name, UserValue.id).limit(limit + 1))
+    rows = result.all()
+    items = [{"id": row.id, "name": row.value_name, "description": row.description} for row in rows[:limit]]
+    next_cursor = make_cursor(items[-1]["id"], items[-1]["name"]) if len(rows) > limit else None
+    return ValuesPage(items, next_cursor)
+
+
+class UserValuesStore:
+    """Cached read path for a user's saved values.
+
+    Pages live in a Redis hash per user (``uservalues:<user_id>``, field =
+    cursor), so one DEL drops every cached page when the user saves a value.
+    Without Redis the pages are kept in a process-local LRU. A per-user
+    generation, bumped by ``invalidate``, is read before the query and
+    checked when the page is stored, so a read that overlapped a commit
+    does not put its stale page back.
+    """
+
+    def __init__(
+            self,
+            redis=None,
+            session_factory=None,
+            page_size: int = 10,
+            ttl: int = 600,
+            prefix: str = "uservalues"
+    ):
+        self.redis = redis
+        self.session_factory = session_factory or AsyncSessionLocal
+        self.page_size = page_size
+        self.ttl = ttl
+        self.prefix = prefix
+        self.memory = LRUCache(max_items=10000, ttl=ttl) if redis is None else None
+        self.generations = LRUCache(max_items=10000) if redis is None else None
+        self.stats = UserValuesStats()
+
+    def _key(self, user_id: int) -> str:
+        return f"{self.prefix}:{user_id}"
+
+    def _generation_key(self, user_id: int) -> str:
+        return f"{self.prefix}:~generation:{user_id}"
+
+    async def _cached(self, user_id: int, field: str) -> Tuple[Optional[ValuesPage], object]:
+        """The cached page, if any, and the user's generation"""
+        if self.redis is None:
+            pages = self.memory.get(user_id)
+            return (pages.get(field) if pages else None), self.generations.get(user_id)
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.hget(self._key(user_id), field)
+                pipe.get(self._generation_key(user_id))
+                data, generation = await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Values cache read error: {e}")
+            # without a known generation the page is not stored either
+            return None, False
+        return (ValuesPage(**json.loads(data)) if data is not None else None), generation
+
+    async def _store(self, user_id: int, field: str, page: ValuesPage, generation):
+        if self.redis is None:
+            if self.generations.get(user_id) != generation:
+                self.stats.stale_skipped += 1
+                return
+            pages = self.memory.get(user_id) or {}
+            pages[field] = page
+            self.memory.set(user_id, pages)
+            return
+        if generation is False:
+            return
+        try:
+            key, generation_key = self._key(user_id), self._generation_key(user_id)
+            async with self.redis.pipeline(transaction=True) as pipe:
+                await pipe.watch(generation_key)
+                if await pipe.get(generation_key) != generation:
+                    self.stats.stale_skipped += 1
+                    return
+                pipe.multi()
+                pipe.hset(key, field, json.dumps(asdict(page), ensure_ascii=False))
+                pipe.expire(key, self.ttl)
+                await pipe.execute()
+        except WatchError:
+            # invalidated between the check and the write
+            self.stats.stale_skipped += 1
+        except Exception as e:
+            logger.warning(f"Values cache write error: {e}")
+
+    async def page(self, user_id: int, cursor: Optional[str] = None) -> ValuesPage:
+        field = cursor or ""
+        page, generation = await self._cached(user_id, field)
+        if page is not None:
+            self.stats.hits += 1
+            return page
+
+        self.stats.misses += 1
+        started = time.perf_counter()
+        async with self.session_factory() as session:
+            page = await fetch_values(session, user_id, cursor, self.page_size)
+        self.stats.query_seconds += time.perf_counter() - started
+        await self._store(user_id, field, page, generation)
+        return page
+
+    async def invalidate(self, *user_ids: int):
+        self.stats.invalidations += len(user_ids)
+        if self.redis is None:
+            for user_id in user_ids:
+                self.generations.set(user_id, (self.generations.get(user_id) or 0) + 1)
+                self.memory.pop(user_id)
+            return
+        if user_ids:
+            try:
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    for user_id in user_ids:
+                        pipe.incr(self._generation_key(user_id))
+                        pipe.expire(self._generation_key(user_id), self.ttl)
+                    pipe.delete(*(self._key(user_id) for user_id in user_ids))
+                    await pipe.execute()
+            except Exception as e:
+                logger.warning(f"Values cache invalidation error: {e}")
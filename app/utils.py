@@ -1,3 +1,4 @@
+import logging
 import uuid
 import os
 
@@ -9,4 +10,4 @@ def cleanup_files(*filenames):
         try:
             os.remove(fname)
         except Exception as e:
-            print(f"Error deleting {fname}: {str(e)}")
\ No newline at end of file
+            logging.warning(f"Error deleting {fname}: {str(e)}")
\ No newline at end of file
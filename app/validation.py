@@ -0,0 +1,170 @@
+import logging
+import re
+import time
+from dataclasses import dataclass, asdict
+from typing import Iterable, Optional
+
+from sqlalchemy import func, select
+
+from cache import LRUCache, TieredCache
+from models import UserValue
+
+logger = logging.getLogger(__name__)
+
+# Whole words; a description containing one of these is rejected
+DEFAULT_PROFANITY = (
+    "сука", "суки", "суку", "сукой",
+    "shit", "shits", "shitty", "bullshit", "dick", "dicks", "dickhead", "asshole", "assholes",
+    "bastard", "bastards", "whore", "whores", "slut", "sluts",
+)
+# Stems whose every inflection is profane, matched as word prefixes
+PROFANITY_STEMS = (
+    "хуй", "хуе", "хуё", "хуя", "пизд", "ебат", "ебан", "ебал", "ёбан", "бляд", "блять",
+    "мудак", "мудил", "залуп", "гандон", "пидор", "пидар", "шлюх",
+    "fuck", "motherfuck", "bitch", "cunt",
+)
+WORD = re.compile(r"\w+")
+
+# outcomes of ``ValueValidator.review``
+VALID = "valid"
+INVALID = "invalid"
+DUPLICATE = "duplicate"
+
+
+def normalize(description: str) -> str:
+    return " ".join(WORD.findall(description.lower()))
+
+
+def load_wordlist(path: str) -> tuple:
+    """``(words, stems)`` of a wordlist file, one entry per line; a trailing ``*`` marks a stem"""
+    with open(path, encoding="utf-8") as f:
+        entries = [line.strip().lower() for line in f if line.strip() and not line.startswith("#")]
+    return (tuple(entry for entry in entries if not entry.endswith("*")),
+            tuple(entry.rstrip("*") for entry in entries if entry.endswith("*")))
+
+
+@dataclass
+class ValidationStats:
+    rule_rejections: int = 0
+    duplicate_rejections: int = 0
+    cache_hits: int = 0
+    llm_calls: int = 0
+    llm_seconds: float = 0.0
+
+    @property
+    def llm_calls_avoided(self) -> int:
+        return self.rule_rejections + self.duplicate_rejections + self.cache_hits
+
+    @property
+    def seconds_saved(self) -> float:
+        return self.llm_calls_avoided * self.llm_seconds / self.llm_calls if self.llm_calls else 0.0
+
+    def snapshot(self) -> dict:
+        return {
+            **asdict(self),
+            "llm_calls_avoided": self.llm_calls_avoided,
+            "seconds_saved": round(self.seconds_saved, 3)
+        }
+
+
+class ValueValidator:
+    """Validates ``save_value`` descriptions in three tiers.
+
+    1. Deterministic rules: word count, length, profanity, and a name the user
+       already saved a value under, the same (user_id, value_name) key the
+       unique index and ``ValueWriter`` use. These can only reject. Profanity is whole words
+       from ``profanity`` plus words starting with one of ``profanity_stems``,
+       so "Dickens" passes. The duplicate check opens its own short session
+       from ``session_factory`` unless one is passed in.
+    2. Earlier LLM verdicts, cached by normalised description.
+    3. ``OpenAIService.request_validation``, the GPT round trip, for everything else.
+    """
+
+    def __init__(
+            self,
+            redis=None,
+            min_words: int = 3,
+            max_chars: int = 500,
+            profanity: Iterable[str] = DEFAULT_PROFANITY,
+            profanity_stems: Iterable[str] = PROFANITY_STEMS,
+            ttl: int = 30 * 24 * 3600,
+            session_factory=None
+    ):
+        self.session_factory = session_factory
+        self.min_words = min_words
+        self.max_chars = max_chars
+        self.profanity = frozenset(profanity)
+        self.profanity_stems = tuple(profanity_stems)
+        self.verdicts = TieredCache(
+            redis,
+            prefix="verdict",
+            memory=LRUCache(max_items=50000),
+            ttl=ttl,
+            dumps=lambda valid: b"1" if valid else b"0",
+            loads=lambda data: data == b"1"
+        )
+        self.stats = ValidationStats()
+
+    def check_rules(self, description: str) -> Optional[str]:
+        """Reason to reject ``description`` outright, or None"""
+        words = WORD.findall(description.lower())
+        if len(words) < self.min_words:
+            return "too few words"
+        if len(description) > self.max_chars:
+            return "too long"
+        if any(word in self.profanity or word.startswith(self.profanity_stems) for word in words):
+            return "profanity"
+        return None
+
+    async def is_duplicate(self, session, user_id: int, name: str) -> bool:
+        """``name`` as stored, i.e. ``ValueWriter.make_row``'s ``value_name``"""
+        result = await session.execute(
+            select(func.count()).select_from(UserValue).where(
+                UserValue.user_id == user_id,
+                UserValue.value_name == name
+            )
+        )
+        return result.scalar_one() > 0
+
+    async def _is_duplicate(self, session, user_id: int, name: str) -> bool:
+        if session is not None:
+            return await self.is_duplicate(session, user_id, name)
+        if self.session_factory is None:
+            return False
+        async with self.session_factory() as session:
+            return await self.is_duplicate(session, user_id, name)
+
+    async def validate(self, description: str, client_ai, user_id: Optional[int] = None, session=None,
+                       name: Optional[str] = None) -> bool:
+        return await self.review(description, client_ai, user_id, session, name) == VALID
+
+    async def review(self, description: str, client_ai, user_id: Optional[int] = None, session=None,
+                     name: Optional[str] = None) -> str:
+        """``VALID``, ``INVALID``, or ``DUPLICATE`` when the user already has a value named ``name``"""
+        reason = self.check_rules(description)
+        if reason is not None:
+            self.stats.rule_rejections += 1
+            logger.info(f"Value rejected without LLM: {reason}")
+            return INVALID
+
+        if user_id is not None and name is not None and await self._is_duplicate(session, user_id, name):
+            self.stats.duplicate_rejections += 1
+            return DUPLICATE
+
+        key = normalize(description)
+        verdict = await self.verdicts.get(key)
+        if verdict is not None:
+            self.stats.cache_hits += 1
+            return VALID if verdict else INVALID
+
+        started = time.perf_counter()
+        try:
+            verdict = await client_ai.request_validation(description, user_id)
+        except Exception as e:
+            # not cached, the next attempt asks the LLM again
+            logger.error(f"Validation error: {e}")
+            return INVALID
+        self.stats.llm_calls += 1
+        self.stats.llm_seconds += time.perf_counter() - started
+        await self.verdicts.set(key, verdict)
+        return VALID if verdict else INVALID
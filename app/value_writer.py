@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, asdict
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+from sqlalchemy.dialects.postgresql import insert
+
+from database import AsyncSessionLocal
+from models import UserValue
+
+logger = logging.getLogger(__name__)
+
+NAME_LENGTH = UserValue.__table__.c.value_name.type.length
+
+_STOP = object()
+
+
+@dataclass
+class ValueWriterStats:
+    rows: int = 0
+    # rows the insert skipped as already stored
+    skipped: int = 0
+    batches: int = 0
+    failed_batches: int = 0
+    failed_rows: int = 0
+    flush_seconds: float = 0.0
+
+    @property
+    def avg_batch(self) -> float:
+        return self.rows / self.batches if self.batches else 0.0
+
+    def snapshot(self) -> dict:
+        return {**asdict(self), "avg_batch": round(self.avg_batch, 1), "flush_seconds": round(self.flush_seconds, 3)}
+
+
+class ValueWriter:
+    """Write-behind buffer for ``UserValue`` rows.
+
+    ``save`` queues a row and waits until the batch holding it is committed,
+    so a returned call is the durability acknowledgement. A background task
+    writes up to ``batch_size`` rows per transaction, or whatever arrived
+    within ``flush_interval`` seconds, as one multi-row INSERT. Rows are
+    checked before they are queued, and a batch inserts one row per
+    (user_id, value_name); the other rows with that key count as skipped. If a batch fails anyway, its rows are
+    retried one per transaction, so only the callers of the rows that fail
+    again get the exception. ``on_commit`` receives the user ids of each
+    committed batch, e.g. to drop cached value lists.
+    """
+
+    def __init__(
+            self,
+            session_factory=None,
+            batch_size: int = 100,
+            flush_interval: float = 0.05,
+            queue_size: int = 10000,
+            on_commit: Optional[Callable[..., Awaitable]] = None
+    ):
+        self.session_factory = session_factory or AsyncSessionLocal
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.on_commit = on_commit
+        self.queue: Optional[asyncio.Queue] = None
+        self.stats = ValueWriterStats()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self.queue = asyncio.Queue(maxsize=self.queue_size)
+            self._task = asyncio.create_task(self._run())
+
+    @staticmethod
+    def make_row(user_id: int, data: dict) -> dict:
+        """The row for a ``save_value`` call; raises ``ValueError`` for one the table would reject"""
+        name, description = data.get("name"), data.get("description")
+        if not isinstance(name, str) or not name.strip():
+            raise ValueError("value name is missing")
+        if not isinstance(description, str) or not description.strip():
+            raise ValueError("value description is missing")
+        return {"user_id": user_id, "value_name": name.strip()[:NAME_LENGTH], "description": description.strip()}
+
+    async def save(self, user_id: int, data: dict) -> bool:
+        """Returns once the row is committed: True, or False if it was skipped as already stored"""
+        self.start()
+        row = self.make_row(user_id, data)
+        done = asyncio.get_running_loop().create_future()
+        await self.queue.put((row, done))
+        return await done
+
+    async def close(self):
+        """Flush everything queued and stop the writer"""
+        if self._task is None:
+            return
+        await self.queue.put(_STOP)
+        await self._task
+        self._task = None
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            batch = [await self.queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and batch[-1] is not _STOP:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            stopping = batch[-1] is _STOP
+            if stopping:
+                batch.pop()
+            await self._flush(batch)
+
+    async def _insert(self, rows: List[dict]) -> set:
+        async with self.session_factory() as session:
+            # executemany of a plain insert is sent as multi-row INSERT ... VALUES;
+            # a value that already exists under a unique index is skipped and not returned
+            result = await session.execute(
+                insert(UserValue).on_conflict_do_nothing().returning(UserValue.user_id, UserValue.value_name),
+                rows
+            )
+            inserted = {tuple(row) for row in result.all()}
+            await session.commit()
+        return inserted
+
+    async def _flush(self, batch: List[Tuple[dict, asyncio.Future]]):
+        if not batch:
+            return
+        # a second row with the same key would come back from RETURNING as the first one's
+        keys = {}
+        for row, _ in batch:
+            keys.setdefault((row["user_id"], row["value_name"]), row)
+        started = time.perf_counter()
+        try:
+            inserted = await self._insert(list(keys.values()))
+        except Exception as e:
+            logger.error(f"Failed to write {len(batch)} values: {e}")
+            self.stats.failed_batches += 1
+            if len(batch) == 1:
+                self.stats.failed_rows += 1
+                if not batch[0][1].done():
+                    batch[0][1].set_exception(e)
+                return
+            # one row per transaction, so a bad row only fails its own caller
+            for item in batch:
+                await self._flush([item])
+            return
+        self.stats.flush_seconds += time.perf_counter() - started
+        self.stats.rows += len(inserted)
+        self.stats.skipped += len(batch) - len(inserted)
+        self.stats.batches += 1
+        if self.on_commit is not None and inserted:
+            try:
+                await self.on_commit(*{user_id for user_id, _ in inserted})
+            except Exception as e:
+                logger.warning(f"on_commit hook failed: {e}")
+        for row, done in batch:
+            if not done.done():
+                key = (row["user_id"], row["value_name"])
+                done.set_result(key in inserted and keys[key] is row)
@@ -0,0 +1,122 @@
+import asyncio
+import base64
+import logging
+from dataclasses import dataclass, asdict
+from io import BytesIO
+from typing import List, Optional, Sequence
+
+from aiogram import Bot
+from aiogram.types import PhotoSize
+
+from audio import BoundedBuffer
+from cache import LRUCache, TieredCache
+from metrics import stage
+
+try:
+    from PIL import Image
+except ImportError:  # downscaling is optional
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+MOODS = ("радость", "грусть", "злость", "нейтральное", "страх", "удивление")
+# OpenAI bills a detail=low image at a flat 85 tokens, high detail adds 170 per 512px tile
+LOW_DETAIL_TOKENS = 85
+
+
+def estimate_image_tokens(width: int, height: int, detail: str = "high") -> int:
+    if detail == "low":
+        return LOW_DETAIL_TOKENS
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = -(-int(width) // 512) * -(-int(height) // 512)
+    return LOW_DETAIL_TOKENS + 170 * tiles
+
+
+def pick_photo(photos: Sequence[PhotoSize], min_side: int = 512) -> PhotoSize:
+    """Smallest size whose shorter side is at least ``min_side``, else the largest one"""
+    ordered = sorted(photos, key=lambda p: p.width * p.height)
+    for photo in ordered:
+        if min(photo.width, photo.height) >= min_side:
+            return photo
+    return ordered[-1]
+
+
+def downscale(data: bytes, max_side: int) -> bytes:
+    if Image is None:
+        return data
+    with Image.open(BytesIO(data)) as image:
+        if max(image.size) <= max_side:
+            return data
+        image.thumbnail((max_side, max_side))
+        out = BytesIO()
+        image.convert("RGB").save(out, format="JPEG", quality=85)
+        return out.getvalue()
+
+
+@dataclass
+class PhotoMoodStats:
+    analyzed: int = 0
+    cache_hits: int = 0
+    image_bytes: int = 0
+    prompt_tokens: int = 0
+
+    def snapshot(self) -> dict:
+        return asdict(self)
+
+
+class PhotoMoodAnalyzer:
+    """Mood of a Telegram photo, sent inline with detail=low and cached by file_unique_id.
+
+    The bot token never leaves the process: the image is downloaded here and
+    passed to OpenAI as a base64 data URL.
+    """
+
+    def __init__(
+            self,
+            redis=None,
+            min_side: int = 512,
+            max_side: int = 512,
+            max_bytes: int = 10 * 1024 * 1024,
+            ttl: int = 30 * 24 * 3600
+    ):
+        self.min_side = min_side
+        self.max_side = max_side
+        self.max_bytes = max_bytes
+        self.cache = TieredCache(
+            redis,
+            prefix="mood",
+            memory=LRUCache(max_items=10000),
+            ttl=ttl,
+            dumps=str.encode,
+            loads=bytes.decode
+        )
+        self.stats = PhotoMoodStats()
+
+    async def image_url(self, bot: Bot, photo: PhotoSize) -> str:
+        buffer = BoundedBuffer(self.max_bytes)
+        with stage("telegram_download"):
+            await bot.download(photo, destination=buffer)
+        data = buffer.getvalue()
+        if max(photo.width, photo.height) > self.max_side:
+            data = await asyncio.to_thread(downscale, data, self.max_side)
+        self.stats.image_bytes += len(data)
+        return f"data:image/jpeg;base64,{base64.b64encode(data).decode()}"
+
+    async def analyze(self, bot: Bot, client_ai, photos: List[PhotoSize], user_id: Optional[int] = None) -> str:
+        photo = pick_photo(photos, self.min_side)
+        mood = await self.cache.get(photo.file_unique_id)
+        if mood is not None:
+            self.stats.cache_hits += 1
+            return mood
+
+        response = await client_ai.mood_completion(await self.image_url(bot, photo), user_id, detail="low")
+        self.stats.analyzed += 1
+        if response.usage is not None:
+            self.stats.prompt_tokens += response.usage.prompt_tokens
+        mood = response.choices[0].message.content.strip()
+        if mood.lower().strip(".") in MOODS:
+            await self.cache.set(photo.file_unique_id, mood)
+        return mood
@@ -0,0 +1,179 @@
+import asyncio
+import hmac
+import logging
+import secrets
+from collections import deque
+from dataclasses import dataclass, asdict
+from typing import Deque, Dict, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+@dataclass
+class WebhookStats:
+    received: int = 0
+    rejected: int = 0
+    overloaded: int = 0
+    processed: int = 0
+    failed: int = 0
+
+    def snapshot(self) -> dict:
+        return asdict(self)
+
+
+def update_key(data: dict) -> int:
+    """Chat (or sender) id of a raw update, the unit whose updates are kept in order"""
+    for name, event in data.items():
+        if name == "update_id" or not isinstance(event, dict):
+            continue
+        chat = event.get("chat") or (event.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+        if event.get("from"):
+            return event["from"]["id"]
+    return data.get("update_id", 0)
+
+
+class WebhookServer:
+    """Receives Telegram updates over HTTP and feeds them to the dispatcher.
+
+    The request is answered as soon as the update is accepted; each update
+    runs ``dp.feed_update`` in a task of its own, so middlewares and routers
+    behave exactly as with polling and one slow chat holds up no other.
+    Within a chat, an update starts once the previous one has finished or
+    has run for ``order_window`` seconds, far enough into its handler to
+    keep the chat's order; a burst still reaches the run coordinator while
+    the first message is waiting, so it can be merged. More than
+    ``queue_size`` updates in flight answer 503 and Telegram redelivers
+    the update later.
+    """
+
+    def __init__(
+            self,
+            dp: Dispatcher,
+            bot: Bot,
+            secret_token: str,
+            path: str = "/webhook",
+            order_window: float = 0.2,
+            queue_size: int = 1000,
+            **kwargs
+    ):
+        if not secret_token:
+            raise ValueError("The webhook needs a secret token, or anyone could post updates to it")
+        self.dp = dp
+        self.bot = bot
+        self.secret_token = secret_token
+        self.path = path
+        self.order_window = order_window
+        self.queue_size = queue_size
+        self.kwargs = kwargs
+        # accepted and not finished
+        self.in_flight = 0
+        # chat -> its updates not yet started, the first one is starting
+        self.chats: Dict[int, Deque[Update]] = {}
+        self.stats = WebhookStats()
+        self._tasks = set()
+        self._runner: Optional[web.AppRunner] = None
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        app.router.add_get("/healthz", self.health)
+        return app
+
+    async def health(self, request: web.Request) -> web.Response:
+        return web.json_response({"in_flight": self.in_flight, "chats": len(self.chats), **self.stats.snapshot()})
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret_token):
+            self.stats.rejected += 1
+            return web.Response(status=401)
+        try:
+            data = await request.json()
+            update = Update.model_validate(data, context={"bot": self.bot})
+        except Exception as e:
+            # a malformed update will not get better on redelivery
+            logger.warning(f"Bad webhook update: {e}")
+            self.stats.rejected += 1
+            return web.Response()
+        if self.in_flight >= self.queue_size:
+            self.stats.overloaded += 1
+            return web.Response(status=503)
+        self.in_flight += 1
+        self.stats.received += 1
+        key = update_key(data)
+        chat = self.chats.get(key)
+        if chat is None:
+            self.chats[key] = deque([update])
+            self._spawn(self._dispatch(key))
+        else:
+            chat.append(update)
+        return web.Response()
+
+    def _spawn(self, coroutine) -> asyncio.Task:
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _dispatch(self, key: int):
+        """Start a chat's updates in order, each after its predecessor finished or had ``order_window`` seconds"""
+        chat = self.chats[key]
+        while chat:
+            task = self._spawn(self._feed(chat[0]))
+            await asyncio.wait({task}, timeout=self.order_window)
+            chat.popleft()
+        del self.chats[key]
+
+    async def _feed(self, update: Update):
+        try:
+            await self.dp.feed_update(self.bot, update, **self.kwargs)
+            self.stats.processed += 1
+        except Exception as e:
+            self.stats.failed += 1
+            logger.error(f"Update {update.update_id} failed: {e}")
+        finally:
+            self.in_flight -= 1
+
+    async def start(self, host: str = "0.0.0.0", port: int = 8080):
+        self._runner = web.AppRunner(self.app())
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logger.info(f"Webhook server listening on {host}:{port}{self.path}")
+
+    async def close(self):
+        """Stop accepting updates, then finish the accepted ones"""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        while self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, url: str, secret_token: str = "", host: str = "0.0.0.0",
+                      port: int = 8080, path: str = "/webhook", order_window: float = 0.2, queue_size: int = 1000):
+    """Serve the webhook until cancelled; without ``secret_token`` a random one is registered with Telegram"""
+    if not secret_token:
+        # fine for one process; replicas behind one URL must share WEBHOOK_SECRET
+        secret_token = secrets.token_urlsafe(32)
+        logger.warning("WEBHOOK_SECRET is not set, registered a random secret token for this process only")
+    server = WebhookServer(dp, bot, secret_token, path, order_window, queue_size)
+    await dp.emit_startup(bot=bot)
+    await server.start(host, port)
+    await bot.set_webhook(
+        url.rstrip("/") + path,
+        secret_token=secret_token,
+        allowed_updates=dp.resolve_used_update_types(),
+        drop_pending_updates=False
+    )
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.close()
+        await dp.emit_shutdown(bot=bot)
@@ -0,0 +1,393 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from dataclasses import dataclass, asdict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.dispatcher.middlewares.base import BaseMiddleware
+from aiogram.types import Update
+from redis.exceptions import ResponseError, WatchError
+
+logger = logging.getLogger(__name__)
+
+
+def job_kind(update: Update) -> Optional[str]:
+    """Kind of job for updates that need the AI backend; None for the cheap ones handled at intake"""
+    message = update.message
+    if message is None:
+        return None
+    if message.voice or message.audio:
+        return "voice"
+    if message.photo:
+        return "photo"
+    if message.text and not message.text.startswith("/"):
+        return "text"
+    return None
+
+
+def default_consumer() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+@dataclass
+class WorkQueueStats:
+    enqueued: int = 0
+    processed: int = 0
+    retried: int = 0
+    reclaimed: int = 0
+    dead_lettered: int = 0
+    # attempts that found steps of an earlier attempt done
+    resumed: int = 0
+    # jobs put back for a while because another job of the same user was running
+    lock_waits: int = 0
+    deferred_released: int = 0
+    # user locks found taken over by the time a heartbeat came to extend them
+    locks_lost: int = 0
+
+    def snapshot(self) -> dict:
+        return asdict(self)
+
+
+class JobProgress:
+    """Steps of one job already done, kept in Redis across its attempts.
+
+    Handlers get it as ``job`` (None outside job workers) and skip a step
+    an earlier attempt finished, such as posting the user's message to the
+    thread or sending the reply, so a retry resumes instead of repeating.
+    """
+
+    def __init__(self, redis, key: str, ttl: int, steps: Optional[Dict[str, str]] = None):
+        self.redis = redis
+        self.key = key
+        self.ttl = ttl
+        self.steps = steps or {}
+
+    def get(self, step: str) -> Optional[str]:
+        return self.steps.get(step)
+
+    async def mark(self, step: str, value: str = "1"):
+        self.steps[step] = value
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hset(self.key, step, value)
+            pipe.expire(self.key, self.ttl)
+            await pipe.execute()
+
+
+class JobQueue:
+    """Jobs in a Redis stream, consumed by a consumer group.
+
+    An entry holds the job ``kind``, the user and chat ids, the raw update
+    and the attempt number. A job is acknowledged after its handler
+    returns. A failed job is re-added with the next attempt number after
+    ``retry_backoff`` seconds, doubled per attempt, up to ``max_attempts``;
+    after that it goes to ``<stream>:dead``. Entries left pending by a
+    crashed worker are claimed by another worker once they have been idle
+    for ``claim_idle_ms``. Progress of a job is kept under
+    ``<stream>:progress:<update_id>`` until it is acknowledged, and a
+    user's jobs run one at a time under ``<stream>:user:<user_id>``, a lock
+    that expires after ``lock_seconds``. While a job runs, its worker
+    renews both the lock and the pending entry with ``heartbeat``. A job
+    whose user is busy goes back to the queue after ``busy_delay`` seconds,
+    and fails once it has waited ``lock_wait_seconds`` in all. Jobs put
+    back wait in the sorted set ``<stream>:delayed`` until they are due.
+    """
+
+    def __init__(
+            self,
+            redis,
+            stream: str = "jobs",
+            group: str = "workers",
+            maxlen: int = 100000,
+            max_attempts: int = 3,
+            claim_idle_ms: int = 60000,
+            lock_seconds: float = 30.0,
+            lock_wait_seconds: float = 120.0,
+            busy_delay: float = 0.5,
+            retry_backoff: float = 5.0,
+            progress_ttl: int = 24 * 3600
+    ):
+        self.redis = redis
+        self.stream = stream
+        self.group = group
+        self.maxlen = maxlen
+        self.max_attempts = max_attempts
+        self.claim_idle_ms = claim_idle_ms
+        self.lock_seconds = lock_seconds
+        self.lock_wait_seconds = lock_wait_seconds
+        self.busy_delay = busy_delay
+        self.retry_backoff = retry_backoff
+        self.progress_ttl = progress_ttl
+        self.stats = WorkQueueStats()
+
+    @property
+    def dead_letter(self) -> str:
+        return f"{self.stream}:dead"
+
+    @property
+    def delayed(self) -> str:
+        return f"{self.stream}:delayed"
+
+    @property
+    def heartbeat_interval(self) -> float:
+        """Seconds between renewals, well inside both the lock's lifetime and the claim idle time"""
+        return min(self.lock_seconds, self.claim_idle_ms / 1000) / 3
+
+    async def ensure_group(self):
+        try:
+            await self.redis.xgroup_create(self.stream, self.group, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def enqueue(self, kind: str, update: Update, attempt: int = 1) -> str:
+        message = update.message
+        fields = {
+            "kind": kind,
+            "user_id": message.from_user.id if message and message.from_user else 0,
+            "chat_id": message.chat.id if message else 0,
+            "update": update.model_dump_json(exclude_none=True, by_alias=True),
+            "attempt": attempt
+        }
+        entry_id = await self.redis.xadd(self.stream, fields, maxlen=self.maxlen, approximate=True)
+        self.stats.enqueued += 1
+        return entry_id
+
+    async def read(self, consumer: str, count: int, block_ms: int = 1000):
+        response = await self.redis.xreadgroup(self.group, consumer, {self.stream: ">"}, count=count, block=block_ms)
+        return response[0][1] if response else []
+
+    async def reclaim(self, consumer: str, count: int):
+        """Entries another consumer took but never acknowledged"""
+        result = await self.redis.xautoclaim(self.stream, self.group, consumer, self.claim_idle_ms,
+                                             start_id="0-0", count=count)
+        entries = [entry for entry in result[1] if entry[1]]
+        self.stats.reclaimed += len(entries)
+        return entries
+
+    async def progress(self, update_id: int) -> JobProgress:
+        key = f"{self.stream}:progress:{update_id}"
+        steps = {k.decode(): v.decode() for k, v in (await self.redis.hgetall(key)).items()}
+        if steps:
+            self.stats.resumed += 1
+        return JobProgress(self.redis, key, self.progress_ttl, steps)
+
+    def _lock_key(self, user_id: int) -> str:
+        return f"{self.stream}:user:{user_id}"
+
+    async def lock_user(self, user_id: int) -> Optional[str]:
+        """Take the user's lock if it is free; returns its token"""
+        token = uuid.uuid4().hex
+        if await self.redis.set(self._lock_key(user_id), token, nx=True, px=int(self.lock_seconds * 1000)):
+            return token
+        return None
+
+    async def heartbeat(self, consumer: str, entry_id, user_id: int = 0, token: Optional[str] = None):
+        """Keep a running job's entry from looking idle to reclaim, and its user lock from expiring"""
+        await self.redis.xclaim(self.stream, self.group, consumer, 0, [entry_id], justid=True)
+        if token is None:
+            return
+        key = self._lock_key(user_id)
+        try:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                await pipe.watch(key)
+                if await pipe.get(key) != token.encode():
+                    self.stats.locks_lost += 1
+                    logger.warning(f"Lock of user {user_id} expired while job {entry_id} was running")
+                    return
+                pipe.multi()
+                pipe.pexpire(key, int(self.lock_seconds * 1000))
+                await pipe.execute()
+        except WatchError:
+            pass
+
+    async def unlock_user(self, user_id: int, token: str):
+        key = self._lock_key(user_id)
+        try:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                await pipe.watch(key)
+                if await pipe.get(key) != token.encode():
+                    # expired, and maybe taken by the next job already
+                    return
+                pipe.multi()
+                pipe.delete(key)
+                await pipe.execute()
+        except WatchError:
+            pass
+
+    async def ack(self, entry_id, progress: Optional[JobProgress] = None):
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.xack(self.stream, self.group, entry_id)
+            pipe.xdel(self.stream, entry_id)
+            if progress is not None:
+                pipe.delete(progress.key)
+            await pipe.execute()
+
+    async def defer(self, entry_id, fields: Dict[bytes, bytes], delay: float, **changes):
+        """Take the entry off the stream and queue it again in ``delay`` seconds, with ``changes`` to its fields"""
+        job = {key.decode(): value.decode() for key, value in fields.items()}
+        job.update({key: str(value) for key, value in changes.items()})
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zadd(self.delayed, {json.dumps(job, sort_keys=True): time.time() + delay})
+            pipe.xack(self.stream, self.group, entry_id)
+            pipe.xdel(self.stream, entry_id)
+            await pipe.execute()
+
+    async def release_due(self, count: int = 100) -> int:
+        """Move deferred jobs that are due back onto the stream; any worker may call it"""
+        try:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                await pipe.watch(self.delayed)
+                due = await pipe.zrangebyscore(self.delayed, 0, time.time(), start=0, num=count)
+                if not due:
+                    return 0
+                pipe.multi()
+                pipe.zrem(self.delayed, *due)
+                for member in due:
+                    pipe.xadd(self.stream, json.loads(member), maxlen=self.maxlen, approximate=True)
+                await pipe.execute()
+        except WatchError:
+            # another worker moved them
+            return 0
+        self.stats.deferred_released += len(due)
+        return len(due)
+
+    async def busy(self, entry_id, fields: Dict[bytes, bytes]) -> bool:
+        """Put back a job whose user is busy; False once it has waited ``lock_wait_seconds``"""
+        waiting_since = float(fields.get(b"waiting_since", time.time()))
+        if time.time() - waiting_since >= self.lock_wait_seconds:
+            return False
+        self.stats.lock_waits += 1
+        await self.defer(entry_id, fields, self.busy_delay, waiting_since=waiting_since)
+        return True
+
+    async def fail(self, entry_id, fields: Dict[bytes, bytes], error: Exception,
+                   progress: Optional[JobProgress] = None):
+        attempt = int(fields[b"attempt"])
+        if attempt < self.max_attempts:
+            self.stats.retried += 1
+            delay = self.retry_backoff * 2 ** (attempt - 1)
+            logger.info(f"Job {entry_id} retried in {delay:.0f}s")
+            retry = dict(fields)
+            retry.pop(b"waiting_since", None)
+            await self.defer(entry_id, retry, delay, attempt=attempt + 1, error=str(error)[:500])
+            return
+        self.stats.dead_lettered += 1
+        logger.error(f"Job {entry_id} dead-lettered after {attempt} attempts: {error}")
+        dead = {key.decode(): value for key, value in fields.items()}
+        dead["attempt"] = attempt + 1
+        dead["error"] = str(error)[:500]
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.xadd(self.dead_letter, dead, maxlen=self.maxlen, approximate=True)
+            pipe.xack(self.stream, self.group, entry_id)
+            pipe.xdel(self.stream, entry_id)
+            if progress is not None:
+                pipe.delete(progress.key)
+            await pipe.execute()
+
+
+class IntakeMiddleware(BaseMiddleware):
+    """Outer update middleware for intake processes: AI jobs go to the queue, the rest is handled here"""
+
+    def __init__(self, queue: JobQueue):
+        super().__init__()
+        self.queue = queue
+
+    async def __call__(self, handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]], event: Update,
+                       data: Dict[str, Any]):
+        kind = job_kind(event)
+        if kind is None:
+            return await handler(event, data)
+        await self.queue.enqueue(kind, event)
+
+
+class JobWorker:
+    """Feeds queued updates to a dispatcher, ``concurrency`` at a time.
+
+    The dispatcher carries the usual router and ``ContextMiddleware``, so
+    handlers run exactly as in a single process and reply through the Bot API;
+    they also get the job's ``JobProgress`` as ``job``. ``stop`` lets the
+    jobs in hand finish and ends ``run``.
+    """
+
+    def __init__(self, queue: JobQueue, dp: Dispatcher, bot: Bot, consumer: Optional[str] = None,
+                 concurrency: int = 16):
+        self.queue = queue
+        self.dp = dp
+        self.bot = bot
+        self.consumer = consumer or default_consumer()
+        self.concurrency = concurrency
+        self._slots = asyncio.Semaphore(concurrency)
+        self._tasks = set()
+        # entry ids being processed here; a long job can look idle to reclaim
+        self._in_hand = set()
+        self._stopping = asyncio.Event()
+
+    async def _process(self, entry_id, fields: Dict[bytes, bytes]):
+        user_id = int(fields.get(b"user_id", 0))
+        progress = token = heartbeat = None
+        try:
+            if user_id:
+                # the user's thread takes one run at a time, whichever worker has the job
+                token = await self.queue.lock_user(user_id)
+                if token is None:
+                    if await self.queue.busy(entry_id, fields):
+                        return
+                    raise RuntimeError(f"user {user_id} was busy with another job for too long")
+            heartbeat = asyncio.create_task(self._heartbeat(entry_id, user_id, token))
+            update = Update.model_validate(json.loads(fields[b"update"]), context={"bot": self.bot})
+            progress = await self.queue.progress(update.update_id)
+            await self.dp.feed_update(self.bot, update, job=progress)
+        except Exception as e:
+            logger.warning(f"Job {entry_id} failed: {e}")
+            await self.queue.fail(entry_id, fields, e, progress)
+        else:
+            await self.queue.ack(entry_id, progress)
+            self.queue.stats.processed += 1
+        finally:
+            if heartbeat is not None:
+                heartbeat.cancel()
+            if token is not None:
+                await self.queue.unlock_user(user_id, token)
+            self._in_hand.discard(entry_id)
+            self._slots.release()
+
+    async def _heartbeat(self, entry_id, user_id: int, token: Optional[str]):
+        while True:
+            await asyncio.sleep(self.queue.heartbeat_interval)
+            try:
+                await self.queue.heartbeat(self.consumer, entry_id, user_id, token)
+            except Exception as e:
+                logger.warning(f"Heartbeat of job {entry_id} failed: {e}")
+
+    async def _spawn(self, entries):
+        for entry_id, fields in entries:
+            if entry_id in self._in_hand:
+                continue
+            self._in_hand.add(entry_id)
+            await self._slots.acquire()
+            task = asyncio.create_task(self._process(entry_id, fields))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def run(self):
+        await self.queue.ensure_group()
+        logger.info(f"Worker {self.consumer} consuming {self.queue.stream}")
+        next_claim = 0.0
+        loop = asyncio.get_running_loop()
+        while not self._stopping.is_set():
+            free = max(1, self.concurrency - len(self._tasks))
+            await self.queue.release_due(free)
+            if loop.time() >= next_claim:
+                await self._spawn(await self.queue.reclaim(self.consumer, free))
+                next_claim = loop.time() + self.queue.claim_idle_ms / 2000
+            await self._spawn(await self.queue.read(self.consumer, free))
+        if self._tasks:
+            await asyncio.gather(*self._tasks)
+
+    def stop(self):
+        self._stopping.set()